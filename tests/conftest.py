@@ -0,0 +1,72 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Unit test setup
+
+Addon modules are imported with the stub Kodi modules of the stress harness.
+The addon profile and settings are in a temporary directory.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+ADDON_DIR = ROOT_DIR / 'weather.open-meteo.lite'
+
+sys.path.insert(0, str(ROOT_DIR / 'tools'))
+
+from stress_harness import DEFAULT_SETTINGS, STUB_MODULES  # pylint: disable=wrong-import-position
+
+WORK_DIR = Path(tempfile.mkdtemp(prefix='omlite-tests-'))
+STUBS_DIR = WORK_DIR / 'stubs'
+PROFILE_DIR = WORK_DIR / 'profile'
+SETTINGS_FILE = WORK_DIR / 'settings.json'
+
+STUBS_DIR.mkdir()
+PROFILE_DIR.mkdir()
+for file_name, source in STUB_MODULES.items():
+    (STUBS_DIR / file_name).write_text(source.lstrip(), encoding='utf-8')
+SETTINGS_FILE.write_text(json.dumps(DEFAULT_SETTINGS), encoding='utf-8')
+os.environ.update(HARNESS_ADDON_DIR=str(ADDON_DIR),
+                  HARNESS_PROFILE=str(PROFILE_DIR),
+                  HARNESS_SETTINGS=str(SETTINGS_FILE),
+                  # Tests must not call the API
+                  HARNESS_API_URL='http://127.0.0.1:9')
+sys.path[:0] = [str(STUBS_DIR), str(ADDON_DIR)]
+
+
+def pytest_sessionfinish(session, exitstatus):  # pylint: disable=unused-argument
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def set_settings():
+    """
+    Set addon settings for a test
+
+    Settings are written to the settings file that the stub ``Addon`` reads,
+    and the default settings are restored after a test.
+    """
+    def _set_settings(**kwargs):
+        SETTINGS_FILE.write_text(json.dumps(dict(DEFAULT_SETTINGS, **kwargs)), encoding='utf-8')
+
+    yield _set_settings
+    SETTINGS_FILE.write_text(json.dumps(DEFAULT_SETTINGS), encoding='utf-8')
@@ -0,0 +1,92 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for sun and moon calculations"""
+
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from libs.astronomy import JULIAN_DAY_OFFSET, get_astronomy, get_moon_phase, get_tzinfo
+
+
+def _get_minutes_difference(actual: str, expected: str) -> float:
+    time_format = '%Y-%m-%dT%H:%M'
+    return abs((datetime.strptime(actual, time_format)
+                - datetime.strptime(expected, time_format)).total_seconds()) / 60
+
+
+@pytest.mark.parametrize('latitude, longitude, timezone_name, utc_offset, day, sunrise, sunset', [
+    (51.5074, -0.1278, 'Europe/London', 3600, '2024-06-21', '2024-06-21T04:43', '2024-06-21T21:21'),
+    (51.4769, 0.0, 'UTC', 0, '2024-03-20', '2024-03-20T06:02', '2024-03-20T18:13'),
+    (-33.87, 151.21, 'Australia/Sydney', 39600, '2024-12-21',
+     '2024-12-21T05:41', '2024-12-21T20:05'),
+])
+def test_sunrise_and_sunset(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        latitude, longitude, timezone_name, utc_offset, day, sunrise, sunset):
+    tz = get_tzinfo(timezone_name, utc_offset)
+    astronomy_info = get_astronomy(latitude, longitude, tz, day, 1)
+    assert astronomy_info['time'] == [day]
+    assert _get_minutes_difference(astronomy_info['sunrise'][0], sunrise) <= 2
+    assert _get_minutes_difference(astronomy_info['sunset'][0], sunset) <= 2
+    assert astronomy_info['golden_hour_morning_end'][0] > astronomy_info['sunrise'][0]
+    assert astronomy_info['golden_hour_evening_start'][0] < astronomy_info['sunset'][0]
+
+
+def test_day_length_matches_sunrise_and_sunset():
+    astronomy_info = get_astronomy(50.45, 30.52, timezone.utc, '2024-01-01', 30)
+    for sunrise, sunset, day_length in zip(astronomy_info['sunrise'], astronomy_info['sunset'],
+                                           astronomy_info['day_length']):
+        assert abs(_get_minutes_difference(sunset, sunrise) - day_length / 60) <= 1
+
+
+def test_polar_day_and_night():
+    tz = get_tzinfo('Europe/Oslo', 3600)
+    polar_day = get_astronomy(69.65, 18.96, tz, '2024-06-21', 1)
+    assert polar_day['sunrise'] == polar_day['sunset'] == [None]
+    assert polar_day['day_length'] == [86400]
+    polar_night = get_astronomy(69.65, 18.96, tz, '2024-12-21', 1)
+    assert polar_night['sunrise'] == polar_night['sunset'] == [None]
+    assert polar_night['golden_hour_morning_end'] == [None]
+    assert polar_night['day_length'] == [0]
+
+
+def test_unknown_timezone_uses_utc_offset():
+    tz = get_tzinfo('Unknown/Timezone', 7200)
+    assert tz.utcoffset(datetime(2024, 1, 1)) == timedelta(hours=2)
+
+
+@pytest.mark.parametrize('moment, expected_phase', [
+    # Full moon
+    (datetime(2024, 6, 22, 1, 8), 0.5),
+    # New moon
+    (datetime(2024, 7, 5, 22, 57), 0.0),
+    # First quarter
+    (datetime(2024, 7, 13, 22, 49), 0.25),
+])
+def test_moon_phase(moment, expected_phase):
+    julian_day = (date(moment.year, moment.month, moment.day).toordinal() + JULIAN_DAY_OFFSET
+                  + (moment.hour * 60 + moment.minute) / 1440)
+    phase = get_moon_phase(julian_day)
+    # The mean synodic month differs from actual lunations by up to ~14 hours
+    assert min(abs(phase - expected_phase), 1 - abs(phase - expected_phase)) < 0.03
+
+
+def test_moon_illumination():
+    astronomy_info = get_astronomy(50.45, 30.52, timezone.utc, '2024-06-22', 14)
+    illumination = astronomy_info['moon_illumination']
+    # The moon wanes from the full moon on 2024-06-22 to the new moon on 2024-07-05
+    assert illumination == sorted(illumination, reverse=True)
+    assert illumination[0] > 0.99
+    assert illumination[-1] < 0.02
@@ -0,0 +1,118 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for multi-model forecast aggregation"""
+
+import pytest
+
+from libs.ensemble import MAX_TEMPERATURE_SPREAD, aggregate_models, parse_models
+
+MODELS = ['icon_seamless', 'gfs_seamless', 'ecmwf_ifs025']
+
+
+def _make_section(times, **variables):
+    section = {'time': times}
+    for variable, columns in variables.items():
+        for model, column in zip(MODELS, columns):
+            section[f'{variable}_{model}'] = column
+    return section
+
+
+def test_parse_models():
+    assert parse_models(' icon_seamless, gfs_seamless,,icon_seamless ') == [
+        'icon_seamless', 'gfs_seamless']
+    assert not parse_models('')
+
+
+def test_median_and_spread():
+    forecast_info = {'hourly': _make_section(
+        ['2024-06-01T00:00', '2024-06-01T01:00'],
+        temperature_2m=[[10.0, 20.0], [12.0, 19.0], [17.0, 15.0]],
+        relative_humidity_2m=[[50, 60], [55, 61], [70, 65]],
+    )}
+    hourly_info = aggregate_models(forecast_info, MODELS)['hourly']
+    assert hourly_info['temperature_2m'] == [12.0, 19.0]
+    assert hourly_info['temperature_2m_spread'] == [7.0, 5.0]
+    assert hourly_info['relative_humidity_2m'] == [55, 61]
+    assert not any(key.endswith(MODELS[0]) for key in hourly_info)
+
+
+def test_median_of_even_number_of_models_keeps_integers():
+    forecast_info = {'hourly': _make_section(
+        ['2024-06-01T00:00'],
+        temperature_2m=[[10.0], [13.0]],
+        relative_humidity_2m=[[50], [55]],
+    )}
+    hourly_info = aggregate_models(forecast_info, MODELS[:2])['hourly']
+    assert hourly_info['temperature_2m'] == [11.5]
+    assert hourly_info['relative_humidity_2m'] == [52]
+
+
+def test_wind_direction_circular_mean():
+    forecast_info = {'hourly': _make_section(
+        ['2024-06-01T00:00', '2024-06-01T01:00'],
+        wind_direction_10m=[[350, 90], [10, 180], [0, 270]],
+    )}
+    hourly_info = aggregate_models(forecast_info, MODELS)['hourly']
+    assert hourly_info['wind_direction_10m'] == [0, 180]
+
+
+def test_weather_code_majority_and_confidence():
+    forecast_info = {'hourly': _make_section(
+        ['2024-06-01T00:00', '2024-06-01T01:00'],
+        weather_code=[[61, 3], [61, 2], [3, 1]],
+        temperature_2m=[[10.0, 10.0], [10.0, 12.0], [10.0, 18.0]],
+    )}
+    hourly_info = aggregate_models(forecast_info, MODELS)['hourly']
+    assert hourly_info['weather_code'] == [61, 3]
+    assert hourly_info['weather_code_agreement'] == pytest.approx([2 / 3, 1 / 3])
+    assert hourly_info['confidence'] == pytest.approx(
+        [2 / 3, 1 / 3 * (1 - 8.0 / MAX_TEMPERATURE_SPREAD)])
+
+
+def test_models_without_variable_are_ignored():
+    forecast_info = {'hourly': _make_section(
+        ['2024-06-01T00:00', '2024-06-01T01:00'],
+        temperature_2m=[[10.0, 11.0], [None, None], [14.0, 15.0]],
+        weather_code=[[1, 2], [None, None], [1, 3]],
+    )}
+    hourly_info = aggregate_models(forecast_info, MODELS)['hourly']
+    assert hourly_info['temperature_2m'] == [12.0, 13.0]
+    assert hourly_info['weather_code_agreement'] == [1.0, 0.5]
+
+
+def test_series_are_cut_beyond_forecast_horizon():
+    forecast_info = {'hourly': _make_section(
+        ['2024-06-01T00:00', '2024-06-01T01:00', '2024-06-01T02:00'],
+        temperature_2m=[[10.0, None, None], [12.0, 13.0, None], [14.0, 15.0, None]],
+        weather_code=[[1, 2, None], [1, 2, None], [1, 2, None]],
+    )}
+    hourly_info = aggregate_models(forecast_info, MODELS)['hourly']
+    assert hourly_info['time'] == ['2024-06-01T00:00', '2024-06-01T01:00']
+    assert hourly_info['temperature_2m'] == [12.0, 14.0]
+    assert hourly_info['temperature_2m_spread'] == [4.0, 2.0]
+    assert hourly_info['weather_code'] == [1, 2]
+
+
+def test_current_values_are_filled_from_first_hour():
+    forecast_info = {
+        'current': {'time': '2024-06-01T00:00', 'temperature_2m_icon_seamless': 10.0,
+                    'temperature_2m_gfs_seamless': 12.0, 'uv_index_icon_seamless': None,
+                    'uv_index_gfs_seamless': None},
+        'hourly': _make_section(['2024-06-01T00:00'], uv_index=[[3.0], [5.0]]),
+    }
+    current_info = aggregate_models(forecast_info, MODELS[:2])['current']
+    assert current_info['temperature_2m'] == 11.0
+    assert current_info['uv_index'] == 4.0
+    assert current_info['time'] == '2024-06-01T00:00'
@@ -0,0 +1,126 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for exception diagnostics"""
+
+import re
+
+import pytest
+
+from libs.common.exception_logger import (
+    DEFAULT_BUDGET,
+    DiagnosticsBudget,
+    catch_exception,
+    format_exception,
+)
+
+
+def _recurse(depth: int) -> None:
+    if depth <= 1:
+        raise RuntimeError('Deep error')
+    _recurse(depth - 1)
+
+
+def _get_exception(func, *args) -> Exception:
+    try:
+        func(*args)
+    except Exception as exc:  # pylint: disable=broad-except
+        return exc
+    raise AssertionError('No exception raised')
+
+
+def _count_frames(message: str) -> int:
+    return message.count('\nFile:\n')
+
+
+def test_frames_are_limited():
+    # 49 recursive calls plus the frame of _get_exception
+    exc = _get_exception(_recurse, 49)
+    message = format_exception(exc, DEFAULT_BUDGET)
+    assert _count_frames(message) == DEFAULT_BUDGET.max_frames
+    assert f'... {50 - DEFAULT_BUDGET.max_frames} outer frames omitted' in message
+    # The innermost frame is kept
+    assert "raise RuntimeError('Deep error')" in message
+
+
+def test_short_stack_trace_is_not_cut():
+    exc = _get_exception(_recurse, 2)
+    message = format_exception(exc, DEFAULT_BUDGET)
+    assert _count_frames(message) == 3
+    assert 'outer frames omitted' not in message
+
+
+def test_full_diagnostics_are_not_limited():
+    exc = _get_exception(_recurse, 49)
+    message = format_exception(exc)
+    assert _count_frames(message) == 50
+    assert 'outer frames omitted' not in message
+
+
+def _raise_with_locals():
+    values = {f'var_{i:02}': i for i in range(30)}
+    long_value = 'x' * 10000  # pylint: disable=unused-variable
+    raise ValueError(str(len(values)))
+
+
+def test_locals_are_limited():
+    exc = _get_exception(_raise_with_locals)
+    budget = DiagnosticsBudget(max_locals=1, max_value_length=50)
+    message = format_exception(exc, budget)
+    # Variables are sorted by name
+    assert re.search(r"long_value = 'x{45,50}\.\.\.\n\.\.\. 1 more variables omitted\n", message)
+    assert 'values = ' not in message
+    assert 'x' * 100 not in message
+
+
+def test_size_is_limited():
+    exc = _get_exception(_recurse, 49)
+    budget = DiagnosticsBudget(max_size=2000)
+    stack_trace = format_exception(exc, budget).split('Stack Trace')[1]
+    assert len(stack_trace) < 2000 + 1000
+    assert 0 < _count_frames(stack_trace) < budget.max_frames
+    assert 'outer frames omitted' in stack_trace
+
+
+def _raise_error(message: str):
+    raise RuntimeError(message)
+
+
+def _catch_and_log(message: str, **kwargs):
+    log_calls = []
+
+    def log(msg, *args):
+        log_calls.append(msg % args if args else msg)
+
+    with pytest.raises(RuntimeError):
+        with catch_exception(logger_func=log, **kwargs):
+            _raise_error(message)
+    return log_calls
+
+
+def test_repeated_exceptions_are_logged_as_single_line():
+    first_log = _catch_and_log('Repeated error')
+    assert 'Exception Diagnostic Info' in first_log[0]
+    repeated_log = _catch_and_log('Repeated error')
+    assert len(repeated_log) == 1
+    assert repeated_log[0].startswith('Repeated unhandled exception RuntimeError: Repeated error')
+    # Other exceptions and full diagnostics are not deduplicated
+    assert 'Exception Diagnostic Info' in _catch_and_log('Another error')[0]
+    assert 'Exception Diagnostic Info' in _catch_and_log('Repeated error',
+                                                         full_diagnostics=True)[0]
+
+
+def test_exceptions_are_logged_again_after_dedup_window():
+    assert 'Exception Diagnostic Info' in _catch_and_log('Error with window', dedup_seconds=0)[0]
+    assert 'Exception Diagnostic Info' in _catch_and_log('Error with window', dedup_seconds=0)[0]
@@ -0,0 +1,110 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for forecast snapshots"""
+
+import json
+import os
+
+from libs.forecast_snapshot import (
+    SnapshotReader,
+    get_rows,
+    load_snapshot,
+    write_current_location,
+    write_snapshot,
+)
+
+KYIV = (50.45, 30.52, 'Europe/Kyiv')
+PARIS = (48.85, 2.35, 'Europe/Paris')
+
+PROPERTIES = {
+    'Current.Temperature': '21',
+    'Hourly.2.Time': '15:00',
+    'Hourly.1.Time': '14:00',
+    'Hourly.1.Temperature': '20',
+    'Daily.1.ShortDay': 'Mon',
+}
+
+
+def test_sequence_is_incremented(tmp_path):
+    write_snapshot(tmp_path, 'location1', 'Kyiv', PROPERTIES, KYIV)
+    write_snapshot(tmp_path, 'location1', 'Kyiv', PROPERTIES, KYIV)
+    write_snapshot(tmp_path, 'location2', 'Paris', PROPERTIES, PARIS)
+    assert load_snapshot(tmp_path / 'location1.json')['sequence'] == 2
+    assert load_snapshot(tmp_path / 'location2.json')['sequence'] == 1
+    assert not list(tmp_path.glob('.*.tmp'))
+
+
+def test_reader_skips_unchanged_snapshots(tmp_path):
+    reader = SnapshotReader(tmp_path, 'location1')
+    assert reader.read() is None
+    write_snapshot(tmp_path, 'location1', 'Kyiv', PROPERTIES, KYIV)
+    snapshot = reader.read()
+    assert snapshot['sequence'] == 1
+    assert snapshot['location'] == 'Kyiv'
+    assert (snapshot['latitude'], snapshot['longitude'], snapshot['timezone']) == KYIV
+    assert reader.read() is None
+    write_snapshot(tmp_path, 'location1', 'Kyiv', {'Current.Temperature': '22'}, KYIV)
+    snapshot = reader.read()
+    assert snapshot['sequence'] == 2
+    assert snapshot['properties'] == {'Current.Temperature': '22'}
+    assert reader.read() is None
+
+
+def test_reader_skips_touched_snapshot_with_same_sequence(tmp_path):
+    write_snapshot(tmp_path, 'location1', 'Kyiv', PROPERTIES, KYIV)
+    reader = SnapshotReader(tmp_path, 'location1')
+    assert reader.read() is not None
+    snapshot_path = tmp_path / 'location1.json'
+    stat = snapshot_path.stat()
+    os.utime(snapshot_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert reader.read() is None
+
+
+def test_reader_follows_current_location(tmp_path):
+    write_snapshot(tmp_path, 'location1', 'Kyiv', PROPERTIES, KYIV)
+    write_snapshot(tmp_path, 'location2', 'Paris', PROPERTIES, PARIS)
+    write_current_location(tmp_path, 'location1')
+    reader = SnapshotReader(tmp_path)
+    assert reader.read()['location'] == 'Kyiv'
+    # A background pre-fetch for another location does not change the current one
+    write_snapshot(tmp_path, 'location2', 'Paris', PROPERTIES, PARIS)
+    assert reader.read() is None
+    write_current_location(tmp_path, 'location2')
+    assert reader.read()['location'] == 'Paris'
+
+
+def test_reader_falls_back_to_latest_snapshot(tmp_path):
+    write_snapshot(tmp_path, 'location1', 'Kyiv', PROPERTIES, KYIV)
+    write_snapshot(tmp_path, 'location2', 'Paris', PROPERTIES, PARIS)
+    location1_path = tmp_path / 'location1.json'
+    stat = location1_path.stat()
+    os.utime(location1_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert SnapshotReader(tmp_path).read()['location'] == 'Kyiv'
+
+
+def test_unsupported_version_is_ignored(tmp_path):
+    (tmp_path / 'location1.json').write_text(
+        json.dumps({'version': 0, 'sequence': 1, 'properties': {}}), encoding='utf-8')
+    assert SnapshotReader(tmp_path, 'location1').read() is None
+    write_snapshot(tmp_path, 'location1', 'Kyiv', PROPERTIES, KYIV)
+    assert load_snapshot(tmp_path / 'location1.json')['sequence'] == 1
+
+
+def test_get_rows():
+    snapshot = {'properties': PROPERTIES}
+    assert get_rows(snapshot, 'Hourly') == [{'Time': '14:00', 'Temperature': '20'},
+                                           {'Time': '15:00'}]
+    assert get_rows(snapshot, 'Daily') == [{'ShortDay': 'Mon'}]
+    assert not get_rows(snapshot, 'Weekly')
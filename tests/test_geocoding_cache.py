@@ -0,0 +1,141 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the geocoding cache"""
+
+import time
+
+import pytest
+
+from libs import open_meteo_api
+from libs.common.kodi_service import (
+    cache_json,
+    get_cache_file,
+    load_json_cache,
+    save_json_cache,
+)
+from libs.open_meteo_api import (
+    GEOCODING_RESULTS_COUNT,
+    normalize_location_query,
+    search_location,
+)
+
+LOCATIONS = [
+    {'name': 'London', 'country': 'United Kingdom'},
+    {'name': 'Londonderry', 'country': 'United Kingdom'},
+    {'name': 'Longyearbyen', 'country': 'Norway'},
+    {'name': 'Łódź', 'country': 'Poland'},
+]
+
+
+class FakeGeocodingApi:  # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.queries = []
+        self.is_available = True
+
+    def __call__(self, url, params):
+        if not self.is_available:
+            raise open_meteo_api.requests.ConnectionError('API is not available')
+        self.queries.append(params['name'])
+        query = normalize_location_query(params['name'])
+        results = [location_info for location_info in LOCATIONS
+                   if normalize_location_query(location_info['name']).startswith(query)]
+        return {'results': results} if results else {}
+
+
+@pytest.fixture(name='geocoding_api')
+def fixture_geocoding_api(monkeypatch):
+    get_cache_file('search_location').unlink(missing_ok=True)
+    fake_api = FakeGeocodingApi()
+    monkeypatch.setattr(open_meteo_api, '_call_api', fake_api)
+    yield fake_api
+    get_cache_file('search_location').unlink(missing_ok=True)
+
+
+def test_normalize_location_query():
+    assert (normalize_location_query('Kraków')
+            == normalize_location_query(' krakow')
+            == normalize_location_query('KRAKOW ')
+            == 'krakow')
+    assert normalize_location_query('New   York') == 'new york'
+
+
+def test_normalized_queries_share_cache_entry(geocoding_api):
+    assert search_location('London') == LOCATIONS[:2]
+    assert search_location(' LONDON ') == LOCATIONS[:2]
+    assert geocoding_api.queries == ['London']
+
+
+def test_longer_query_is_answered_from_prefix_results(geocoding_api):
+    assert search_location('Lon') == LOCATIONS[:3]
+    assert search_location('Londonde') == [LOCATIONS[1]]
+    assert search_location('longyear') == [LOCATIONS[2]]
+    assert geocoding_api.queries == ['Lon']
+    assert set(load_json_cache('search_location')) == {'lon', 'londonde', 'longyear'}
+
+
+def test_prefix_results_without_matches_are_not_used(geocoding_api):
+    search_location('Lon')
+    # Fuzzy API search may find locations that do not start with the query
+    assert search_location('Lond0n') is None
+    assert geocoding_api.queries == ['Lon', 'Lond0n']
+
+
+def test_short_and_truncated_prefix_results_are_not_used(geocoding_api):
+    search_location('Lo')
+    search_location('Lon')
+    assert geocoding_api.queries == ['Lo', 'Lon']
+    # Results that hit the API limit may miss matching locations
+    cache = load_json_cache('search_location')
+    cache['lon']['data'] = (LOCATIONS[:3] * GEOCODING_RESULTS_COUNT)[:GEOCODING_RESULTS_COUNT]
+    save_json_cache('search_location', cache)
+    search_location('London')
+    assert geocoding_api.queries == ['Lo', 'Lon', 'London']
+
+
+def test_expired_results_are_used_on_api_error(geocoding_api):
+    search_location('London')
+    cache = load_json_cache('search_location')
+    cache['london']['timestamp'] = 0
+    save_json_cache('search_location', cache)
+    geocoding_api.is_available = False
+    assert search_location('London') == LOCATIONS[:2]
+    with pytest.raises(open_meteo_api.requests.ConnectionError):
+        search_location('Paris')
+
+
+def test_max_entries_evicts_least_recently_written_entries():
+    calls = []
+
+    @cache_json(ttl_minutes=1, max_entries=3, key_func=str)
+    def cached_function(value):
+        calls.append(value)
+        return value * 2
+
+    get_cache_file('cached_function').unlink(missing_ok=True)
+    try:
+        for value in (1, 2, 3, 1, 4):
+            assert cached_function(value) == value * 2
+        assert calls == [1, 2, 3, 4]
+        assert list(load_json_cache('cached_function')) == ['2', '3', '4']
+        # Expired entries are refreshed and become the most recently written ones
+        cache = load_json_cache('cached_function')
+        cache['2']['timestamp'] = int(time.time()) - 120
+        save_json_cache('cached_function', cache)
+        cached_function(2)
+        cached_function(5)
+        assert list(load_json_cache('cached_function')) == ['4', '2', '5']
+    finally:
+        get_cache_file('cached_function').unlink(missing_ok=True)
@@ -0,0 +1,117 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the LAN cache"""
+
+import threading
+import time
+
+import pytest
+
+from libs import lan_cache
+from libs.lan_cache import CoalescingCache, LanCacheServer, parse_allowed_clients
+
+
+def test_fresh_entries_are_returned_from_cache():
+    cache = CoalescingCache()
+    assert cache.get('a', 60, lambda: 1) == 1
+    assert cache.get('a', 60, lambda: 2) == 1
+    assert cache.get('b', 0, lambda: 3) == 3
+    assert cache.get('b', 60, lambda: 4) == 4
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = CoalescingCache(max_entries=3)
+    for key in 'abc':
+        cache.get(key, 60, lambda key=key: key)
+    # A cache hit makes "a" the most recently used entry
+    cache.get('a', 60, lambda: None)
+    cache.get('d', 60, lambda: 'd')
+    assert len(cache) == 3
+    assert cache.get('b', 60, lambda: 'new b') == 'new b'
+    assert cache.get('a', 60, lambda: 'new a') == 'a'
+
+
+def test_expired_entries_are_removed(monkeypatch):
+    cache = CoalescingCache()
+    cache.get('a', 10, lambda: 'a')
+    cache.get('b', 100, lambda: 'b')
+    now = time.time() + 50
+    monkeypatch.setattr(lan_cache.time, 'time', lambda: now)
+    cache.get('c', 100, lambda: 'c')
+    assert len(cache) == 2
+
+
+def test_concurrent_requests_are_coalesced():
+    cache = CoalescingCache()
+    fetch_started = threading.Event()
+    release_fetch = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(threading.get_ident())
+        fetch_started.set()
+        release_fetch.wait(5)
+        return 'data'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('key', 60, fetch)))
+               for _ in range(5)]
+    threads[0].start()
+    fetch_started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release_fetch.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == ['data'] * 5
+    assert len(calls) == 1
+    # Per-key locks are released when nobody uses them
+    assert not cache._key_locks  # pylint: disable=protected-access
+
+
+def test_failed_fetch_releases_key_lock():
+    cache = CoalescingCache()
+
+    def fetch():
+        raise OSError('API is not available')
+
+    with pytest.raises(OSError):
+        cache.get('key', 60, fetch)
+    assert not cache._key_locks  # pylint: disable=protected-access
+    assert cache.get('key', 60, lambda: 'data') == 'data'
+
+
+def test_parse_allowed_clients():
+    networks = parse_allowed_clients(' 192.168.1.0/24, 10.0.0.5,, invalid, fd00::/8')
+    assert [str(network) for network in networks] == [
+        '192.168.1.0/24', '10.0.0.5/32', 'fd00::/8']
+
+
+@pytest.mark.parametrize('allowed_clients, address, is_allowed', [
+    ('', '192.168.1.10', True),
+    ('', '127.0.0.1', True),
+    ('', '::ffff:10.0.0.1', True),
+    ('', '8.8.8.8', False),
+    ('192.168.1.0/24', '192.168.1.10', True),
+    ('192.168.1.0/24', '192.168.2.10', False),
+    ('192.168.1.0/24', '::ffff:192.168.1.10', True),
+    ('8.8.8.8', '8.8.8.8', True),
+])
+def test_verify_request(allowed_clients, address, is_allowed):
+    server = LanCacheServer(0, parse_allowed_clients(allowed_clients))
+    try:
+        assert server.verify_request(None, (address, 12345)) is is_allowed
+    finally:
+        server.server_close()
@@ -0,0 +1,196 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for forecast refresh scheduling"""
+
+import calendar
+import copy
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from libs import refresh_scheduler
+from libs.refresh_scheduler import (
+    DEFAULT_CURRENT_INTERVAL_SECONDS,
+    MAX_TTL_MINUTES,
+    MIN_TTL_MINUTES,
+    get_forecast_ttl_minutes,
+    get_minutes_until_current_update,
+    get_minutes_until_model_update,
+    get_volatility,
+    shift_to_current_hour,
+)
+
+UTC_OFFSET_SECONDS = 3 * 3600
+
+
+def _make_api_response(hours):
+    return {
+        'utc_offset_seconds': UTC_OFFSET_SECONDS,
+        'current': {'time': '2024-06-01T10:15', 'temperature_2m': 15.0, 'weather_code': 1,
+                    'interval': 900},
+        'hourly': {
+            'time': [(datetime(2024, 6, 1, 10) + timedelta(hours=hour)).strftime('%Y-%m-%dT%H:%M')
+                     for hour in range(hours)],
+            'temperature_2m': [float(hour) for hour in range(10, 10 + hours)],
+            'weather_code': [hour % 4 for hour in range(10, 10 + hours)],
+        },
+        'daily': {
+            'time': ['2024-06-01', '2024-06-02', '2024-06-03'],
+            'temperature_2m_max': [21.0, 22.0, 23.0],
+        },
+    }
+
+
+def _get_timestamp(local_time: str) -> float:
+    return calendar.timegm(time.strptime(local_time, '%Y-%m-%dT%H:%M')) - UTC_OFFSET_SECONDS
+
+
+def _make_hourly_info(precipitation_probability=None, weather_code=None, wind_speed=None):
+    return {
+        'precipitation_probability': precipitation_probability or [10] * 12,
+        'weather_code': weather_code or [1] * 12,
+        'wind_speed_10m': wind_speed or [5.0] * 12,
+    }
+
+
+def _make_forecast_info(current_time: str, interval: int = 900, **hourly_series):
+    return {
+        'utc_offset_seconds': UTC_OFFSET_SECONDS,
+        'current': {'time': current_time, 'interval': interval},
+        'hourly': _make_hourly_info(**hourly_series),
+    }
+
+
+@pytest.mark.parametrize('utc_time, expected_minutes', [
+    # Model runs start every 3 hours and become available 2 hours later
+    ('2024-06-01T00:00', 120),
+    ('2024-06-01T02:00', 180),
+    ('2024-06-01T02:30', 150),
+    ('2024-06-01T04:59', 1),
+])
+def test_minutes_until_model_update(utc_time, expected_minutes):
+    now = calendar.timegm(time.strptime(utc_time, '%Y-%m-%dT%H:%M'))
+    assert get_minutes_until_model_update(now) == pytest.approx(expected_minutes)
+
+
+def test_minutes_until_current_update():
+    forecast_info = _make_forecast_info('2024-06-01T12:00')
+    assert get_minutes_until_current_update(
+        forecast_info, _get_timestamp('2024-06-01T12:05')) == pytest.approx(10)
+    # Outdated current conditions are expected to be updated within an interval
+    assert get_minutes_until_current_update(
+        forecast_info, _get_timestamp('2024-06-01T13:00')) == pytest.approx(15)
+    del forecast_info['current']['interval']
+    assert get_minutes_until_current_update(
+        forecast_info, _get_timestamp('2024-06-01T12:00')) == pytest.approx(
+            DEFAULT_CURRENT_INTERVAL_SECONDS / 60)
+
+
+@pytest.mark.parametrize('hourly_series, expected_volatility', [
+    ({}, 0.0),
+    ({'precipitation_probability': [10, 35, 30, 30, 30, 30]}, 0.5),
+    ({'precipitation_probability': [0, 100, 0, 100, 0, 100]}, 1.0),
+    ({'weather_code': [1, 2, 1, 1, 1, 1]}, 2 / 3),
+    ({'weather_code': [1, 2, 3, 1, 2, 3]}, 1.0),
+    ({'wind_speed': [5.0, 40.0, 5.0, 5.0, 5.0, 5.0]}, 0.5),
+    ({'wind_speed': [90.0] * 6}, 1.0),
+    # Only the next hours are taken into account, and missing values are skipped
+    ({'weather_code': [1] * 6 + [2, 3, 4], 'wind_speed': [None] * 6 + [90.0]}, 0.0),
+])
+def test_volatility(hourly_series, expected_volatility):
+    assert get_volatility(_make_hourly_info(**hourly_series)) == pytest.approx(
+        expected_volatility)
+
+
+def _get_ttl_minutes(monkeypatch, now: str, forecast_info) -> float:
+    monkeypatch.setattr(refresh_scheduler.time, 'time', lambda: _get_timestamp(now))
+    return get_forecast_ttl_minutes(forecast_info)
+
+
+def test_calm_weather_is_kept_until_model_update(monkeypatch):
+    # The next model run is available at 05:00 UTC, i.e. 08:00 local time
+    forecast_info = _make_forecast_info('2024-06-01T07:00')
+    assert _get_ttl_minutes(monkeypatch, '2024-06-01T07:05', forecast_info) == pytest.approx(55)
+
+
+def test_volatile_weather_is_refreshed_with_current_conditions(monkeypatch):
+    calm_forecast_info = _make_forecast_info('2024-06-01T06:00')
+    volatile_forecast_info = _make_forecast_info('2024-06-01T06:00',
+                                                 weather_code=[1, 2, 3, 1, 2, 3])
+    stormy_forecast_info = _make_forecast_info('2024-06-01T06:00', wind_speed=[40.0] * 6)
+    calm_ttl = _get_ttl_minutes(monkeypatch, '2024-06-01T06:05', calm_forecast_info)
+    stormy_ttl = _get_ttl_minutes(monkeypatch, '2024-06-01T06:05', stormy_forecast_info)
+    volatile_ttl = _get_ttl_minutes(monkeypatch, '2024-06-01T06:05', volatile_forecast_info)
+    assert calm_ttl == pytest.approx(115)
+    assert volatile_ttl == pytest.approx(MIN_TTL_MINUTES)
+    assert calm_ttl > stormy_ttl > volatile_ttl
+
+
+def test_ttl_is_clamped(monkeypatch):
+    # Current conditions are updated in 1 minute
+    forecast_info = _make_forecast_info('2024-06-01T06:00', wind_speed=[90.0] * 6)
+    assert _get_ttl_minutes(monkeypatch, '2024-06-01T06:14', forecast_info) == MIN_TTL_MINUTES
+    # Current conditions are updated less often than models
+    forecast_info = _make_forecast_info('2024-06-01T06:00', interval=6 * 3600)
+    assert _get_ttl_minutes(monkeypatch, '2024-06-01T06:05', forecast_info) == MAX_TTL_MINUTES
+
+
+def test_current_hour_is_kept():
+    api_response = _make_api_response(6)
+    assert shift_to_current_hour(api_response, 4, _get_timestamp('2024-06-01T10:40'))
+    assert api_response['hourly']['time'] == [f'2024-06-01T{hour}:00' for hour in range(10, 14)]
+    assert api_response['current']['temperature_2m'] == 15.0
+
+
+def test_past_hours_are_dropped_and_current_conditions_are_updated():
+    api_response = _make_api_response(6)
+    assert shift_to_current_hour(api_response, 24, _get_timestamp('2024-06-01T12:05'))
+    assert api_response['hourly'] == {
+        'time': ['2024-06-01T12:00', '2024-06-01T13:00', '2024-06-01T14:00',
+                 '2024-06-01T15:00'],
+        'temperature_2m': [12.0, 13.0, 14.0, 15.0],
+        'weather_code': [0, 1, 2, 3],
+    }
+    assert api_response['current'] == {'time': '2024-06-01T12:00', 'temperature_2m': 12.0,
+                                       'weather_code': 0, 'interval': 900}
+
+
+def test_data_beyond_forecast_horizon():
+    api_response = _make_api_response(6)
+    assert not shift_to_current_hour(api_response, 24, _get_timestamp('2024-06-01T16:00'))
+
+
+def test_response_without_current_conditions():
+    api_response = _make_api_response(6)
+    del api_response['current']
+    assert shift_to_current_hour(api_response, 2, _get_timestamp('2024-06-01T15:59'))
+    assert api_response['hourly']['time'] == ['2024-06-01T15:00']
+
+
+def test_past_days_are_dropped_after_midnight():
+    api_response = _make_api_response(24)
+    assert shift_to_current_hour(api_response, 24, _get_timestamp('2024-06-02T01:30'))
+    assert api_response['hourly']['time'][0] == '2024-06-02T01:00'
+    assert api_response['daily'] == {'time': ['2024-06-02', '2024-06-03'],
+                                     'temperature_2m_max': [22.0, 23.0]}
+
+
+def test_data_beyond_daily_forecast_horizon_are_not_changed():
+    api_response = _make_api_response(24)
+    api_response['daily'] = {'time': ['2024-06-01'], 'temperature_2m_max': [21.0]}
+    expected_response = copy.deepcopy(api_response)
+    assert not shift_to_current_hour(api_response, 24, _get_timestamp('2024-06-02T01:30'))
+    assert api_response == expected_response
@@ -0,0 +1,105 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the request budget governor"""
+
+import pytest
+
+from libs import request_governor
+from libs.request_governor import (
+    LOW_BUDGET_FRACTION,
+    MAX_TTL_FACTOR,
+    RequestBudgetExceeded,
+    acquire_request,
+    get_remaining_budget_fraction,
+    get_ttl_factor,
+    get_usage,
+)
+
+
+class FakeClock:  # pylint: disable=too-few-public-methods
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture(name='clock')
+def fixture_clock(monkeypatch, tmp_path):
+    """Isolated budget file and a controlled clock"""
+    monkeypatch.setattr(request_governor, 'BUDGET_FILE', tmp_path / 'request_budget.json')
+    monkeypatch.setattr(request_governor, 'BUDGET_LOCK_FILE', tmp_path / 'request_budget.lock')
+    fake_clock = FakeClock(1718000000.0)
+    monkeypatch.setattr(request_governor.time, 'time', fake_clock.time)
+    return fake_clock
+
+
+@pytest.mark.usefixtures('clock')
+def test_tokens_are_taken_and_counted(set_settings):
+    set_settings(hourly_request_limit=100, daily_request_limit=1000)
+    acquire_request('forecast')
+    acquire_request('forecast', cost=3)
+    acquire_request('geocoding')
+    usage = get_usage()
+    assert usage['today'] == usage['this_hour'] == 5
+    assert usage['remaining_today'] == 995
+    assert usage['endpoints_today'] == {'forecast': 4, 'geocoding': 1}
+
+
+def test_exhausted_bucket_raises_and_keeps_tokens(clock, set_settings):
+    set_settings(hourly_request_limit=3, daily_request_limit=1000)
+    acquire_request('forecast', cost=2)
+    with pytest.raises(RequestBudgetExceeded, match='hour'):
+        acquire_request('forecast', cost=2)
+    # A cheaper request still fits into the remaining token
+    acquire_request('forecast')
+    with pytest.raises(RequestBudgetExceeded):
+        acquire_request('forecast')
+    clock.now += 3600 / 3
+    acquire_request('forecast')
+
+
+def test_buckets_are_refilled_over_time(clock, set_settings):
+    set_settings(hourly_request_limit=60, daily_request_limit=1000)
+    for _ in range(60):
+        acquire_request('forecast')
+    assert get_remaining_budget_fraction() == 0.0
+    clock.now += 30 * 60
+    assert get_remaining_budget_fraction() == pytest.approx(0.5)
+    # Buckets are never filled above their limits
+    clock.now += 24 * 3600
+    assert get_remaining_budget_fraction() == 1.0
+
+
+@pytest.mark.usefixtures('clock')
+def test_ttl_factor_grows_when_budget_runs_low(set_settings):
+    set_settings(hourly_request_limit=100, daily_request_limit=1000)
+    for _ in range(int(100 * LOW_BUDGET_FRACTION)):
+        acquire_request('forecast')
+    assert get_ttl_factor() == 1.0
+    acquire_request('forecast', cost=25)
+    assert get_ttl_factor() == pytest.approx(1.0 + (MAX_TTL_FACTOR - 1.0) / 2)
+    acquire_request('forecast', cost=25)
+    assert get_ttl_factor() == pytest.approx(MAX_TTL_FACTOR)
+
+
+def test_usage_is_reset_on_next_day(clock, set_settings):
+    set_settings(hourly_request_limit=100, daily_request_limit=1000)
+    acquire_request('forecast')
+    clock.now += 24 * 3600
+    usage = get_usage()
+    assert usage['today'] == usage['this_hour'] == 0
+    assert not usage['endpoints_today']
@@ -0,0 +1,66 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for coordinates snapping"""
+
+import pytest
+
+from libs.open_meteo_api import (
+    SNAP_OFF,
+    SNAP_TO_GEOHASH,
+    SNAP_TO_GRID,
+    _get_geohash_cell_center,
+    snap_coordinates,
+)
+
+
+def test_geohash_cell_center_of_known_geohash():
+    # Geohash "ezs42" spans latitudes 42.583-42.627 and longitudes -5.625 - -5.581
+    assert _get_geohash_cell_center(42.6, -5.6, 5) == pytest.approx((42.60498, -5.60303),
+                                                                    abs=1e-5)
+
+
+@pytest.mark.parametrize('precision', [1, 3, 5, 7])
+def test_geohash_cell_contains_point(precision):
+    # A geohash with 5 * precision bits has ceil(bits / 2) longitude bits
+    # and floor(bits / 2) latitude bits
+    bits = 5 * precision
+    lat_half_size = 90.0 / 2 ** (bits // 2)
+    lon_half_size = 180.0 / 2 ** (bits - bits // 2)
+    for latitude, longitude in [(50.45, 30.52), (-33.87, 151.21), (0.0, 0.0), (89.9, -179.9)]:
+        center_lat, center_lon = _get_geohash_cell_center(latitude, longitude, precision)
+        assert abs(center_lat - latitude) <= lat_half_size
+        assert abs(center_lon - longitude) <= lon_half_size
+
+
+def test_snap_to_geohash_shares_cell_for_nearby_points(set_settings):
+    set_settings(coordinates_snapping=SNAP_TO_GEOHASH, geohash_precision=5)
+    assert snap_coordinates(50.4501, 30.5234) == snap_coordinates(50.4512, 30.5241)
+    assert snap_coordinates(50.4501, 30.5234) != snap_coordinates(50.5501, 30.5234)
+
+
+def test_snap_to_grid(set_settings):
+    set_settings(coordinates_snapping=SNAP_TO_GRID, grid_step=0.1)
+    assert snap_coordinates(50.4501, 30.5634) == (50.5, 30.6)
+    assert snap_coordinates(-0.04, -0.06) == (-0.0, -0.1)
+
+
+def test_snap_to_grid_ignores_invalid_step(set_settings):
+    set_settings(coordinates_snapping=SNAP_TO_GRID, grid_step=0)
+    assert snap_coordinates(50.4501, 30.5234) == (50.4501, 30.5234)
+
+
+def test_snapping_off(set_settings):
+    set_settings(coordinates_snapping=SNAP_OFF, grid_step=0.1, geohash_precision=5)
+    assert snap_coordinates(50.4501, 30.5234) == (50.4501, 30.5234)
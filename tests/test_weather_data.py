@@ -0,0 +1,106 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for getting weather data from the cache or the API"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from libs import open_meteo_api
+from libs.common.kodi_service import get_cache_file, load_json_cache, save_json_cache
+from libs.open_meteo_api import (
+    SNAP_TO_GRID,
+    ForecastOutdatedError,
+    get_forecast,
+    get_weather_data,
+)
+
+LATITUDE, LONGITUDE, TIMEZONE = 50.4501, 30.5234, 'UTC'
+
+
+def _make_forecast(start_time: datetime, hours: int = 48):
+    times = [start_time + timedelta(hours=hour) for hour in range(hours)]
+    days = sorted({moment.date() for moment in times})
+    return {
+        'utc_offset_seconds': 0,
+        'current': {'time': start_time.strftime('%Y-%m-%dT%H:%M'), 'interval': 900,
+                    'temperature_2m': 20.0},
+        'hourly': {'time': [moment.strftime('%Y-%m-%dT%H:%M') for moment in times],
+                   'temperature_2m': [20.0] * hours},
+        'daily': {'time': [day.strftime('%Y-%m-%d') for day in days],
+                  'temperature_2m_max': [25.0] * len(days)},
+    }
+
+
+class FakeForecastApi:  # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.requests = []
+        self.forecast = None
+
+    def __call__(self, url, params):
+        self.requests.append(params)
+        if self.forecast is None:
+            raise open_meteo_api.requests.ConnectionError('Network is down')
+        return self.forecast
+
+
+@pytest.fixture(name='forecast_api')
+def fixture_forecast_api(monkeypatch, set_settings):
+    set_settings(coordinates_snapping=SNAP_TO_GRID, grid_step=0.1)
+    get_cache_file('get_forecast').unlink(missing_ok=True)
+    fake_api = FakeForecastApi()
+    monkeypatch.setattr(open_meteo_api, '_call_api', fake_api)
+    yield fake_api
+    get_cache_file('get_forecast').unlink(missing_ok=True)
+
+
+def test_evict_snaps_coordinates(forecast_api):
+    forecast_api.forecast = _make_forecast(datetime.utcnow().replace(minute=0))
+    get_forecast(LATITUDE, LONGITUDE, TIMEZONE)
+    assert forecast_api.requests[0]['latitude'] == '50.5'
+    assert len(load_json_cache('get_forecast')) == 1
+    assert get_forecast.evict(LATITUDE, LONGITUDE, TIMEZONE)
+    assert not load_json_cache('get_forecast')
+
+
+def test_current_hour_is_shown(forecast_api):
+    now = datetime.utcnow()
+    forecast_api.forecast = _make_forecast(now.replace(minute=0) - timedelta(hours=2))
+    forecast, air_quality = get_weather_data(LATITUDE, LONGITUDE, TIMEZONE, False)
+    assert forecast['hourly']['time'][0] == now.strftime('%Y-%m-%dT%H:00')
+    assert air_quality is None
+
+
+def test_outdated_cached_forecast_is_not_shown_when_api_is_unavailable(forecast_api):
+    # Regression: an expired entry under the snapped key used to survive eviction,
+    # so it was returned again as a stale fallback and shown as the current forecast
+    forecast_api.forecast = _make_forecast(datetime(2020, 6, 1))
+    get_forecast(LATITUDE, LONGITUDE, TIMEZONE)
+    cache = load_json_cache('get_forecast')
+    for entry in cache.values():
+        entry['timestamp'] = 0
+    save_json_cache('get_forecast', cache)
+    forecast_api.forecast = None
+    with pytest.raises(open_meteo_api.requests.ConnectionError):
+        get_weather_data(LATITUDE, LONGITUDE, TIMEZONE, False)
+    assert not load_json_cache('get_forecast')
+
+
+def test_outdated_fetched_forecast_raises_error(forecast_api):
+    forecast_api.forecast = _make_forecast(datetime(2020, 6, 1))
+    with pytest.raises(ForecastOutdatedError):
+        get_weather_data(LATITUDE, LONGITUDE, TIMEZONE, False)
+    assert len(forecast_api.requests) == 2
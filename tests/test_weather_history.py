@@ -0,0 +1,178 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the weather history store"""
+
+import threading
+import time
+from datetime import date, timedelta
+
+import pytest
+
+from libs import weather_history
+from libs.weather_history import INCOMPLETE_RETRY_DAYS, update_history
+
+HISTORY_DAYS = 7
+
+
+class FakeHistoryApi:
+    """
+    Stand-in for :func:`libs.open_meteo_api.get_daily_history`
+
+    Records are derived from dates, and dates from ``incomplete_dates``
+    have no precipitation data.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.incomplete_dates = set()
+        self.latency = 0.0
+
+    @staticmethod
+    def get_record(day: date):
+        return {
+            'temperature_2m_max': 20.0 + day.toordinal() % 7,
+            'temperature_2m_min': 10.0 - day.toordinal() % 5,
+            'precipitation_sum': 0.5 * (day.toordinal() % 3),
+        }
+
+    def __call__(self, latitude, longitude, timezone, start_date, end_date, **kwargs):
+        self.requests.append((start_date, end_date))
+        time.sleep(self.latency)
+        daily_info = {'time': [], 'temperature_2m_max': [], 'temperature_2m_min': [],
+                      'precipitation_sum': []}
+        day = start_date
+        while day <= end_date:
+            daily_info['time'].append(day.isoformat())
+            for field, value in self.get_record(day).items():
+                if field == 'precipitation_sum' and day in self.incomplete_dates:
+                    value = None
+                daily_info[field].append(value)
+            day += timedelta(days=1)
+        return {'daily': daily_info}
+
+
+@pytest.fixture(name='history_api')
+def fixture_history_api(monkeypatch, tmp_path):
+    monkeypatch.setattr(weather_history, 'HISTORY_DIR', tmp_path)
+    fake_api = FakeHistoryApi()
+    monkeypatch.setattr(weather_history, 'get_daily_history', fake_api)
+    return fake_api
+
+
+def _update(today: date):
+    return update_history(50.45, 30.52, 'Europe/Kyiv', HISTORY_DAYS, today)
+
+
+def _assert_aggregates_are_consistent(store):
+    records = list(store['records'].values())
+    aggregates = store['aggregates']
+    assert aggregates['count'] == len(records)
+    for field in weather_history.RECORD_FIELDS:
+        assert aggregates[f'sum_{field}'] == pytest.approx(
+            sum(record[field] for record in records))
+    assert aggregates['max_temperature_2m_max'] == max(
+        (record['temperature_2m_max'] for record in records), default=None)
+    assert aggregates['min_temperature_2m_min'] == min(
+        (record['temperature_2m_min'] for record in records), default=None)
+
+
+def test_only_missing_days_are_fetched(history_api):
+    today = date(2024, 6, 10)
+    store = _update(today)
+    assert history_api.requests == [(today - timedelta(days=HISTORY_DAYS),
+                                     today - timedelta(days=1))]
+    assert len(store['records']) == HISTORY_DAYS
+    _assert_aggregates_are_consistent(store)
+    _update(today)
+    assert len(history_api.requests) == 1
+    _update(today + timedelta(days=1))
+    assert history_api.requests[-1] == (today, today)
+
+
+def test_aggregates_are_updated_incrementally(history_api):
+    today = date(2024, 6, 10)
+    # Rolling the window over two weeks trims records that hold extremes
+    for days in range(15):
+        store = _update(today + timedelta(days=days))
+        assert len(store['records']) == HISTORY_DAYS
+        assert min(store['records']) == (today + timedelta(days=days - HISTORY_DAYS)).isoformat()
+        _assert_aggregates_are_consistent(store)
+    assert len(history_api.requests) == 15
+
+
+def test_store_is_reloaded_from_file(history_api):
+    today = date(2024, 6, 10)
+    _update(today)
+    store = _update(today + timedelta(days=2))
+    assert history_api.requests[-1] == (today, today + timedelta(days=1))
+    _assert_aggregates_are_consistent(store)
+
+
+def test_incomplete_days_are_retried_while_recent(history_api):
+    today = date(2024, 6, 10)
+    yesterday = today - timedelta(days=1)
+    history_api.incomplete_dates.add(yesterday)
+    store = _update(today)
+    assert yesterday.isoformat() not in store['records']
+    assert store['incomplete'] == {yesterday.isoformat(): today.isoformat()}
+    _assert_aggregates_are_consistent(store)
+    # Incomplete days are retried at most once a day
+    _update(today)
+    assert len(history_api.requests) == 1
+    for days in range(1, INCOMPLETE_RETRY_DAYS + 3):
+        _update(today + timedelta(days=days))
+        assert history_api.requests[-1][1] == today + timedelta(days=days - 1)
+        if days < INCOMPLETE_RETRY_DAYS:
+            assert history_api.requests[-1][0] == yesterday
+        else:
+            # The incomplete day is not requested again
+            assert history_api.requests[-1][0] == today + timedelta(days=days - 1)
+
+
+def test_completed_days_replace_incomplete_entries(history_api):
+    today = date(2024, 6, 10)
+    yesterday = today - timedelta(days=1)
+    history_api.incomplete_dates.add(yesterday)
+    _update(today)
+    history_api.incomplete_dates.clear()
+    store = _update(today + timedelta(days=1))
+    assert history_api.requests[-1] == (yesterday, today)
+    assert not store['incomplete']
+    assert yesterday.isoformat() in store['records']
+    _assert_aggregates_are_consistent(store)
+
+
+def test_incomplete_entries_are_trimmed(history_api):
+    today = date(2024, 6, 10)
+    history_api.incomplete_dates.add(today - timedelta(days=1))
+    _update(today)
+    store = _update(today + timedelta(days=HISTORY_DAYS + 1))
+    assert not store['incomplete']
+
+
+def test_concurrent_updates_fetch_once_and_keep_records(history_api, tmp_path):
+    history_api.latency = 0.1
+    today = date(2024, 6, 10)
+    stores = []
+    threads = [threading.Thread(target=lambda: stores.append(_update(today))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(history_api.requests) == 1
+    assert [len(store['records']) for store in stores] == [HISTORY_DAYS] * 4
+    _assert_aggregates_are_consistent(_update(today))
+    assert len(list(tmp_path.glob('*.json'))) == 1
+    assert not list(tmp_path.glob('.*.tmp'))
@@ -0,0 +1,130 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for weather info pre-fetching"""
+
+import itertools
+
+import pytest
+from stress_harness import DEFAULT_SETTINGS, _make_forecast
+from xbmcaddon import Addon
+from xbmcgui import Window
+
+from libs import open_meteo_api, weather_info_service
+from libs.common.kodi_service import get_cache_file
+from libs.forecast_snapshot import load_snapshot, write_snapshot
+from libs.open_meteo_api import SNAP_TO_GRID
+from libs.weather_info_service import (
+    LocationData,
+    populate_weather_info_for_location,
+    prepare_weather_info_for_location,
+)
+
+KYIV = LocationData('Kyiv', 50.45, 30.52, 'Europe/Kyiv')
+PARIS = LocationData('Paris', 48.85, 2.35, 'Europe/Paris')
+# Stub windows with the same ID share properties, so each test gets its own window
+WINDOW_IDS = itertools.count(100000)
+
+
+class ChangedSettingsAddon(Addon):
+    """An addon instance with settings that differ from the settings file"""
+
+    def __init__(self, **settings):
+        super().__init__()
+        self._changed_settings = dict(DEFAULT_SETTINGS, **settings)
+
+    def _settings(self):
+        return self._changed_settings
+
+
+@pytest.fixture(name='window')
+def fixture_window(monkeypatch):
+    window = Window(next(WINDOW_IDS))
+    monkeypatch.setattr(weather_info_service, 'WEATHER_WINDOW', window)
+    return window
+
+
+@pytest.fixture(name='api_is_down')
+def fixture_api_is_down(monkeypatch, tmp_path):
+    monkeypatch.setattr(weather_info_service, 'SNAPSHOTS_DIR', tmp_path)
+    get_cache_file('get_forecast').unlink(missing_ok=True)
+
+    def call_api(url, params):
+        raise open_meteo_api.requests.ConnectionError('Network is down')
+
+    monkeypatch.setattr(open_meteo_api, '_call_api', call_api)
+
+
+@pytest.fixture(name='forecast_requests')
+def fixture_forecast_requests(monkeypatch, tmp_path):
+    monkeypatch.setattr(weather_info_service, 'SNAPSHOTS_DIR', tmp_path)
+    get_cache_file('get_forecast').unlink(missing_ok=True)
+    requests = []
+
+    def call_api(url, params):  # pylint: disable=unused-argument
+        requests.append(params)
+        return _make_forecast(params)
+
+    monkeypatch.setattr(open_meteo_api, '_call_api', call_api)
+    yield requests
+    get_cache_file('get_forecast').unlink(missing_ok=True)
+
+
+def test_prefetch_uses_given_addon_settings(forecast_requests, tmp_path):
+    addon = ChangedSettingsAddon(coordinates_snapping=SNAP_TO_GRID, grid_step=1.0,
+                                 location2_name='Paris', location2_lat=48.85,
+                                 location2_lon=2.35, location2_timezone='UTC')
+    prepare_weather_info_for_location('location2', LocationData('Paris', 48.85, 2.35, 'UTC'),
+                                      addon)
+    assert len(forecast_requests) == 1
+    assert float(forecast_requests[0]['latitude']) == 49.0
+    assert float(forecast_requests[0]['longitude']) == 2.0
+    properties = load_snapshot(tmp_path / 'location2.json')['properties']
+    assert properties['Location'] == properties['Location2'] == 'Paris'
+    assert properties['Locations'] == '2'
+    # The next invocation with the same settings uses the pre-fetched data
+    open_meteo_api.get_forecast(48.85, 2.35, 'UTC', addon=addon)
+    assert len(forecast_requests) == 1
+
+
+@pytest.mark.usefixtures('api_is_down')
+def test_last_snapshot_is_shown_before_fetching(window, tmp_path):
+    write_snapshot(tmp_path, 'location1', 'Kyiv',
+                   {'Current.Location': 'Kyiv', 'Current.Temperature': '21'}, KYIV[1:])
+    with pytest.raises(open_meteo_api.requests.ConnectionError):
+        populate_weather_info_for_location('location1')
+    assert window.getProperty('Current.Location') == 'Kyiv'
+    assert window.getProperty('Current.Temperature') == '21'
+
+
+@pytest.mark.usefixtures('api_is_down')
+def test_snapshot_for_changed_location_is_not_shown(window, tmp_path):
+    # location1 has been changed to Kyiv, but its data have not been pre-fetched
+    write_snapshot(tmp_path, 'location1', 'Paris',
+                   {'Current.Location': 'Paris', 'Current.Temperature': '25'}, PARIS[1:])
+    with pytest.raises(open_meteo_api.requests.ConnectionError):
+        populate_weather_info_for_location('location1')
+    assert not window.getProperty('Current.Location')
+    assert not window.getProperty('Current.Temperature')
+
+
+@pytest.mark.usefixtures('api_is_down')
+def test_shown_location_is_not_replayed(window, tmp_path):
+    write_snapshot(tmp_path, 'location1', 'Kyiv',
+                   {'Current.Location': 'Kyiv', 'Current.Temperature': '21'}, KYIV[1:])
+    window.setProperty('Current.Location', 'Kyiv')
+    window.setProperty('Current.Temperature', '22')
+    with pytest.raises(open_meteo_api.requests.ConnectionError):
+        populate_weather_info_for_location('location1')
+    assert window.getProperty('Current.Temperature') == '22'
@@ -0,0 +1,595 @@
+#!/usr/bin/env python3
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Concurrency stress harness for simultaneous weather script invocations
+
+Kodi may start several ``main.py`` processes at once, e.g. on a location switch,
+a periodic refresh and a settings action. The harness runs many concurrent
+invocations of the addon script against stub Kodi modules and a local stand-in
+for Open-Meteo API, and reports the results as JSON:
+
+* throughput and invocation latency percentiles;
+* failed invocations and invocations that logged errors;
+* duplicate upstream API calls;
+* JSON files in the addon profile that were observed torn (partially written)
+  during the run or are corrupted after it;
+* lost updates of counters that are shared between processes: cache statistics
+  and request budget usage.
+
+Usage::
+
+    python tools/stress_harness.py --invocations 100 --concurrency 20
+
+The harness uses only the Python standard library and does not touch
+the real Kodi profile.
+"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+ADDON_DIR = Path(__file__).resolve().parent.parent / 'weather.open-meteo.lite'
+
+DEFAULT_SETTINGS = {
+    'location1_name': 'Kyiv',
+    'location1_lat': 50.45,
+    'location1_lon': 30.52,
+    'location1_timezone': 'Europe/Kyiv',
+    'coordinates_snapping': 0,
+    'enable_air_quality': False,
+    'enable_metrics': True,
+}
+
+# Cached functions that are called exactly once per populating invocation
+PER_INVOCATION_CACHED_FUNCTIONS = ('get_forecast',)
+
+STUB_MODULES = {
+    'xbmc.py': '''
+import os
+import sys
+
+LOGDEBUG, LOGINFO, LOGWARNING, LOGERROR, LOGFATAL, LOGNONE = range(6)
+
+
+def log(msg, level=LOGDEBUG):
+    if level >= LOGERROR:
+        print(f'KODI_LOG_ERROR: {msg}', file=sys.stderr)
+
+
+def getRegion(key):
+    return {'datelong': '%A, %d %B %Y', 'dateshort': '%d/%m/%Y', 'time': '%H:%M:%S',
+            'tempunit': '\\u00b0C', 'speedunit': 'km/h'}[key]
+
+
+def getInfoLabel(label):
+    return ''
+
+
+def getCondVisibility(condition):
+    return False
+
+
+class Keyboard:
+    def __init__(self, *args):
+        pass
+
+    def doModal(self):
+        pass
+
+    def getText(self):
+        return 'London'
+
+
+class Monitor:
+    def abortRequested(self):
+        return True
+
+    def waitForAbort(self, timeout=None):
+        return True
+''',
+    'xbmcaddon.py': '''
+import json
+import os
+
+PROFILE = os.environ['HARNESS_PROFILE']
+
+
+class Addon:
+    def __init__(self, addon_id=None):
+        pass
+
+    def getAddonInfo(self, key):
+        return {'id': 'weather.open-meteo.lite', 'name': 'Open-Meteo Lite', 'version': '0.0.0',
+                'path': os.environ['HARNESS_ADDON_DIR'], 'profile': PROFILE}[key]
+
+    def _settings(self):
+        with open(os.environ['HARNESS_SETTINGS'], encoding='utf-8') as fo:
+            return json.load(fo)
+
+    def getSettingString(self, key):
+        return str(self._settings().get(key, ''))
+
+    def getSetting(self, key):
+        return str(self._settings().get(key, ''))
+
+    def getSettingNumber(self, key):
+        return float(self._settings().get(key, 0.0))
+
+    def getSettingInt(self, key):
+        return int(self._settings().get(key, 0))
+
+    def getSettingBool(self, key):
+        return bool(self._settings().get(key, False))
+
+    def _set_setting(self, key, value):
+        pass
+
+    setSettingString = setSettingNumber = setSettingInt = setSettingBool = _set_setting
+
+    def getLocalizedString(self, string_id):
+        return f'#{string_id}'
+''',
+    'xbmcgui.py': '''
+NOTIFICATION_INFO, NOTIFICATION_WARNING, NOTIFICATION_ERROR = 'info', 'warning', 'error'
+_PROPERTIES = {}
+
+
+class Window:
+    def __init__(self, window_id=0):
+        self._properties = _PROPERTIES.setdefault(window_id, {})
+
+    def setProperty(self, key, value):
+        self._properties[key] = value
+
+    def getProperty(self, key):
+        return self._properties.get(key, '')
+
+    def clearProperty(self, key):
+        self._properties.pop(key, None)
+
+
+class Dialog:
+    def notification(self, *args, **kwargs):
+        pass
+
+    def select(self, heading, options):
+        return 0
+
+    def textviewer(self, heading, text, usemono=False):
+        pass
+
+    def ok(self, heading, text):
+        pass
+
+
+class ListItem:
+    def __init__(self, label='', label2='', path='', offscreen=False):
+        self.properties = {}
+
+    def setProperty(self, key, value):
+        self.properties[key] = value
+
+    def setProperties(self, properties):
+        self.properties.update(properties)
+
+    def setArt(self, art):
+        pass
+
+    def setLabel2(self, label):
+        pass
+''',
+    'xbmcvfs.py': '''
+def translatePath(path):
+    return path
+''',
+    'simple_requests.py': '''
+import json
+import os
+import urllib.error
+import urllib.parse
+import urllib.request
+
+API_URL = os.environ['HARNESS_API_URL']
+
+
+class RequestException(IOError):
+    pass
+
+
+class ConnectionError(RequestException):
+    pass
+
+
+class HTTPError(RequestException):
+    pass
+
+
+class Timeout(RequestException):
+    pass
+
+
+class Response:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise HTTPError(f'HTTP error {self.status_code}')
+
+
+def get(url, params=None, headers=None, timeout=None, **kwargs):
+    url_parts = urllib.parse.urlsplit(url)
+    if url_parts.hostname not in ('127.0.0.1', 'localhost'):
+        # Send Open-Meteo requests to the stand-in API
+        url = API_URL + url_parts.path
+    url += '?' + urllib.parse.urlencode(params or {})
+    try:
+        with urllib.request.urlopen(url, timeout=timeout or 30) as response:
+            return Response(response.status, response.read().decode('utf-8'))
+    except urllib.error.HTTPError as exc:
+        return Response(exc.code, exc.read().decode('utf-8'))
+    except OSError as exc:
+        raise ConnectionError(str(exc)) from exc
+''',
+}
+
+
+def _get_date_range(params: Dict[str, str]) -> List[str]:
+    start_date = datetime.strptime(params['start_date'], '%Y-%m-%d')
+    end_date = datetime.strptime(params['end_date'], '%Y-%m-%d')
+    return [(start_date + timedelta(days=i)).strftime('%Y-%m-%d')
+            for i in range((end_date - start_date).days + 1)]
+
+
+def _get_value(variable: str, i: int) -> Any:
+    if variable in ('weather_code', 'is_day'):
+        return i % 2
+    if 'direction' in variable:
+        return (i * 30) % 360
+    return 10.0 + i % 10
+
+
+def _make_forecast(params: Dict[str, str]) -> Dict[str, Any]:
+    days = _get_date_range(params)
+    daily = {'time': days}
+    for variable in params['daily'].split(','):
+        daily[variable] = [_get_value(variable, i) for i in range(len(days))]
+    forecast = {'utc_offset_seconds': 0, 'timezone': params.get('timezone'), 'daily': daily}
+    if 'start_hour' in params:
+        start_hour = datetime.strptime(params['start_hour'], '%Y-%m-%dT%H:%M')
+        end_hour = datetime.strptime(params['end_hour'], '%Y-%m-%dT%H:%M')
+        hours = int((end_hour - start_hour).total_seconds() // 3600) + 1
+        hourly = {'time': [(start_hour + timedelta(hours=i)).strftime('%Y-%m-%dT%H:%M')
+                           for i in range(hours)]}
+        for variable in params['hourly'].split(','):
+            hourly[variable] = [_get_value(variable, i) for i in range(hours)]
+        current = {variable: _get_value(variable, 0) for variable in params['current'].split(',')}
+        current['time'] = start_hour.strftime('%Y-%m-%dT%H:%M')
+        current['interval'] = 900
+        forecast.update({'current': current, 'hourly': hourly})
+    return forecast
+
+
+def _make_air_quality(params: Dict[str, str]) -> Dict[str, Any]:
+    start_hour = datetime.strptime(params['start_hour'], '%Y-%m-%dT%H:%M')
+    end_hour = datetime.strptime(params['end_hour'], '%Y-%m-%dT%H:%M')
+    hours = int((end_hour - start_hour).total_seconds() // 3600) + 1
+    hourly = {'time': [(start_hour + timedelta(hours=i)).strftime('%Y-%m-%dT%H:%M')
+                       for i in range(hours)]}
+    for variable in params['hourly'].split(','):
+        hourly[variable] = [5.0] * hours
+    return {
+        'current': {variable: 3.0 for variable in params['current'].split(',')},
+        'hourly': hourly,
+    }
+
+
+def _make_search_results(params: Dict[str, str]) -> Dict[str, Any]:
+    return {'results': [{'name': params.get('name', ''), 'country': 'Ukraine',
+                         'admin1': 'Kyiv City', 'latitude': 50.45, 'longitude': 30.52,
+                         'timezone': 'Europe/Kyiv'}]}
+
+
+class StandInApiHandler(BaseHTTPRequestHandler):
+    server: 'StandInApiServer'
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        url_parts = urlsplit(self.path)
+        params = dict(parse_qsl(url_parts.query))
+        self.server.count_request(url_parts.path, params)
+        time.sleep(self.server.latency)
+        if url_parts.path == '/v1/forecast':
+            data = _make_forecast(params)
+        elif url_parts.path == '/v1/air-quality':
+            data = _make_air_quality(params)
+        elif url_parts.path == '/v1/search':
+            data = _make_search_results(params)
+        else:
+            self.send_error(404)
+            return
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class StandInApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float):
+        super().__init__(('127.0.0.1', 0), StandInApiHandler)
+        self.latency = latency
+        self.request_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def count_request(self, path: str, params: Dict[str, str]) -> None:
+        key = f'{path}?{sorted(params.items())}'
+        with self._lock:
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+
+
+class JsonFileMonitor:
+    """
+    Repeatedly parse JSON files in the profile directory to detect torn writes
+    """
+
+    def __init__(self, profile_dir: Path, interval: float = 0.002):
+        self._profile_dir = profile_dir
+        self._interval = interval
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.reads = 0
+        self.torn_reads: Dict[str, int] = {}
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            for path in self._profile_dir.glob('*.json'):
+                try:
+                    with path.open('r', encoding='utf-8') as fo:
+                        json.load(fo)
+                except FileNotFoundError:
+                    continue
+                except (OSError, ValueError):
+                    self.torn_reads[path.name] = self.torn_reads.get(path.name, 0) + 1
+                self.reads += 1
+            time.sleep(self._interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop_event.set()
+        self._thread.join()
+
+
+def _percentile(values: List[float], percent: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(0, math.ceil(len(values) * percent / 100) - 1)
+    return round(values[index], 4)
+
+
+def _run_invocation(env: Dict[str, str], parameter: str) -> Dict[str, Any]:
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, 'main.py', parameter],
+                             cwd=env['HARNESS_ADDON_DIR'], env=env,
+                             capture_output=True, text=True, check=False)
+    return {
+        'latency': time.perf_counter() - start,
+        'returncode': process.returncode,
+        'errors': [line for line in process.stderr.splitlines()
+                   if line.startswith('KODI_LOG_ERROR')],
+        'stderr_tail': process.stderr.strip().splitlines()[-1:] if process.returncode else [],
+    }
+
+
+def _check_json_files(profile_dir: Path) -> List[str]:
+    corrupted = []
+    for path in sorted(profile_dir.glob('*.json')):
+        try:
+            with path.open('r', encoding='utf-8') as fo:
+                json.load(fo)
+        except (OSError, ValueError):
+            corrupted.append(path.name)
+    return corrupted
+
+
+def _load_json(path: Path) -> Any:
+    try:
+        with path.open('r', encoding='utf-8') as fo:
+            return json.load(fo)
+    except (OSError, ValueError):
+        return None
+
+
+def _get_lost_updates(profile_dir: Path,
+                      successful_invocations: int,
+                      upstream_calls: int) -> Dict[str, Any]:
+    """
+    Count updates of shared counters that have been overwritten by concurrent processes
+
+    Cache statistics are counted in per-run metrics records. Failed invocations
+    may or may not have written their records, so only the lower bound
+    of lost cache statistics updates is known.
+    """
+    lost_updates: Dict[str, Any] = {}
+    counters: Dict[str, int] = {}
+    metrics_file = profile_dir / 'metrics.jsonl'
+    if metrics_file.exists():
+        with metrics_file.open('r', encoding='utf-8') as fo:
+            for line in fo:
+                for name, value in json.loads(line).get('counters', {}).items():
+                    counters[name] = counters.get(name, 0) + value
+    for func_name in PER_INVOCATION_CACHED_FUNCTIONS:
+        recorded = (counters.get(f'{func_name}.cache_hit', 0)
+                    + counters.get(f'{func_name}.cache_miss', 0))
+        lost_updates[f'cache_stats.{func_name}'] = max(0, successful_invocations - recorded)
+    budget_state = _load_json(profile_dir / 'request_budget.json') or {}
+    recorded_requests = sum(budget_state.get('usage', {}).get('day_counts', {}).values())
+    lost_updates['request_budget.usage'] = upstream_calls - recorded_requests
+    return lost_updates
+
+
+def run_stress_test(invocations: int,
+                    concurrency: int,
+                    parameter: str,
+                    latency: float,
+                    settings: Dict[str, Any],
+                    warm: bool,
+                    addon_dir: Path) -> Dict[str, Any]:
+    """
+    Run concurrent addon script invocations and collect statistics
+
+    :param invocations: total number of script invocations
+    :param concurrency: the max number of simultaneously running invocations
+    :param parameter: script parameter, e.g. "1" for populating location 1
+    :param latency: simulated API latency in seconds
+    :param settings: addon settings
+    :param warm: run one invocation before the test to create the profile files
+    :param addon_dir: addon directory
+    :return: results dict
+    """
+    work_dir = Path(tempfile.mkdtemp(prefix='omlite-stress-'))
+    try:
+        stubs_dir = work_dir / 'stubs'
+        profile_dir = work_dir / 'profile'
+        stubs_dir.mkdir()
+        profile_dir.mkdir()
+        for file_name, source in STUB_MODULES.items():
+            (stubs_dir / file_name).write_text(source.lstrip(), encoding='utf-8')
+        settings_file = work_dir / 'settings.json'
+        settings_file.write_text(json.dumps(settings), encoding='utf-8')
+        server = StandInApiServer(latency)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        env = dict(os.environ,
+                   PYTHONPATH=os.pathsep.join([str(stubs_dir), str(addon_dir)]),
+                   HARNESS_ADDON_DIR=str(addon_dir),
+                   HARNESS_PROFILE=str(profile_dir),
+                   HARNESS_SETTINGS=str(settings_file),
+                   HARNESS_API_URL=server.url)
+        if warm:
+            _run_invocation(env, parameter)
+            server.request_counts.clear()
+            (profile_dir / 'metrics.jsonl').unlink(missing_ok=True)
+            (profile_dir / 'request_budget.json').unlink(missing_ok=True)
+        start = time.perf_counter()
+        with JsonFileMonitor(profile_dir) as monitor:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(lambda _: _run_invocation(env, parameter),
+                                            range(invocations)))
+        wall_time = time.perf_counter() - start
+        server.shutdown()
+        server.server_close()
+        latencies = [result['latency'] for result in results]
+        failed = [result for result in results if result['returncode'] != 0]
+        upstream_calls = sum(server.request_counts.values())
+        error_messages = sorted({error for result in results for error in result['errors']})
+        return {
+            'invocations': invocations,
+            'concurrency': concurrency,
+            'parameter': parameter,
+            'warm_start': warm,
+            'wall_time': round(wall_time, 3),
+            'throughput': round(invocations / wall_time, 3),
+            'latency': {
+                'p50': _percentile(latencies, 50),
+                'p90': _percentile(latencies, 90),
+                'p99': _percentile(latencies, 99),
+                'max': _percentile(latencies, 100),
+            },
+            'failed_invocations': len(failed),
+            'failure_samples': sorted({line for result in failed
+                                       for line in result['stderr_tail']})[:5],
+            'invocations_with_errors': sum(1 for result in results if result['errors']),
+            'error_samples': error_messages[:5],
+            'upstream': {
+                'calls': upstream_calls,
+                'unique_calls': len(server.request_counts),
+                'duplicate_calls': upstream_calls - len(server.request_counts),
+            },
+            'json_files': {
+                'monitor_reads': monitor.reads,
+                'torn_reads': monitor.torn_reads,
+                'corrupted_after_run': _check_json_files(profile_dir),
+            },
+            'lost_updates': _get_lost_updates(profile_dir, invocations - len(failed),
+                                              upstream_calls),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0].strip())
+    parser.add_argument('-n', '--invocations', type=int, default=50,
+                        help='total number of script invocations (default: %(default)s)')
+    parser.add_argument('-c', '--concurrency', type=int, default=10,
+                        help='simultaneously running invocations (default: %(default)s)')
+    parser.add_argument('-p', '--parameter', default='1',
+                        help='script parameter (default: %(default)s)')
+    parser.add_argument('-l', '--latency', type=float, default=50,
+                        help='simulated API latency in milliseconds (default: %(default)s)')
+    parser.add_argument('--air-quality', action='store_true',
+                        help='enable air quality data')
+    parser.add_argument('--warm', action='store_true',
+                        help='create profile files with one invocation before the test')
+    parser.add_argument('--addon-dir', type=Path, default=ADDON_DIR,
+                        help='addon directory (default: %(default)s)')
+    parser.add_argument('-o', '--output', type=Path,
+                        help='write JSON results to a file instead of stdout')
+    args = parser.parse_args()
+    settings = dict(DEFAULT_SETTINGS, enable_air_quality=args.air_quality)
+    results = run_stress_test(args.invocations, args.concurrency, args.parameter,
+                              args.latency / 1000, settings, args.warm,
+                              args.addon_dir.resolve())
+    output = json.dumps(results, indent=2)
+    if args.output is not None:
+        args.output.write_text(output + '\n', encoding='utf-8')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,13 +15,23 @@
 
 import logging
 import sys
+import time
 from typing import Dict, Any
 
 import xbmc
 import xbmcgui
 
-from libs.common.kodi_service import ADDON, ADDON_ID, GettextEmulator
+from libs.common.kodi_service import (
+    ADDON,
+    ADDON_ID,
+    ADDON_NAME,
+    PROFILE,
+    GettextEmulator,
+)
+from libs.common.metrics import record_run, sum_counters, summarize_metrics
+from libs.common.profiler import bundle_profiles, profile_run
 from libs.open_meteo_api import search_location
+from libs.request_governor import get_usage
 from libs.weather_info_service import populate_weather_info_for_location
 
 _ = GettextEmulator.gettext
@@ -29,6 +39,13 @@ _ = GettextEmulator.gettext
 logger = logging.getLogger(__name__)
 DIALOG = xbmcgui.Dialog()
 
+METRICS_FILE = PROFILE / 'metrics.jsonl'
+PROFILES_DIR = PROFILE / 'profiles'
+
+PROFILING_CPROFILE = 1
+PROFILING_TRACEMALLOC = 2
+PROFILING_ALL = 3
+
 
 def _get_full_location_name(location_info: Dict[str, Any]) -> str:
     name_parts = [location_info['name']]
@@ -103,7 +120,66 @@ def set_location(location_id: str) -> None:
 def populate_weather_info(location_no: str) -> None:
     logger.debug('Populating weather info for location_%s...', location_no)
     location_id = f'location{location_no}'
-    populate_weather_info_for_location(location_id)
+    with record_run(location_id, METRICS_FILE, enabled=ADDON.getSettingBool('enable_metrics')):
+        populate_weather_info_for_location(location_id)
+
+
+def show_stats() -> None:
+    metrics_summary = summarize_metrics(METRICS_FILE)
+    if metrics_summary is None:
+        metrics_summary = _('No timing metrics collected')
+    lines = [metrics_summary, '']
+    counters = sum_counters(METRICS_FILE)
+    cached_functions = sorted({name.rsplit('.', 1)[0] for name in counters
+                               if name.endswith(('.cache_hit', '.cache_miss'))})
+    for func_name in cached_functions:
+        hits = counters.get(f'{func_name}.cache_hit', 0)
+        total = hits + counters.get(f'{func_name}.cache_miss', 0)
+        lines.append(_('{function} cache hits: {hits}/{total}').format(
+            function=func_name, hits=hits, total=total))
+    request_usage = get_usage()
+    lines.append(_('Open-Meteo requests today: {today}, this hour: {this_hour}, '
+                   'remaining today: {remaining_today}').format(**request_usage))
+    for endpoint, count in request_usage['endpoints_today'].items():
+        lines.append(f'  {endpoint}: {count}')
+    stats_text = '\n'.join(lines)
+    logger.info('Weather refresh stats:\n%s', stats_text)
+    DIALOG.textviewer(_('Weather refresh statistics'), stats_text, usemono=True)
+
+
+def bundle_profiling_results() -> None:
+    bundle_path = bundle_profiles(
+        PROFILES_DIR,
+        PROFILE / f'profiles_{time.strftime("%Y%m%d-%H%M%S")}.zip',
+        extra_files=[METRICS_FILE]
+    )
+    if bundle_path is None:
+        DIALOG.notification(
+            ADDON_ID,
+            _('No profiling results found'),
+            icon=xbmcgui.NOTIFICATION_WARNING
+        )
+        return
+    logger.info('Profiling results are saved to %s', bundle_path)
+    DIALOG.ok(ADDON_NAME, _('Profiling results are saved to:') + f'\n{bundle_path}')
+
+
+def profile_invocation():
+    """
+    Profile the current script invocation according to the hidden "profiling_mode" setting
+
+    :return: a context manager
+    """
+    profiling_mode = ADDON.getSettingInt('profiling_mode')
+    label = sys.argv[1] if len(sys.argv) > 1 else 'main'
+    if label == 'bundle_profiles':
+        profiling_mode = 0
+    return profile_run(
+        PROFILES_DIR,
+        label,
+        use_cprofile=profiling_mode in (PROFILING_CPROFILE, PROFILING_ALL),
+        use_tracemalloc=profiling_mode in (PROFILING_TRACEMALLOC, PROFILING_ALL)
+    )
 
 
 def main() -> None:
@@ -111,4 +187,10 @@ def main() -> None:
     if parameter.startswith('location'):
         set_location(parameter)
         return
+    if parameter == 'stats':
+        show_stats()
+        return
+    if parameter == 'bundle_profiles':
+        bundle_profiling_results()
+        return
     populate_weather_info(parameter)
@@ -0,0 +1,201 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Local calculation of sun and moon data
+
+Sun events are calculated with NOAA solar position equations, which are accurate
+to about a minute for latitudes below the polar circles. The moon phase is
+calculated from the mean synodic month.
+"""
+
+import logging
+import math
+from datetime import date, datetime, timedelta, timezone as dt_timezone, tzinfo
+from typing import Any, Dict, List, Optional, Tuple
+
+from libs.common.metrics import timed
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+
+logger = logging.getLogger(__name__)
+
+# Sun elevations in degrees. Sunrise and sunset elevation accounts for
+# atmospheric refraction and the apparent radius of the sun.
+SUNRISE_ELEVATION = -0.833
+GOLDEN_HOUR_ELEVATION = 6.0
+
+# date.toordinal() + JULIAN_DAY_OFFSET is the Julian day at 00:00 UTC
+JULIAN_DAY_OFFSET = 1721424.5
+J2000 = 2451545.0
+SYNODIC_MONTH = 29.530588853
+# Julian day of the new moon on 2000-01-06 18:14 UTC
+REFERENCE_NEW_MOON = 2451550.26
+
+OUTPUT_DATE_TIME_FORMAT = '%Y-%m-%dT%H:%M'
+
+
+def get_tzinfo(timezone: str, utc_offset_seconds: int) -> tzinfo:
+    """
+    Get a timezone by its IANA name or a fixed-offset timezone if the name is unknown
+
+    IANA timezone database may be unavailable on some Kodi platforms.
+
+    :param timezone: IANA timezone name
+    :param utc_offset_seconds: UTC offset of the location
+    """
+    if ZoneInfo is not None:
+        try:
+            return ZoneInfo(timezone)
+        except (KeyError, ValueError):
+            logger.debug('Timezone %s is not available, using UTC offset %s',
+                         timezone, utc_offset_seconds)
+    return dt_timezone(timedelta(seconds=utc_offset_seconds))
+
+
+def _get_solar_parameters(julian_day: float) -> Tuple[float, float]:
+    """
+    Get solar declination and the equation of time
+
+    :return: (declination in radians, equation of time in minutes) tuple
+    """
+    t = (julian_day - J2000) / 36525
+    mean_longitude = math.radians((280.46646 + t * (36000.76983 + t * 0.0003032)) % 360)
+    mean_anomaly = math.radians(357.52911 + t * (35999.05029 - 0.0001537 * t))
+    eccentricity = 0.016708634 - t * (0.000042037 + 0.0000001267 * t)
+    center = (math.sin(mean_anomaly) * (1.914602 - t * (0.004817 + 0.000014 * t))
+              + math.sin(2 * mean_anomaly) * (0.019993 - 0.000101 * t)
+              + math.sin(3 * mean_anomaly) * 0.000289)
+    omega = math.radians(125.04 - 1934.136 * t)
+    apparent_longitude = math.radians(
+        math.degrees(mean_longitude) + center - 0.00569 - 0.00478 * math.sin(omega))
+    mean_obliquity = 23 + (26 + (21.448 - t * (46.815 + t * (0.00059 - t * 0.001813))) / 60) / 60
+    obliquity = math.radians(mean_obliquity + 0.00256 * math.cos(omega))
+    declination = math.asin(math.sin(obliquity) * math.sin(apparent_longitude))
+    y = math.tan(obliquity / 2) ** 2
+    equation_of_time = 4 * math.degrees(
+        y * math.sin(2 * mean_longitude)
+        - 2 * eccentricity * math.sin(mean_anomaly)
+        + 4 * eccentricity * y * math.sin(mean_anomaly) * math.cos(2 * mean_longitude)
+        - 0.5 * y * y * math.sin(4 * mean_longitude)
+        - 1.25 * eccentricity * eccentricity * math.sin(2 * mean_anomaly)
+    )
+    return declination, equation_of_time
+
+
+def _get_hour_angle(latitude: float, declination: float, elevation: float) -> float:
+    """
+    Get the hour angle in degrees at which the sun crosses the given elevation
+
+    :return: the hour angle, 0.0 if the sun is always below the elevation
+        or 180.0 if the sun is always above it
+    """
+    latitude = math.radians(latitude)
+    cos_hour_angle = ((math.sin(math.radians(elevation))
+                       - math.sin(latitude) * math.sin(declination))
+                      / (math.cos(latitude) * math.cos(declination)))
+    if cos_hour_angle >= 1.0:
+        return 0.0
+    if cos_hour_angle <= -1.0:
+        return 180.0
+    return math.degrees(math.acos(cos_hour_angle))
+
+
+def get_moon_phase(julian_day: float) -> float:
+    """
+    Get the moon phase
+
+    :return: the fraction of the synodic month: 0.0 - new moon, 0.25 - first quarter,
+        0.5 - full moon, 0.75 - last quarter
+    """
+    return ((julian_day - REFERENCE_NEW_MOON) / SYNODIC_MONTH) % 1.0
+
+
+def _format_event(day_start_utc: datetime, minutes: float, tz: tzinfo) -> str:
+    event_time = (day_start_utc + timedelta(minutes=minutes)).astimezone(tz)
+    return event_time.strftime(OUTPUT_DATE_TIME_FORMAT)
+
+
+def _get_event_pair(day_start_utc: datetime,
+                    solar_noon: float,
+                    hour_angle: float,
+                    tz: tzinfo) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Get the morning and evening times when the sun crosses an elevation
+
+    :return: (morning, evening) tuple, both ``None`` if the sun does not cross
+        the elevation, e.g. during polar day or night
+    """
+    if not 0.0 < hour_angle < 180.0:
+        return None, None
+    return (_format_event(day_start_utc, solar_noon - 4 * hour_angle, tz),
+            _format_event(day_start_utc, solar_noon + 4 * hour_angle, tz))
+
+
+def _get_day_astronomy(day: date, latitude: float, longitude: float, tz: tzinfo) -> List[Any]:
+    day_start_utc = datetime(day.year, day.month, day.day, tzinfo=dt_timezone.utc)
+    julian_day = day.toordinal() + JULIAN_DAY_OFFSET
+    _, equation_of_time = _get_solar_parameters(julian_day + 0.5 - longitude / 360)
+    solar_noon = 720 - 4 * longitude - equation_of_time
+    # Recalculate solar parameters at the actual solar noon for better accuracy
+    declination, equation_of_time = _get_solar_parameters(julian_day + solar_noon / 1440)
+    solar_noon = 720 - 4 * longitude - equation_of_time
+    sunrise_hour_angle = _get_hour_angle(latitude, declination, SUNRISE_ELEVATION)
+    golden_hour_angle = _get_hour_angle(latitude, declination, GOLDEN_HOUR_ELEVATION)
+    moon_phase = get_moon_phase(julian_day + solar_noon / 1440)
+    moon_illumination = (1 - math.cos(2 * math.pi * moon_phase)) / 2
+    # sunrise, sunset, day length, golden hour morning end, golden hour evening start,
+    # moon phase, moon illumination
+    return [*_get_event_pair(day_start_utc, solar_noon, sunrise_hour_angle, tz),
+            round(8 * sunrise_hour_angle * 60),
+            *_get_event_pair(day_start_utc, solar_noon, golden_hour_angle, tz),
+            round(moon_phase, 4), round(moon_illumination, 4)]
+
+
+ASTRONOMY_KEYS = ('sunrise', 'sunset', 'day_length', 'golden_hour_morning_end',
+                  'golden_hour_evening_start', 'moon_phase', 'moon_illumination')
+
+
+@timed('get_astronomy')
+def get_astronomy(latitude: float,
+                  longitude: float,
+                  tz: tzinfo,
+                  start_date: str,
+                  days: int) -> Dict[str, List[Any]]:
+    """
+    Calculate sun and moon data for a range of days
+
+    The calculation takes a fraction of a millisecond per day,
+    so results are not cached.
+
+    :param tz: location timezone, see :func:`get_tzinfo`
+    :param start_date: the first day in YYYY-MM-DD format
+    :param days: the number of days
+    :return: a dict of daily columns like in Open-Meteo responses: "time", "sunrise"
+        and "sunset" (local time in ISO 8601 format or ``None`` during polar day or night),
+        "day_length" (seconds), "golden_hour_morning_end", "golden_hour_evening_start",
+        "moon_phase" (see :func:`get_moon_phase`) and "moon_illumination" (0.0-1.0)
+    """
+    first_day = datetime.strptime(start_date, '%Y-%m-%d').date()
+    astronomy_info: Dict[str, List[Any]] = {key: [] for key in ('time',) + ASTRONOMY_KEYS}
+    for i in range(days):
+        day = first_day + timedelta(days=i)
+        astronomy_info['time'].append(day.strftime('%Y-%m-%d'))
+        for key, value in zip(ASTRONOMY_KEYS,
+                              _get_day_astronomy(day, latitude, longitude, tz)):
+            astronomy_info[key].append(value)
+    return astronomy_info
@@ -14,32 +14,87 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """Exception logger with extended diagnostic info"""
 
+import hashlib
 import inspect
 import logging
+import reprlib
 import sys
+import time
+from collections import deque
 from contextlib import contextmanager
 from platform import uname
 from pprint import pformat
-from typing import Any, Dict, Iterable, Optional
+from types import TracebackType
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
 
 import xbmc
+from xbmcgui import Window
 
 logger = logging.getLogger(__name__)
 
 
-def _format_vars(variables: Dict[str, Any]) -> str:
+class DiagnosticsBudget(NamedTuple):
+    """
+    Limits for the size and formatting time of exception diagnostic info
+
+    The last ``max_frames`` frames of a stack trace are formatted until
+    the total size or time limit is exceeded.
+    """
+    max_frames: int = 10
+    max_locals: int = 20
+    max_value_length: int = 300
+    max_size: int = 32 * 1024
+    max_seconds: float = 0.5
+    code_context: int = 1
+
+
+DEFAULT_BUDGET = DiagnosticsBudget()
+
+_value_repr = reprlib.Repr()
+_value_repr.maxlevel = 3
+_value_repr.maxdict = 10
+_value_repr.maxlist = 10
+_value_repr.maxtuple = 10
+_value_repr.maxset = 10
+_value_repr.maxstring = 200
+_value_repr.maxother = 200
+
+
+def _truncated_repr(value: Any, max_length: int) -> str:
+    try:
+        value_repr = _value_repr.repr(value)
+    except Exception:  # pylint: disable=broad-except
+        value_repr = f'<unrepresentable {type(value).__name__} object>'
+    if len(value_repr) > max_length:
+        value_repr = value_repr[:max_length] + '...'
+    return value_repr
+
+
+def _format_vars(variables: Dict[str, Any],
+                 budget: Optional[DiagnosticsBudget] = None) -> str:
     """
     Format variables dictionary
 
     :param variables: variables dict
+    :param budget: diagnostics budget. If ``None``, all variables are pretty-printed
+        without limits.
     :return: formatted string with sorted ``var = val`` pairs
     """
     var_list = [(var, val) for var, val in variables.items()
                 if not (var.startswith('__') or var.endswith('__'))]
     var_list.sort(key=lambda i: i[0])
+    omitted = 0
+    if budget is not None and len(var_list) > budget.max_locals:
+        omitted = len(var_list) - budget.max_locals
+        var_list = var_list[:budget.max_locals]
     lines = []
     for var, val in var_list:
-        lines.append(f'{var} = {pformat(val)}')
+        if budget is None:
+            lines.append(f'{var} = {pformat(val)}')
+        else:
+            lines.append(f'{var} = {_truncated_repr(val, budget.max_value_length)}')
+    if omitted:
+        lines.append(f'... {omitted} more variables omitted')
     return '\n'.join(lines)
 
 
@@ -66,12 +121,13 @@ Local variables:
 """
 
 
-def _format_frame_info(frame_info: inspect.FrameInfo) -> str:
+def _format_frame_info(frame_info: inspect.FrameInfo,
+                       budget: Optional[DiagnosticsBudget] = None) -> str:
     return FRAME_INFO_TEMPLATE.format(
         file_path=frame_info.filename,
         lineno=frame_info.lineno,
         code_context=_format_code_context(frame_info),
-        local_vars=_format_vars(frame_info.frame.f_locals)
+        local_vars=_format_vars(frame_info.frame.f_locals, budget)
     )
 
 
@@ -91,6 +147,34 @@ def _format_stack_trace(frames: Iterable[inspect.FrameInfo]) -> str:
     return STACK_TRACE_TEMPLATE.format(stack_trace=stack_trace)
 
 
+def _format_budgeted_stack_trace(frames: List[inspect.FrameInfo],
+                                 budget: DiagnosticsBudget,
+                                 total_frames: int) -> str:
+    """
+    Format the innermost stack frames within the size and time budget
+
+    :param frames: stack frames from the outermost to the innermost
+    :param budget: diagnostics budget
+    :param total_frames: the depth of the whole stack trace that ``frames`` may be cut from
+    """
+    start_time = time.monotonic()
+    formatted_frames = []
+    size = 0
+    # Format from the innermost frame because it is the most relevant one
+    for frame_info in reversed(frames[-budget.max_frames:]):
+        if size >= budget.max_size or time.monotonic() - start_time >= budget.max_seconds:
+            break
+        frame_text = _format_frame_info(frame_info, budget)
+        formatted_frames.append(frame_text[:budget.max_size - size])
+        size += len(frame_text)
+    omitted = total_frames - len(formatted_frames)
+    stack_trace = ''
+    if omitted:
+        stack_trace += f'... {omitted} outer frames omitted\n'
+    stack_trace += ''.join(reversed(formatted_frames))
+    return STACK_TRACE_TEMPLATE.format(stack_trace=stack_trace)
+
+
 EXCEPTION_TEMPLATE = """
 ####################################################################################################
                                      Exception Diagnostic Info
@@ -128,19 +212,48 @@ def format_trace(frames_to_exclude: int = 1) -> str:
     return _format_stack_trace(reversed(frames))
 
 
-def format_exception(exc_obj: Optional[Exception] = None) -> str:
+def _get_last_tracebacks(tb: Optional[TracebackType],
+                         max_frames: int) -> Tuple[Optional[TracebackType], int]:
+    """
+    Skip traceback entries except the last ``max_frames`` ones
+
+    Frame info with code context is expensive to get, so it is got
+    only for the frames that fit into the diagnostics budget.
+
+    :return: (the first kept traceback entry, the total number of entries) tuple
+    """
+    last_tracebacks = deque(maxlen=max_frames)
+    total_frames = 0
+    while tb is not None:
+        last_tracebacks.append(tb)
+        total_frames += 1
+        tb = tb.tb_next
+    return (last_tracebacks[0] if last_tracebacks else None), total_frames
+
+
+def format_exception(exc_obj: Optional[Exception] = None,
+                     budget: Optional[DiagnosticsBudget] = None) -> str:
     """
     Returns a pretty exception stack trace with code context and local variables
 
     :param exc_obj: exception object (optional)
+    :param budget: diagnostics budget (optional). If set, the number of frames
+        and local variables, the length of variable values and the total size
+        and formatting time of the stack trace are limited. Otherwise full
+        diagnostic info is returned.
     :raises ValueError: if no exception is being handled
     """
     if exc_obj is None:
         _, exc_obj, _ = sys.exc_info()
     if exc_obj is None:
         raise ValueError('No exception is currently being handled')
-    stack_trace = inspect.getinnerframes(exc_obj.__traceback__, context=5)
-    stack_trace_info = _format_stack_trace(stack_trace)
+    if budget is None:
+        stack_trace = inspect.getinnerframes(exc_obj.__traceback__, context=5)
+        stack_trace_info = _format_stack_trace(stack_trace)
+    else:
+        last_tb, total_frames = _get_last_tracebacks(exc_obj.__traceback__, budget.max_frames)
+        stack_trace = inspect.getinnerframes(last_tb, context=budget.code_context)
+        stack_trace_info = _format_budgeted_stack_trace(stack_trace, budget, total_frames)
     message = EXCEPTION_TEMPLATE.format(
         exc_type=exc_obj.__class__.__name__,
         exc=exc_obj,
@@ -154,8 +267,37 @@ def format_exception(exc_obj: Optional[Exception] = None) -> str:
     return message
 
 
+def _get_exception_signature(exc_obj: Exception) -> str:
+    tb = exc_obj.__traceback__
+    while tb is not None and tb.tb_next is not None:
+        tb = tb.tb_next
+    location = f'{tb.tb_frame.f_code.co_filename}:{tb.tb_lineno}' if tb is not None else ''
+    signature = f'{exc_obj.__class__.__name__}|{exc_obj}|{location}'
+    return hashlib.md5(signature.encode('utf-8')).hexdigest()
+
+
+def _is_repeated_exception(exc_obj: Exception, dedup_seconds: int) -> bool:
+    """
+    Check if an identical exception has been logged within the deduplication window
+
+    The last logging time is stored in a Home window property, so it is shared
+    between script invocations.
+    """
+    property_name = f'{__name__}.{_get_exception_signature(exc_obj)}'
+    home_window = Window(10000)
+    now = int(time.time())
+    last_logged = home_window.getProperty(property_name)
+    if last_logged and now - int(last_logged) < dedup_seconds:
+        return True
+    home_window.setProperty(property_name, str(now))
+    return False
+
+
 @contextmanager
-def catch_exception(logger_func=logger.error):
+def catch_exception(logger_func: Callable[..., Any] = logger.error,
+                    full_diagnostics: bool = False,
+                    budget: DiagnosticsBudget = DEFAULT_BUDGET,
+                    dedup_seconds: int = 600):
     """
     Diagnostic helper context manager
 
@@ -174,19 +316,30 @@ def catch_exception(logger_func=logger.error):
 
     After logging the diagnostic info the exception is re-raised.
 
+    By default diagnostic info is limited by ``budget``, and an exception identical
+    to one that has been logged within the last ``dedup_seconds`` is logged
+    as a single line.
+
     Example::
 
         with catch_exception():
             # Some risky code
             raise RuntimeError('Fatal error!')
 
-    :param logger_func: logger function that accepts a single argument
-        that is a log message.
+    :param logger_func: logger function that accepts a log message
+        and optional %-style message arguments, e.g. ``logger.error``.
+    :param full_diagnostics: log full diagnostic info without limits and deduplication.
+    :param budget: diagnostics size and time budget.
+    :param dedup_seconds: deduplication time window for repeated exceptions.
     """
     try:
         yield
     except Exception as exc:
-        message = format_exception(exc)
+        if not full_diagnostics and _is_repeated_exception(exc, dedup_seconds):
+            logger_func('Repeated unhandled exception %s: %s (diagnostic info has been logged '
+                        'within the last %s seconds)', exc.__class__.__name__, exc, dedup_seconds)
+            raise
+        message = format_exception(exc, budget=None if full_diagnostics else budget)
         # pylint: disable=logging-not-lazy
         logger_func('''
 *********************************** Unhandled exception detected ***********************************
@@ -17,15 +17,32 @@ import datetime
 import hashlib
 import json
 import logging
+import os
 import re
+import reprlib
+import threading
 import time
+from contextlib import contextmanager
 from functools import wraps
 from pathlib import Path
+from pprint import pformat
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:  # Other OSes
+    msvcrt = None
 
 import xbmc
 from xbmcaddon import Addon
 from xbmcvfs import translatePath
 
+from libs.common.metrics import count, span
+
 ADDON = Addon()
 ADDON_ID = ADDON.getAddonInfo('id')
 ADDON_NAME = ADDON.getAddonInfo('name')
@@ -36,6 +53,8 @@ PROFILE = Path(translatePath(ADDON.getAddonInfo('profile')))
 ICON = PATH / 'resources'/ 'images' / 'icon.png'
 BANNER = PATH / 'resources' / 'images' / 'banner.jpg'
 
+logger = logging.getLogger(__name__)
+
 LOG_FORMAT = '[{addon_id} v.{addon_version}] {filename}:{lineno} - {message}'
 
 
@@ -73,21 +92,101 @@ class KodiLogHandler(logging.Handler):
         xbmc.log(message, level=kodi_log_level)
 
 
+PAYLOAD_TRACE_FULL = 0
+PAYLOAD_TRACE_TRUNCATED = 1
+PAYLOAD_TRACE_SAMPLED = 2
+
+MAX_PAYLOAD_TRACE_LENGTH = 2000
+PAYLOAD_TRACE_SAMPLE_RATE = 10
+
+_payload_trace_mode = PAYLOAD_TRACE_FULL  # pylint: disable=invalid-name
+_payload_trace_counter = 0  # pylint: disable=invalid-name
+
+# Truncated payloads are formatted within these limits, so the formatting time
+# does not depend on the payload size
+_payload_repr = reprlib.Repr()
+_payload_repr.maxlevel = 4
+_payload_repr.maxdict = 30
+_payload_repr.maxlist = 24
+_payload_repr.maxtuple = 24
+_payload_repr.maxset = 24
+_payload_repr.maxstring = 200
+_payload_repr.maxother = 200
+
+
+def is_kodi_debug_logging_enabled() -> bool:
+    return xbmc.getCondVisibility('System.GetBool(debug.showloginfo)')
+
+
 def initialize_logging():
     """
     Initialize the root logger that writes to the Kodi log
 
+    The logging level is DEBUG if debug logging is enabled in Kodi settings,
+    and INFO otherwise, so debug messages that Kodi would discard are not formatted.
+
     After initialization, you can use Python logging facilities as usual.
     """
+    global _payload_trace_mode  # pylint: disable=global-statement
+    _payload_trace_mode = ADDON.getSettingInt('payload_trace')
     logging.basicConfig(
         format=LOG_FORMAT,
         style='{',
-        level=logging.DEBUG,
+        level=logging.DEBUG if is_kodi_debug_logging_enabled() else logging.INFO,
         handlers=[KodiLogHandler()],
         force=True
     )
 
 
+class LazyPayload:  # pylint: disable=too-few-public-methods
+    """
+    Pretty-format a payload only when a log record is actually emitted
+
+    :param payload: an object to format
+    :param max_length: the max length of the formatted payload (optional).
+        If set, the payload is formatted with :mod:`reprlib` limits
+        on nesting depth and the number of items instead of pretty-printing.
+    """
+    __slots__ = ('_payload', '_max_length')
+
+    def __init__(self, payload: Any, max_length: Optional[int] = None):
+        self._payload = payload
+        self._max_length = max_length
+
+    def __str__(self):
+        if self._max_length is None:
+            return pformat(self._payload)
+        text = _payload_repr.repr(self._payload)
+        if len(text) > self._max_length:
+            text = f'{text[:self._max_length]}... (truncated)'
+        return text
+
+
+def log_payload(target_logger: logging.Logger, message: str, *args: Any) -> None:
+    """
+    Log a debug message with a large payload, e.g. API response data
+
+    The payload is the last of ``args`` and it is formatted lazily according
+    to the "payload_trace" setting: in full, truncated, or only every
+    :data:`PAYLOAD_TRACE_SAMPLE_RATE`-th payload.
+
+    :param target_logger: a logger to write the message to
+    :param message: a log message with %-style placeholders
+    :param args: message arguments, the last one being a payload
+    """
+    global _payload_trace_counter  # pylint: disable=global-statement
+    if not target_logger.isEnabledFor(logging.DEBUG):
+        return
+    if _payload_trace_mode == PAYLOAD_TRACE_SAMPLED:
+        _payload_trace_counter += 1
+        if _payload_trace_counter % PAYLOAD_TRACE_SAMPLE_RATE != 1:
+            return
+    max_length = (MAX_PAYLOAD_TRACE_LENGTH if _payload_trace_mode == PAYLOAD_TRACE_TRUNCATED
+                  else None)
+    *message_args, payload = args
+    target_logger.debug(message, *message_args, LazyPayload(payload, max_length), stacklevel=2)
+
+
 class GettextEmulator:
     """
     Emulate GNU Gettext by mapping resource.language.en_gb UI strings to their numeric string IDs
@@ -173,24 +272,203 @@ class GettextEmulator:
         return ADDON.getLocalizedString(string_id)
 
 
-def cache_json(ttl_minutes=60):
+@contextmanager
+def file_lock(lock_path: Path):
+    """
+    Exclusive inter-process lock based on a lock file
+
+    The lock is also exclusive between threads of the same process
+    because each acquisition opens its own file descriptor.
+
+    :param lock_path: path to a lock file
+    """
+    with lock_path.open('a+b') as fo:
+        if fcntl is not None:
+            fcntl.flock(fo.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            fo.seek(0)
+            # LK_LOCK retries for 10 seconds before raising OSError
+            msvcrt.locking(fo.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fo.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                fo.seek(0)
+                msvcrt.locking(fo.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def get_cache_file(func_name: str) -> Path:
+    """
+    Get the path to a JSON cache file for a cached function
+
+    :param func_name: the name of a function decorated with :func:`cache_json`
+    :return: cache file path
+    """
+    return PROFILE / f'{func_name}_cache.json'
+
+
+def _cache_file_lock(func_name: str):
+    return file_lock(get_cache_file(func_name).with_suffix('.lock'))
+
+
+def load_json_cache(func_name: str) -> Dict[str, Any]:
+    """
+    Load JSON cache contents for a cached function
+
+    :param func_name: the name of a function decorated with :func:`cache_json`
+    :return: cache contents as a dict of ``{key: {'timestamp': int, 'data': Any}}``
+    """
+    cache_file = get_cache_file(func_name)
+    if not cache_file.exists():
+        return {}
+    with span('cache_read'), cache_file.open('r', encoding='utf-8') as fo:
+        try:
+            return json.load(fo)
+        except ValueError:
+            logger.warning('%s is corrupted, treating it as empty', cache_file.name)
+            return {}
+
+
+def save_json_cache(func_name: str, cache: Dict[str, Any]) -> None:
+    """
+    Save JSON cache contents for a cached function
+
+    The cache is written to a temporary file that replaces the cache file,
+    so concurrent readers never see a partially written cache.
+
+    :param func_name: the name of a function decorated with :func:`cache_json`
+    :param cache: cache contents
+    """
+    cache_file = get_cache_file(func_name)
+    temp_file = cache_file.with_name(
+        f'.{cache_file.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    with span('cache_write'):
+        with temp_file.open('w', encoding='utf-8') as fo:
+            json.dump(cache, fo)
+        os.replace(temp_file, cache_file)
+
+
+_cache_stats: Dict[str, Dict[str, int]] = {}
+_cache_stats_lock = threading.Lock()
+
+
+def get_cache_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Get cache hit statistics for cached functions in the current process
+
+    Statistics are not persisted. Cache hits and misses are also counted
+    as ``<func_name>.cache_hit`` and ``<func_name>.cache_miss`` counters
+    of the metrics record of a run (see :mod:`libs.common.metrics`).
+
+    :return: a dict of ``{func_name: {'hits': int, 'misses': int}}``
+    """
+    with _cache_stats_lock:
+        return {func_name: dict(func_stats) for func_name, func_stats in _cache_stats.items()}
+
+
+def _update_cache_stats(func_name: str, is_hit: bool) -> None:
+    count(f'{func_name}.cache_{"hit" if is_hit else "miss"}')
+    with _cache_stats_lock:
+        func_stats = _cache_stats.setdefault(func_name, {'hits': 0, 'misses': 0})
+        func_stats['hits' if is_hit else 'misses'] += 1
+        hits = func_stats['hits']
+        total = hits + func_stats['misses']
+    logger.debug('%s cache %s, hit rate: %d/%d (%.1f%%)', func_name,
+                 'hit' if is_hit else 'miss', hits, total, hits / total * 100)
+
+
+def cache_json(ttl_minutes: int = 60,  # pylint: disable=too-many-arguments
+               *,
+               max_entries: Optional[int] = None,
+               key_func: Optional[Callable[..., str]] = None,
+               ttl_factor: Optional[Callable[[], float]] = None,
+               ttl_func: Optional[Callable[[Any], float]] = None,
+               stale_on_error: Tuple[Type[Exception], ...] = ()):
+    """
+    Cache function results in a JSON file in the addon profile
+
+    :param ttl_minutes: cache entry time-to-live in minutes
+    :param max_entries: the max number of cache entries. If set, the least recently
+        written entries are evicted when the limit is exceeded. Cache hits
+        do not reorder entries, so reading from the cache never writes the cache file.
+    :param key_func: a function that accepts the same arguments as the decorated
+        function and returns a cache key. By default the key is built
+        from the string representation of the arguments.
+    :param ttl_factor: a function that returns a multiplier for ``ttl_minutes``,
+        e.g. to stretch TTL when API request budget is running low.
+    :param ttl_func: a function that accepts fetched data and returns
+        time-to-live in minutes for the new cache entry. ``ttl_minutes`` is used
+        for entries created without it.
+    :param stale_on_error: exception types on which an expired cache entry is returned
+        instead of re-raising the exception, if such entry exists.
+
+    Cache hits only read the cache file. Cache updates re-read and write the cache
+    file under a file lock, so concurrent processes and threads do not overwrite
+    each other's entries.
+
+    The decorated function gets ``evict`` attribute: a function that accepts
+    the same arguments and removes the respective cache entry.
+    """
     def outer_wrapper(func):
         @wraps(func)
         def inner_wrapper(*args, **kwargs):
-            cache = {}
-            cache_file = PROFILE / f'{func.__name__}_cache.json'
-            if cache_file.exists():
-                with cache_file.open('r', encoding='utf-8') as fo:
-                    cache = json.load(fo)
-            params = f'{args}_{kwargs}'
+            cache = load_json_cache(func.__name__)
+            if key_func is not None:
+                params = key_func(*args, **kwargs)
+            else:
+                params = f'{args}_{kwargs}'
             params_cache = cache.get(params)
             now = int(time.time())
-            if params_cache is not None and params_cache['timestamp'] + ttl_minutes * 60 > now:
+            ttl_seconds = ttl_minutes * 60
+            if params_cache is not None and 'ttl' in params_cache:
+                ttl_seconds = params_cache['ttl'] * 60
+            if params_cache is not None and ttl_factor is not None:
+                ttl_seconds *= ttl_factor()
+            if params_cache is not None and params_cache['timestamp'] + ttl_seconds > now:
+                _update_cache_stats(func.__name__, is_hit=True)
                 return params_cache['data']
-            data = func(*args, **kwargs)
-            cache[params] = {'timestamp': now, 'data': data}
-            with cache_file.open('w', encoding='utf-8') as fo:
-                json.dump(cache, fo)
+            _update_cache_stats(func.__name__, is_hit=False)
+            try:
+                data = func(*args, **kwargs)
+            except stale_on_error as exc:
+                if params_cache is None:
+                    raise
+                logger.warning('Using expired %s cache entry because of error: %s',
+                               func.__name__, exc)
+                return params_cache['data']
+            entry = {'timestamp': now, 'data': data}
+            if ttl_func is not None:
+                entry['ttl'] = ttl_func(data)
+            with _cache_file_lock(func.__name__):
+                # Re-read the cache so that entries written by concurrent callers are kept
+                cache = load_json_cache(func.__name__)
+                cache.pop(params, None)
+                cache[params] = entry
+                if max_entries is not None:
+                    while len(cache) > max_entries:
+                        del cache[next(iter(cache))]
+                save_json_cache(func.__name__, cache)
             return data
+
+        def evict(*args, **kwargs) -> bool:
+            """
+            Evict the cache entry for the given arguments
+
+            :return: ``True`` if the entry has been evicted
+            """
+            if key_func is not None:
+                params = key_func(*args, **kwargs)
+            else:
+                params = f'{args}_{kwargs}'
+            with _cache_file_lock(func.__name__):
+                cache = load_json_cache(func.__name__)
+                if cache.pop(params, None) is None:
+                    return False
+                save_json_cache(func.__name__, cache)
+            return True
+
+        inner_wrapper.evict = evict
         return inner_wrapper
     return outer_wrapper
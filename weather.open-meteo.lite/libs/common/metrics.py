@@ -0,0 +1,226 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Lightweight per-phase timing instrumentation
+
+Timings of named spans and named event counters are accumulated during a run
+(one script invocation) and appended as a JSON line to a metrics file
+that is rotated by size. When no run is being recorded, spans and counters are no-op.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_METRICS_FILE_SIZE = 256 * 1024
+PERCENTILES = (50, 90, 99)
+
+_NULL_SPAN = nullcontext()
+
+
+class _RunMetrics:
+
+    def __init__(self, label: str):
+        self.label = label
+        self.timestamp = int(time.time())
+        self.spans: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, duration: float) -> None:
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + duration
+
+    def increment(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+
+_current_run: Optional[_RunMetrics] = None  # pylint: disable=invalid-name
+
+
+class _Span:
+    __slots__ = ('_run', '_name', '_start')
+
+    def __init__(self, run: _RunMetrics, name: str):
+        self._run = run
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._run.add(self._name, time.perf_counter() - self._start)
+
+
+def span(name: str):
+    """
+    Measure execution time of a code block
+
+    Durations of spans with the same name are summed within a run.
+
+    Example::
+
+        with span('http'):
+            response = requests.get(url)
+
+    :param name: span name
+    :return: a context manager
+    """
+    if _current_run is None:
+        return _NULL_SPAN
+    return _Span(_current_run, name)
+
+
+def timed(name: str):
+    """
+    Measure execution time of the decorated function as a span
+
+    :param name: span name
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_run is None:
+                return func(*args, **kwargs)
+            with _Span(_current_run, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str) -> None:
+    """
+    Increment a named event counter of the current run, e.g. cache hits
+
+    :param name: counter name
+    """
+    run = _current_run
+    if run is not None:
+        run.increment(name)
+
+
+def _rotate_metrics_file(metrics_file: Path) -> None:
+    if metrics_file.exists() and metrics_file.stat().st_size > MAX_METRICS_FILE_SIZE:
+        os.replace(metrics_file, metrics_file.with_name(metrics_file.name + '.1'))
+
+
+@contextmanager
+def record_run(label: str, metrics_file: Path, enabled: bool = True):
+    """
+    Record span timings for a run and append them to a metrics file
+
+    :param label: run label, e.g. a location ID
+    :param metrics_file: path to a JSON-lines metrics file
+    :param enabled: if ``False``, nothing is recorded
+    """
+    global _current_run  # pylint: disable=global-statement
+    if not enabled:
+        yield
+        return
+    _current_run = run = _RunMetrics(label)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current_run = None
+        run.spans['total'] = time.perf_counter() - start
+        record = {
+            'label': run.label,
+            'timestamp': run.timestamp,
+            'spans': {name: round(duration * 1000, 3) for name, duration in run.spans.items()},
+        }
+        if run.counters:
+            record['counters'] = run.counters
+        try:
+            _rotate_metrics_file(metrics_file)
+            with metrics_file.open('a', encoding='utf-8') as fo:
+                fo.write(json.dumps(record) + '\n')
+        except OSError:
+            logger.exception('Unable to write metrics to %s', metrics_file)
+
+
+def _load_recent_runs(metrics_file: Path, max_runs: int) -> List[dict]:
+    lines = []
+    for path in (metrics_file.with_name(metrics_file.name + '.1'), metrics_file):
+        if path.exists():
+            with path.open('r', encoding='utf-8') as fo:
+                lines.extend(fo.readlines())
+    runs = []
+    for line in lines[-max_runs:]:
+        try:
+            runs.append(json.loads(line))
+        except ValueError:
+            continue
+    return runs
+
+
+def _percentile(sorted_values: List[float], percentile: int) -> float:
+    # Nearest-rank method
+    index = max(0, -(-len(sorted_values) * percentile // 100) - 1)
+    return sorted_values[index]
+
+
+def summarize_metrics(metrics_file: Path, max_runs: int = 100) -> Optional[str]:
+    """
+    Summarize span timings over recent runs
+
+    :param metrics_file: path to a JSON-lines metrics file
+    :param max_runs: the number of the most recent runs to summarize
+    :return: a text table with span timing percentiles in milliseconds
+        or ``None`` if there are no recorded runs
+    """
+    runs = _load_recent_runs(metrics_file, max_runs)
+    if not runs:
+        return None
+    span_values: Dict[str, List[float]] = {}
+    for run in runs:
+        for name, duration in run['spans'].items():
+            span_values.setdefault(name, []).append(duration)
+    header = 'span'.ljust(28) + 'count'.rjust(7) + ''.join(
+        f'p{percentile}, ms'.rjust(11) for percentile in PERCENTILES) + 'max, ms'.rjust(11)
+    lines = [f'Runs: {len(runs)}', header]
+    for name in sorted(span_values, key=lambda n: (n == 'total', n)):
+        values = sorted(span_values[name])
+        line = name.ljust(28) + str(len(values)).rjust(7)
+        for percentile in PERCENTILES:
+            line += f'{_percentile(values, percentile):.1f}'.rjust(11)
+        line += f'{values[-1]:.1f}'.rjust(11)
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def sum_counters(metrics_file: Path, max_runs: int = 100) -> Dict[str, int]:
+    """
+    Sum event counters over recent runs
+
+    :param metrics_file: path to a JSON-lines metrics file
+    :param max_runs: the number of the most recent runs to sum
+    :return: a dict of ``{counter_name: total}``
+    """
+    totals: Dict[str, int] = {}
+    for run in _load_recent_runs(metrics_file, max_runs):
+        for name, value in run.get('counters', {}).items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
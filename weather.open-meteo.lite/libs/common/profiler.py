@@ -0,0 +1,123 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Opt-in cProfile and tracemalloc capture for script invocations"""
+
+import cProfile
+import logging
+import time
+import tracemalloc
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SUFFIX = '.prof'
+TRACEMALLOC_SUFFIX = '.tracemalloc.txt'
+TOP_ALLOCATIONS = 30
+
+
+def _rotate_files(directory: Path, suffix: str, max_files: int) -> None:
+    files = sorted(directory.glob(f'*{suffix}'), key=lambda path: path.stat().st_mtime)
+    for path in files[:-max_files]:
+        path.unlink()
+
+
+def _format_tracemalloc_snapshot(snapshot: tracemalloc.Snapshot, peak_size: int) -> str:
+    lines = [f'Peak traced memory: {peak_size / 1024:.1f} KiB',
+             f'Top {TOP_ALLOCATIONS} allocations by line:']
+    for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+        lines.append(str(stat))
+    return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def profile_run(profiles_dir: Path,
+                label: str,
+                use_cprofile: bool = False,
+                use_tracemalloc: bool = False,
+                max_files: int = 20):
+    """
+    Capture cProfile stats and/or tracemalloc top allocations within the context
+
+    Results are saved to ``profiles_dir`` as ``<timestamp>_<label>.prof`` and
+    ``<timestamp>_<label>.tracemalloc.txt`` files. Only ``max_files`` newest files
+    of each kind are kept.
+
+    :param profiles_dir: directory for profiling results
+    :param label: invocation label that is added to file names
+    :param use_cprofile: capture cProfile stats
+    :param use_tracemalloc: capture tracemalloc snapshot
+    :param max_files: the max number of files of each kind to keep
+    """
+    if not (use_cprofile or use_tracemalloc):
+        yield
+        return
+    profiler: Optional[cProfile.Profile] = None
+    if use_tracemalloc:
+        tracemalloc.start()
+    if use_cprofile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        snapshot = None
+        peak_size = 0
+        if use_tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak_size = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        profiles_dir.mkdir(parents=True, exist_ok=True)
+        file_stem = f'{time.strftime("%Y%m%d-%H%M%S")}_{label}'
+        if profiler is not None:
+            profiler.dump_stats(str(profiles_dir / (file_stem + PROFILE_SUFFIX)))
+            _rotate_files(profiles_dir, PROFILE_SUFFIX, max_files)
+        if snapshot is not None:
+            snapshot = snapshot.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ))
+            tracemalloc_file = profiles_dir / (file_stem + TRACEMALLOC_SUFFIX)
+            with tracemalloc_file.open('w', encoding='utf-8') as fo:
+                fo.write(_format_tracemalloc_snapshot(snapshot, peak_size))
+            _rotate_files(profiles_dir, TRACEMALLOC_SUFFIX, max_files)
+        logger.debug('Profiling results for "%s" are saved to %s', label, profiles_dir)
+
+
+def bundle_profiles(profiles_dir: Path,
+                    bundle_path: Path,
+                    extra_files: Iterable[Path] = ()) -> Optional[Path]:
+    """
+    Pack profiling results into a ZIP file for uploading
+
+    :param profiles_dir: directory with profiling results
+    :param bundle_path: path to the ZIP file to create
+    :param extra_files: additional files to include in the bundle, e.g. metrics logs
+    :return: the bundle path or ``None`` if there is nothing to bundle
+    """
+    files = []
+    if profiles_dir.exists():
+        files.extend(sorted(profiles_dir.glob(f'*{PROFILE_SUFFIX}')))
+        files.extend(sorted(profiles_dir.glob(f'*{TRACEMALLOC_SUFFIX}')))
+    if not files:
+        return None
+    files.extend(path for path in extra_files if path.exists())
+    with zipfile.ZipFile(bundle_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for path in files:
+            zf.write(path, arcname=path.name)
+    return bundle_path
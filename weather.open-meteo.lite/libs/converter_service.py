@@ -190,12 +190,46 @@ def get_wind_direction(direction_degrees: int) -> str:
     return WIND_DIRECTION_MAP[direction_code]
 
 
+MOON_PHASE_LABELS = [
+    _('New moon'),
+    _('Waxing crescent'),
+    _('First quarter'),
+    _('Waxing gibbous'),
+    _('Full moon'),
+    _('Waning gibbous'),
+    _('Last quarter'),
+    _('Waning crescent'),
+]
+
+
+def get_moon_phase_label(moon_phase: float) -> str:
+    return MOON_PHASE_LABELS[round(moon_phase * 8) % 8]
+
+
+def get_day_length(day_length_seconds: int) -> str:
+    hours, minutes = divmod(round(day_length_seconds / 60), 60)
+    return f'{hours}:{minutes:02d}'
+
+
 def get_temperature(temperature_celc: int, temperature_unit: str) -> str:
     if temperature_unit == '°F':
         return str(round((temperature_celc * 9 / 5) + 32)) + temperature_unit
     return str(temperature_celc) + '°C'
 
 
+def get_temperature_difference(difference_celc: float, temperature_unit: str) -> str:
+    if temperature_unit == '°F':
+        difference = round(difference_celc * 9 / 5)
+    else:
+        difference = round(difference_celc)
+        temperature_unit = '°C'
+    return f'{difference:+d}{temperature_unit}'
+
+
+def get_precipitation(precipitation_mm: float) -> str:
+    return f'{round(precipitation_mm, 1)} {_("mm")}'
+
+
 def _wind_speed_to_beaufort(wind_speed_kmh: float) -> int:
     if wind_speed_kmh < 1:
         return 0  # Calm
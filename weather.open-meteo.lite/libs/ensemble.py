@@ -0,0 +1,257 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Aggregation of multi-model forecasts
+
+When several models are requested with the ``models`` parameter, Open-Meteo
+returns a separate column for each model, e.g. ``temperature_2m_icon_seamless``.
+Model columns of each variable are aggregated into a single column with the plain
+variable name, so the rest of the addon handles ensemble forecasts
+like single-model ones. Additional columns describe model agreement:
+
+* ``<variable>_spread``: the difference between the max and min model values
+  for temperatures.
+* ``weather_code_agreement``: the fraction of models that agree on the weather code.
+* ``confidence``: forecast confidence from 0.0 to 1.0 based on weather code
+  agreement and temperature spread.
+"""
+
+import logging
+import math
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Temperature spread between models at which forecast confidence drops to 0
+MAX_TEMPERATURE_SPREAD = 8.0
+
+SPREAD_VARIABLES = ('temperature_2m', 'temperature_2m_max', 'temperature_2m_min')
+CONFIDENCE_TEMPERATURE_VARIABLES = ('temperature_2m', 'temperature_2m_max')
+
+
+def parse_models(models_setting: str) -> List[str]:
+    """
+    Parse a comma-separated list of Open-Meteo weather models
+
+    :return: the list of model names. Ensemble mode requires at least 2 models.
+    """
+    return list(dict.fromkeys(model.strip() for model in models_setting.split(',')
+                              if model.strip()))
+
+
+def _has_nulls(columns: List[List[Any]]) -> bool:
+    return any(None in column for column in columns)
+
+
+def _median_of_sorted(values: List[Any]) -> Any:
+    if not values:
+        return None
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def _median_column(columns: List[List[Any]]) -> List[Any]:
+    """
+    Get medians of model values for each row
+
+    Integer variables, e.g. humidity, keep integer medians.
+    """
+    first_value = next((value for column in columns for value in column if value is not None),
+                       None)
+    if _has_nulls(columns):
+        medians = [_median_of_sorted(sorted(value for value in values if value is not None))
+                   for values in zip(*columns)]
+    elif len(columns) % 2:
+        middle = len(columns) // 2
+        medians = [sorted(values)[middle] for values in zip(*columns)]
+    else:
+        middle = len(columns) // 2
+        medians = [(values[middle - 1] + values[middle]) / 2
+                   for values in map(sorted, zip(*columns))]
+    if isinstance(first_value, int):
+        return [round(median) if median is not None else None for median in medians]
+    return medians
+
+
+def _spread_column(columns: List[List[Any]]) -> List[Optional[float]]:
+    if not _has_nulls(columns):
+        return [max(values) - min(values) for values in zip(*columns)]
+    spreads = []
+    for values in zip(*columns):
+        values = [value for value in values if value is not None]
+        spreads.append(max(values) - min(values) if values else None)
+    return spreads
+
+
+def _circular_mean_column(columns: List[List[Any]]) -> List[Optional[int]]:
+    # Sines and cosines are calculated once per model column
+    sin_columns = [[math.sin(math.radians(value)) if value is not None else None
+                    for value in column] for column in columns]
+    cos_columns = [[math.cos(math.radians(value)) if value is not None else None
+                    for value in column] for column in columns]
+    means = []
+    for sin_values, cos_values in zip(zip(*sin_columns), zip(*cos_columns)):
+        sin_values = [value for value in sin_values if value is not None]
+        if not sin_values:
+            means.append(None)
+            continue
+        cos_sum = sum(value for value in cos_values if value is not None)
+        means.append(round(math.degrees(math.atan2(sum(sin_values), cos_sum))) % 360)
+    return means
+
+
+def _first_column(columns: List[List[Any]]) -> List[Any]:
+    if not _has_nulls(columns):
+        return list(columns[0])
+    return [next((value for value in values if value is not None), None)
+            for values in zip(*columns)]
+
+
+def _aggregate_weather_codes(columns: List[List[Any]],
+                             section: Dict[str, Any]) -> None:
+    codes = []
+    agreement = []
+    has_nulls = _has_nulls(columns)
+    for values in zip(*columns):
+        if has_nulls:
+            values = tuple(value for value in values if value is not None)
+            if not values:
+                codes.append(None)
+                agreement.append(None)
+                continue
+        # The first of equally common codes wins
+        code = max(values, key=values.count)
+        codes.append(code)
+        agreement.append(values.count(code) / len(values))
+    section['weather_code'] = codes
+    section['weather_code_agreement'] = agreement
+
+
+def _get_confidence(agreement: Optional[float], spread: Optional[float]) -> Optional[float]:
+    if agreement is None:
+        return None
+    if spread is None:
+        return agreement
+    return agreement * max(0.0, 1.0 - spread / MAX_TEMPERATURE_SPREAD)
+
+
+def _group_model_columns(section: Dict[str, Any],
+                         models: List[str]) -> Dict[str, List[Any]]:
+    """
+    Group model columns by variable
+
+    Columns without any values, e.g. variables that a model does not provide,
+    are dropped, so they do not affect aggregation. If no model provides
+    a variable, it gets a single all-null column.
+    """
+    grouped_columns: Dict[str, List[Any]] = {}
+    for key in list(section):
+        for model in models:
+            if key.endswith(f'_{model}'):
+                variable = key[:-len(model) - 1]
+                grouped_columns.setdefault(variable, []).append(section.pop(key))
+                break
+    for variable, columns in grouped_columns.items():
+        grouped_columns[variable] = ([column for column in columns
+                                      if any(value is not None for value in column)]
+                                     or columns[:1])
+    return grouped_columns
+
+
+def _aggregate_section(section: Dict[str, Any], models: List[str]) -> None:
+    grouped_columns = _group_model_columns(section, models)
+    for variable, columns in grouped_columns.items():
+        if variable == 'weather_code':
+            _aggregate_weather_codes(columns, section)
+            continue
+        if variable.startswith('wind_direction'):
+            aggregate = _circular_mean_column
+        elif variable == 'is_day':
+            aggregate = _first_column
+        else:
+            aggregate = _median_column
+        section[variable] = aggregate(columns)
+        if variable in SPREAD_VARIABLES:
+            section[f'{variable}_spread'] = _spread_column(columns)
+    if 'weather_code_agreement' in section:
+        temperature_spread = next(
+            (section[f'{variable}_spread'] for variable in CONFIDENCE_TEMPERATURE_VARIABLES
+             if f'{variable}_spread' in section),
+            [None] * len(section['weather_code_agreement'])
+        )
+        section['confidence'] = [
+            _get_confidence(agreement, spread)
+            for agreement, spread in zip(section['weather_code_agreement'], temperature_spread)
+        ]
+
+
+def _get_complete_rows_count(section: Dict[str, Any], variables: List[str]) -> int:
+    """
+    Get the number of leading rows that have values of all aggregated variables
+
+    Rows without values of some variable in all models are usually at the end
+    of a series, beyond the forecast horizon of the requested models.
+    """
+    rows_count = len(section.get('time', []))
+    for variable in variables:
+        column = section[variable]
+        if None in column:
+            rows_count = min(rows_count, column.index(None))
+    return rows_count
+
+
+def aggregate_models(forecast_info: Dict[str, Any], models: List[str]) -> Dict[str, Any]:
+    """
+    Aggregate per-model columns of a multi-model forecast in place
+
+    Each variable is aggregated column-wise over its model columns:
+    the median for numeric values, the circular mean for wind directions
+    and the most common value for weather codes.
+
+    Hourly and daily series are cut before the first row where all models
+    lack a value of some variable, so aggregated series contain no nulls.
+    Current values that no model provides are taken from the first hour.
+
+    :param forecast_info: Forecast API response for several models
+    :param models: model names used in the request
+    :return: the same forecast dict with aggregated columns
+    """
+    for section_name in ('hourly', 'daily'):
+        if section_name not in forecast_info:
+            continue
+        section = forecast_info[section_name]
+        variables = [key[:-len(model) - 1] for key in section for model in models
+                     if key.endswith(f'_{model}')]
+        _aggregate_section(section, models)
+        rows_count = _get_complete_rows_count(section, list(dict.fromkeys(variables)))
+        if rows_count < len(section.get('time', [])):
+            logger.debug('%s ensemble forecast is cut to %s rows with values from all models',
+                         section_name, rows_count)
+            for key, values in section.items():
+                section[key] = values[:rows_count]
+    if 'current' in forecast_info:
+        # Current values are scalars, so they are aggregated as one-row columns
+        current_info = forecast_info['current']
+        columns = {key: [value] for key, value in current_info.items()}
+        _aggregate_section(columns, models)
+        hourly_info = forecast_info.get('hourly', {})
+        forecast_info['current'] = {
+            key: values[0] if values[0] is not None or not hourly_info.get(key)
+            else hourly_info[key][0]
+            for key, values in columns.items()
+        }
+    return forecast_info
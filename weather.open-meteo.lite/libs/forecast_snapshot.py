@@ -0,0 +1,225 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Processed forecast snapshots for other addons and widgets
+
+After each successful population the addon writes a snapshot of the converted
+weather properties for a location to ``snapshots/<location_id>.json``
+in the addon profile. A snapshot is a JSON object::
+
+    {
+        "version": 1,
+        "sequence": 42,
+        "timestamp": 1718000000,
+        "location_id": "location1",
+        "location": "Kyiv",
+        "latitude": 50.45,
+        "longitude": 30.52,
+        "timezone": "Europe/Kyiv",
+        "properties": {"Current.Temperature": "21", "Hourly.1.Time": "14:00", ...}
+    }
+
+Property names and values are the same as in the Weather window (id=12600).
+Snapshot files are replaced atomically, so readers never see partial data.
+
+Snapshots are also written when weather data are pre-fetched in background,
+so the ID of the location that was last shown in the Weather window
+is stored separately in ``snapshots/current`` text file.
+
+This module depends only on the Python standard library and the Kodi
+``xbmcvfs`` module, so other addons can use it to read snapshots::
+
+    reader = SnapshotReader()
+    snapshot = reader.read()  # None if the snapshot has not changed since the last read
+    if snapshot is not None:
+        hourly_rows = get_rows(snapshot, 'Hourly')
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+SNAPSHOT_VERSION = 1
+SNAPSHOTS_PATH = 'special://profile/addon_data/weather.open-meteo.lite/snapshots'
+CURRENT_LOCATION_FILE_NAME = 'current'
+
+
+def _get_snapshot_path(snapshots_dir: Path, location_id: str) -> Path:
+    return snapshots_dir / f'{location_id}.json'
+
+
+def _replace_file(path: Path, content: str) -> None:
+    temp_path = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    with temp_path.open('w', encoding='utf-8') as fo:
+        fo.write(content)
+    os.replace(temp_path, path)
+
+
+def write_current_location(snapshots_dir: Path, location_id: str) -> None:
+    """
+    Store the ID of the location that is shown in the Weather window
+
+    :param snapshots_dir: directory with snapshot files
+    :param location_id: location ID, e.g. "location1"
+    """
+    snapshots_dir.mkdir(parents=True, exist_ok=True)
+    _replace_file(snapshots_dir / CURRENT_LOCATION_FILE_NAME, location_id)
+
+
+def read_current_location(snapshots_dir: Path) -> Optional[str]:
+    """
+    Read the ID of the location that is shown in the Weather window
+
+    :param snapshots_dir: directory with snapshot files
+    :return: location ID or ``None`` if it has not been stored yet
+    """
+    try:
+        location_id = (snapshots_dir / CURRENT_LOCATION_FILE_NAME).read_text(
+            encoding='utf-8').strip()
+    except OSError:
+        return None
+    return location_id or None
+
+
+def load_snapshot(snapshot_path: Path) -> Optional[Dict[str, Any]]:
+    """
+    Load a snapshot file
+
+    :param snapshot_path: path to a snapshot file
+    :return: snapshot dict or ``None`` if the file is missing, invalid
+        or has an unsupported version
+    """
+    try:
+        with snapshot_path.open('r', encoding='utf-8') as fo:
+            snapshot = json.load(fo)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+
+def write_snapshot(snapshots_dir: Path,
+                   location_id: str,
+                   location_name: str,
+                   properties: Dict[str, str],
+                   location_key: Tuple[float, float, str]) -> None:
+    """
+    Atomically write a snapshot of converted weather properties for a location
+
+    :param snapshots_dir: directory for snapshot files
+    :param location_id: location ID, e.g. "location1"
+    :param location_name: location name
+    :param properties: weather properties as set to the Weather window
+    :param location_key: (latitude, longitude, timezone) tuple of the location,
+        so that a snapshot can be matched with current location settings
+    """
+    snapshots_dir.mkdir(parents=True, exist_ok=True)
+    snapshot_path = _get_snapshot_path(snapshots_dir, location_id)
+    previous_snapshot = load_snapshot(snapshot_path)
+    sequence = previous_snapshot['sequence'] + 1 if previous_snapshot is not None else 1
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'sequence': sequence,
+        'timestamp': int(time.time()),
+        'location_id': location_id,
+        'location': location_name,
+        'latitude': location_key[0],
+        'longitude': location_key[1],
+        'timezone': location_key[2],
+        'properties': properties,
+    }
+    _replace_file(snapshot_path, json.dumps(snapshot, ensure_ascii=False))
+
+
+def get_rows(snapshot: Dict[str, Any], prefix: str) -> List[Dict[str, str]]:
+    """
+    Group numbered snapshot properties, e.g. "Hourly.1.Temperature", into rows
+
+    :param snapshot: snapshot dict
+    :param prefix: row prefix: "Hourly" or "Daily"
+    :return: the list of rows ordered by their numbers. Each row is a dict
+        of property names without the prefix and the number, e.g. "Temperature".
+    """
+    pattern = re.compile(rf'^{re.escape(prefix)}\.(\d+)\.(.+)$')
+    rows: Dict[int, Dict[str, str]] = {}
+    for prop, value in snapshot['properties'].items():
+        if (match := pattern.match(prop)) is not None:
+            rows.setdefault(int(match.group(1)), {})[match.group(2)] = value
+    return [rows[number] for number in sorted(rows)]
+
+
+class SnapshotReader:  # pylint: disable=too-few-public-methods
+    """
+    Read processed forecast snapshots skipping unchanged ones
+
+    :param snapshots_dir: directory with snapshot files. By default the directory
+        in the Open-Meteo Lite addon profile is used.
+    :param location_id: location ID, e.g. "location1". By default the snapshot
+        for the location that was last shown in the Weather window is read
+        or, if it is not known, the most recently updated snapshot.
+    """
+
+    def __init__(self, snapshots_dir: Optional[Path] = None, location_id: Optional[str] = None):
+        if snapshots_dir is None:
+            from xbmcvfs import translatePath  # pylint: disable=import-outside-toplevel
+            snapshots_dir = Path(translatePath(SNAPSHOTS_PATH))
+        self._snapshots_dir = snapshots_dir
+        self._location_id = location_id
+        self._last_path: Optional[Path] = None
+        self._last_mtime_ns = 0
+        self._last_sequence = 0
+
+    def _find_snapshot(self) -> Optional[Tuple[Path, os.stat_result]]:
+        location_id = self._location_id or read_current_location(self._snapshots_dir)
+        if location_id is not None:
+            path = _get_snapshot_path(self._snapshots_dir, location_id)
+            try:
+                return path, path.stat()
+            except OSError:
+                return None
+        snapshots = []
+        for path in self._snapshots_dir.glob('location*.json'):
+            try:
+                snapshots.append((path, path.stat()))
+            except OSError:
+                continue
+        return max(snapshots, key=lambda snapshot: snapshot[1].st_mtime_ns, default=None)
+
+    def read(self) -> Optional[Dict[str, Any]]:
+        """
+        Read a snapshot if it has changed since the last read
+
+        :return: snapshot dict or ``None`` if the snapshot is missing or unchanged
+        """
+        found = self._find_snapshot()
+        if found is None:
+            return None
+        path, stat = found
+        if path == self._last_path and stat.st_mtime_ns == self._last_mtime_ns:
+            return None
+        snapshot = load_snapshot(path)
+        if snapshot is None:
+            return None
+        if path == self._last_path and snapshot['sequence'] == self._last_sequence:
+            return None
+        self._last_path = path
+        self._last_mtime_ns = stat.st_mtime_ns
+        self._last_sequence = snapshot['sequence']
+        return snapshot
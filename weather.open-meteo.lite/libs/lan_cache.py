@@ -0,0 +1,235 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+LAN cache server that shares Open-Meteo responses between Kodi instances at one site
+
+Client instances send the same requests that they would send to Open-Meteo
+to ``http://<server>:<port>/v1/<endpoint>``. The server caches responses in memory
+and makes only one upstream call for concurrent identical requests.
+By default only clients from private networks are served.
+"""
+
+import ipaddress
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Tuple, Union
+from urllib.parse import parse_qsl, urlsplit
+
+from libs.open_meteo_api import (
+    AIR_QUALITY_API_URL,
+    FORECAST_API_URL,
+    GEOCODING_API_URL,
+    GEOCODING_CACHE_TTL_MINUTES,
+    API_ENDPOINT_NAMES,
+    call_open_meteo,
+)
+
+logger = logging.getLogger(__name__)
+
+LAN_CACHE_TTL_MINUTES = {
+    FORECAST_API_URL: 30,
+    AIR_QUALITY_API_URL: 60,
+    GEOCODING_API_URL: GEOCODING_CACHE_TTL_MINUTES,
+}
+LAN_CACHE_MAX_ENTRIES = 200
+
+IpNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+class CoalescingCache:
+    """
+    In-memory TTL and LRU cache that coalesces concurrent requests for the same key
+
+    :param max_entries: the max number of cache entries
+    """
+
+    def __init__(self, max_entries: int = LAN_CACHE_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+        # Per-key locks with the number of threads that use them
+        self._key_locks: Dict[str, Tuple[threading.Lock, int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get_fresh(self, key: str) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.time():
+            # Move the entry to the end as the most recently used one
+            self._entries[key] = self._entries.pop(key)
+            return True, entry[1]
+        return False, None
+
+    def _add(self, key: str, ttl_seconds: float, data: Any) -> None:
+        now = time.time()
+        for expired_key in [entry_key for entry_key, (expires_at, _) in self._entries.items()
+                            if expires_at <= now]:
+            del self._entries[expired_key]
+        self._entries.pop(key, None)
+        self._entries[key] = (now + ttl_seconds, data)
+        while len(self._entries) > self._max_entries:
+            del self._entries[next(iter(self._entries))]
+
+    def _acquire_key_lock(self, key: str) -> threading.Lock:
+        key_lock, users = self._key_locks.get(key, (None, 0))
+        if key_lock is None:
+            key_lock = threading.Lock()
+        self._key_locks[key] = (key_lock, users + 1)
+        return key_lock
+
+    def _release_key_lock(self, key: str) -> None:
+        key_lock, users = self._key_locks[key]
+        if users > 1:
+            self._key_locks[key] = (key_lock, users - 1)
+        else:
+            # Nobody holds or waits for the lock
+            del self._key_locks[key]
+
+    def get(self, key: str, ttl_seconds: float, fetch: Callable[[], Any]) -> Any:
+        """
+        Get cached data or fetch them
+
+        If several threads request the same missing key, only one of them calls
+        ``fetch``, and the others wait for its result.
+
+        :param key: cache key
+        :param ttl_seconds: cache entry time-to-live
+        :param fetch: a function that fetches data
+        :return: cached or fetched data
+        """
+        with self._lock:
+            is_fresh, data = self._get_fresh(key)
+            if is_fresh:
+                return data
+            key_lock = self._acquire_key_lock(key)
+        try:
+            with key_lock:
+                with self._lock:
+                    is_fresh, data = self._get_fresh(key)
+                if is_fresh:
+                    return data
+                data = fetch()
+                with self._lock:
+                    self._add(key, ttl_seconds, data)
+        finally:
+            with self._lock:
+                self._release_key_lock(key)
+        return data
+
+
+class LanCacheRequestHandler(BaseHTTPRequestHandler):
+    server: 'LanCacheServer'
+
+    def _send_json(self, status: int, data: Any) -> None:
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        url_parts = urlsplit(self.path)
+        upstream_url = self.server.endpoints.get(url_parts.path)
+        if upstream_url is None:
+            self._send_json(404, {'error': True, 'reason': 'Unknown endpoint'})
+            return
+        params = dict(parse_qsl(url_parts.query))
+        cache_key = f'{url_parts.path}?{sorted(params.items())}'
+        try:
+            data = self.server.cache.get(
+                cache_key,
+                LAN_CACHE_TTL_MINUTES[upstream_url] * 60,
+                lambda: call_open_meteo(upstream_url, params)
+            )
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.error('Unable to get data from Open-Meteo for a LAN client: %s', exc)
+            self._send_json(502, {'error': True, 'reason': str(exc)})
+            return
+        self._send_json(200, data)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logger.debug('LAN cache request from %s: ' + format, self.address_string(), *args)
+
+
+def parse_allowed_clients(allowed_clients: str) -> List[IpNetwork]:
+    """
+    Parse a comma-separated list of allowed client IP addresses or networks
+
+    :param allowed_clients: e.g. "192.168.1.0/24, 10.0.0.5"
+    :return: the list of networks. Invalid items are logged and skipped.
+    """
+    networks = []
+    for item in allowed_clients.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            logger.error('Invalid LAN cache client address or network: %s', item)
+    return networks
+
+
+class LanCacheServer(ThreadingHTTPServer):
+    """
+    LAN cache HTTP server
+
+    :param port: TCP port to listen on
+    :param allowed_networks: client networks that are allowed to use the server.
+        If empty, only clients from private networks and loopback are allowed.
+    """
+    daemon_threads = True
+
+    def __init__(self, port: int, allowed_networks: List[IpNetwork]):
+        super().__init__(('', port), LanCacheRequestHandler)
+        self.allowed_networks = allowed_networks
+        self.cache = CoalescingCache()
+        self.endpoints = {f'/v1/{endpoint}': url for url, endpoint in API_ENDPOINT_NAMES.items()}
+
+    def verify_request(self, request, client_address) -> bool:
+        try:
+            address = ipaddress.ip_address(client_address[0])
+        except ValueError:
+            return False
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if self.allowed_networks:
+            is_allowed = any(address in network for network in self.allowed_networks)
+        else:
+            is_allowed = address.is_private or address.is_loopback
+        if not is_allowed:
+            logger.warning('LAN cache request from %s is rejected', client_address[0])
+        return is_allowed
+
+
+def start_lan_cache_server(port: int, allowed_clients: str = '') -> LanCacheServer:
+    """
+    Start LAN cache server in a background thread
+
+    :param port: TCP port to listen on
+    :param allowed_clients: comma-separated client IP addresses or networks,
+        see :func:`parse_allowed_clients`. Empty means private networks.
+    :return: a running server instance. Call its ``shutdown()`` method to stop it.
+    """
+    server = LanCacheServer(port, parse_allowed_clients(allowed_clients))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info('LAN cache server is listening on port %s', port)
+    return server
@@ -14,13 +14,27 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
-from datetime import datetime, timedelta
-from pprint import pformat
-from typing import Dict, List, Any
+import math
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import wraps
+from typing import Dict, List, Any, Optional, Tuple
 
 import simple_requests as requests
+from xbmcaddon import Addon
 
-from libs.common.kodi_service import VERSION, cache_json
+from libs.common.kodi_service import ADDON, VERSION, cache_json, load_json_cache, log_payload
+from libs.common.metrics import span, timed
+from libs.ensemble import aggregate_models, parse_models
+from libs.refresh_scheduler import MAX_TTL_MINUTES, get_forecast_ttl_minutes, shift_to_current_hour
+from libs.request_governor import (
+    MAX_TTL_FACTOR,
+    RequestBudgetExceeded,
+    acquire_request,
+    get_ttl_factor,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -32,9 +46,41 @@ FORECAST_API_BASE_PARAMS = {
     'hourly': 'temperature_2m,relative_humidity_2m,dew_point_2m,apparent_temperature,'
               'precipitation_probability,weather_code,surface_pressure,'
               'wind_speed_10m,wind_direction_10m,cloud_cover,is_day',
-    'daily': 'weather_code,temperature_2m_max,temperature_2m_min,sunrise,sunset,'
-             'precipitation_probability_mean,'
-             'wind_speed_10m_max,wind_direction_10m_dominant,sunrise,sunset,uv_index_max',
+    'daily': 'weather_code,temperature_2m_max,temperature_2m_min,precipitation_probability_mean,'
+             'wind_speed_10m_max,wind_direction_10m_dominant,uv_index_max',
+    'format': 'json',
+    'timeformat': 'iso8601',
+}
+
+HOURLY_FORECAST_HOURS = 24
+# Extra hours are requested so that data cached for the max stretched TTL
+# still cover HOURLY_FORECAST_HOURS from the current hour
+HOURLY_FORECAST_RESERVE_HOURS = math.ceil(MAX_TTL_MINUTES * MAX_TTL_FACTOR / 60)
+
+GEOCODING_RESULTS_COUNT = 10
+GEOCODING_CACHE_TTL_MINUTES = 30 * 24 * 60
+GEOCODING_CACHE_MAX_ENTRIES = 100
+# Open-Meteo geocoding API does fuzzy matching only for queries of 3 characters or longer
+GEOCODING_MIN_FUZZY_QUERY_LENGTH = 3
+
+# Expired cache entries are used if new data cannot be fetched because of these errors
+STALE_CACHE_ERRORS = (RequestBudgetExceeded, requests.RequestException)
+
+SNAP_OFF = 0
+SNAP_TO_GRID = 1
+SNAP_TO_GEOHASH = 2
+
+HISTORY_API_BASE_PARAMS = {
+    'daily': 'temperature_2m_max,temperature_2m_min,precipitation_sum',
+    'format': 'json',
+    'timeformat': 'iso8601',
+}
+
+AIR_QUALITY_API_URL = 'https://air-quality-api.open-meteo.com/v1/air-quality'
+AIR_QUALITY_API_BASE_PARAMS = {
+    'current': 'european_aqi,us_aqi,pm2_5,pm10,alder_pollen,birch_pollen,grass_pollen,'
+               'mugwort_pollen,olive_pollen,ragweed_pollen',
+    'hourly': 'european_aqi,us_aqi,pm2_5,pm10',
     'format': 'json',
     'timeformat': 'iso8601',
 }
@@ -47,34 +93,360 @@ HEADERS = {
     'Accept': 'application/json',
 }
 
+API_ENDPOINT_NAMES = {
+    FORECAST_API_URL: 'forecast',
+    AIR_QUALITY_API_URL: 'air-quality',
+    GEOCODING_API_URL: 'search',
+}
 
-def _call_api(url: str, params: Dict[str, str]) -> Dict[str, Any]:
-    response = requests.get(url, params=params, headers=HEADERS.copy())
+LAN_CACHE_OFF = 0
+LAN_CACHE_SERVER = 1
+LAN_CACHE_CLIENT = 2
+LAN_CACHE_TIMEOUT = 3
+
+
+class ForecastOutdatedError(Exception):
+    pass
+
+
+def call_open_meteo(url: str, params: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Call Open-Meteo API directly within the request budget
+
+    A request for several weather models takes a budget token for each model.
+
+    :param url: API URL
+    :param params: query params
+    :return: decoded response data
+    :raises RequestBudgetExceeded: if Open-Meteo request budget is exhausted
+    """
+    models_count = len(parse_models(params.get('models', '')))
+    acquire_request(API_ENDPOINT_NAMES[url], cost=max(1, models_count))
+    with span('http'):
+        response = requests.get(url, params=params, headers=HEADERS.copy())
     if not response.ok:
         logger.error('Open-Meteo returned error %s: %s', response.status_code, response.text)
         response.raise_for_status()
-    response_data = response.json()
-    logger.debug('Open-Meteo response:\n%s', pformat(response_data))
+    with span('json_decode'):
+        response_data = response.json()
+    log_payload(logger, 'Open-Meteo response:\n%s', response_data)
+    return response_data
+
+
+def _get_lan_cache_peer_url() -> Optional[str]:
+    if ADDON.getSettingInt('lan_cache_mode') != LAN_CACHE_CLIENT:
+        return None
+    host = ADDON.getSettingString('lan_cache_host')
+    if not host:
+        return None
+    return f'http://{host}:{ADDON.getSettingInt("lan_cache_port")}'
+
+
+def _call_lan_cache_peer(peer_url: str, url: str, params: Dict[str, str]) -> Dict[str, Any]:
+    endpoint_url = f'{peer_url}/v1/{API_ENDPOINT_NAMES[url]}'
+    with span('http'):
+        response = requests.get(endpoint_url, params=params, headers=HEADERS.copy(),
+                                timeout=LAN_CACHE_TIMEOUT)
+    response.raise_for_status()
+    with span('json_decode'):
+        response_data = response.json()
+    log_payload(logger, 'LAN cache peer response:\n%s', response_data)
     return response_data
 
 
-def search_location(name_query: str) -> List[Dict[str, Any]]:
-    result = _call_api(GEOCODING_API_URL, params={'name': name_query})
+def _call_api(url: str, params: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Call Open-Meteo API via a LAN cache peer, if configured, or directly
+
+    If the peer is not reachable or returns an error, Open-Meteo API is called directly.
+    """
+    if (peer_url := _get_lan_cache_peer_url()) is not None:
+        try:
+            return _call_lan_cache_peer(peer_url, url, params)
+        except (requests.RequestException, OSError, ValueError) as exc:
+            logger.warning('LAN cache peer %s is not available, calling Open-Meteo directly: %s',
+                           peer_url, exc)
+    return call_open_meteo(url, params)
+
+
+def _get_geohash_cell_center(latitude: float,
+                             longitude: float,
+                             precision: int) -> Tuple[float, float]:
+    """
+    Get the center of a geohash cell that contains the given point
+
+    :param precision: geohash length in characters (5 bits per character)
+    :return: (latitude, longitude) tuple of the cell center
+    """
+    lat_interval = [-90.0, 90.0]
+    lon_interval = [-180.0, 180.0]
+    for bit in range(precision * 5):
+        # Even bits encode longitude, odd bits encode latitude
+        interval, value = (lon_interval, longitude) if bit % 2 == 0 else (lat_interval, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        if value >= middle:
+            interval[0] = middle
+        else:
+            interval[1] = middle
+    return (lat_interval[0] + lat_interval[1]) / 2, (lon_interval[0] + lon_interval[1]) / 2
+
+
+def snap_coordinates(latitude: float,
+                     longitude: float,
+                     addon: Addon = ADDON) -> Tuple[float, float]:
+    """
+    Snap coordinates to a grid or geohash cell center according to addon settings
+
+    Weather models have a grid that is coarser than the precision of location coordinates,
+    so nearby locations can share the same forecast and its cache entry.
+
+    :param addon: an addon instance to read settings from
+    :return: (latitude, longitude) tuple of snapped coordinates
+    """
+    snapping_mode = addon.getSettingInt('coordinates_snapping')
+    if snapping_mode == SNAP_TO_GRID:
+        grid_step = addon.getSettingNumber('grid_step')
+        if grid_step <= 0:
+            return latitude, longitude
+        latitude = round(latitude / grid_step) * grid_step
+        longitude = round(longitude / grid_step) * grid_step
+    elif snapping_mode == SNAP_TO_GEOHASH:
+        latitude, longitude = _get_geohash_cell_center(
+            latitude, longitude, addon.getSettingInt('geohash_precision'))
+    else:
+        return latitude, longitude
+    return round(latitude, 5), round(longitude, 5)
+
+
+def snap_to_grid(func):
+    """
+    Snap ``latitude`` and ``longitude`` arguments of the decorated function
+
+    It must be applied before :func:`cache_json` so that snapped coordinates are used
+    both for cache keys and for API requests. ``evict`` attribute of a cached function
+    is replaced with the one that snaps coordinates too. Both accept an optional
+    ``addon`` keyword argument: an addon instance to read snapping settings from.
+    """
+    @wraps(func)
+    def wrapper(latitude, longitude, *args, addon: Addon = ADDON, **kwargs):
+        return func(*snap_coordinates(latitude, longitude, addon), *args, **kwargs)
+
+    if hasattr(func, 'evict'):
+        def evict(latitude, longitude, *args, addon: Addon = ADDON, **kwargs):
+            return func.evict(*snap_coordinates(latitude, longitude, addon), *args, **kwargs)
+
+        wrapper.evict = evict
+    return wrapper
+
+
+def normalize_location_query(name_query: str) -> str:
+    """
+    Normalize a location search query for using as a cache key
+
+    The query is case-folded, diacritics are removed and whitespaces are collapsed,
+    so that "Kraków", " krakow" and "KRAKOW " produce the same key.
+    """
+    decomposed_query = unicodedata.normalize('NFKD', name_query.casefold())
+    folded_query = ''.join(char for char in decomposed_query
+                           if not unicodedata.combining(char))
+    return ' '.join(folded_query.split())
+
+
+def _find_in_cached_prefix_results(normalized_query: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Try to answer a location query by filtering cached results of a shorter query
+
+    Only complete results (that did not hit the API results limit) are used
+    because otherwise matching locations may be missing from the cached results.
+
+    :return: matching locations or ``None`` if the query cannot be answered from the cache
+    """
+    cache = load_json_cache('search_location')
+    now = int(time.time())
+    best_prefix = ''
+    best_results = None
+    for prefix, entry in cache.items():
+        if (GEOCODING_MIN_FUZZY_QUERY_LENGTH <= len(prefix) < len(normalized_query)
+                and len(prefix) > len(best_prefix)
+                and normalized_query.startswith(prefix)
+                and entry['timestamp'] + GEOCODING_CACHE_TTL_MINUTES * 60 > now
+                and len(entry['data'] or []) < GEOCODING_RESULTS_COUNT):
+            best_prefix = prefix
+            best_results = entry['data'] or []
+    if best_results is None:
+        return None
+    filtered_results = [location_info for location_info in best_results
+                        if normalize_location_query(location_info['name']).startswith(
+                            normalized_query)]
+    if not filtered_results:
+        return None
+    logger.debug('Location query "%s" is answered from cached results for "%s"',
+                 normalized_query, best_prefix)
+    return filtered_results
+
+
+@cache_json(ttl_minutes=GEOCODING_CACHE_TTL_MINUTES,
+            max_entries=GEOCODING_CACHE_MAX_ENTRIES,
+            key_func=normalize_location_query,
+            stale_on_error=STALE_CACHE_ERRORS)
+def search_location(name_query: str) -> Optional[List[Dict[str, Any]]]:
+    if (cached_results := _find_in_cached_prefix_results(
+            normalize_location_query(name_query))) is not None:
+        return cached_results
+    result = _call_api(GEOCODING_API_URL,
+                       params={'name': name_query, 'count': str(GEOCODING_RESULTS_COUNT)})
     return result.get('results')
 
 
-@cache_json(ttl_minutes=30)
-def get_forecast(latitude: float, longitude: float, timezone: str) -> Dict[str, Any]:
+def _get_hourly_range_params() -> Dict[str, str]:
+    start_hour = datetime.now().replace(minute=0, second=0, microsecond=0)
+    end_hour = start_hour + timedelta(
+        hours=HOURLY_FORECAST_HOURS + HOURLY_FORECAST_RESERVE_HOURS - 1)
+    return {
+        'start_hour': start_hour.strftime(OPEN_METEO_DATE_TIME_FORMAT),
+        'end_hour': end_hour.strftime(OPEN_METEO_DATE_TIME_FORMAT),
+    }
+
+
+@timed('get_forecast')
+@snap_to_grid
+@cache_json(ttl_minutes=30, ttl_factor=get_ttl_factor, ttl_func=get_forecast_ttl_minutes,
+            stale_on_error=STALE_CACHE_ERRORS)
+def get_forecast(latitude: float,
+                 longitude: float,
+                 timezone: str,
+                 models: str = '') -> Dict[str, Any]:
+    """
+    Get weather forecast
+
+    :param models: comma-separated weather models. If several models are given,
+        their forecasts are aggregated into a single ensemble forecast.
+    """
     params = FORECAST_API_BASE_PARAMS.copy()
     params['latitude'] = str(latitude)
     params['longitude'] = str(longitude)
     params['timezone'] = timezone
-    start_hour = datetime.now().replace(minute=0, second=0, microsecond=0)
-    params['start_hour'] = start_hour.strftime(OPEN_METEO_DATE_TIME_FORMAT)
-    end_hour = start_hour + timedelta(hours=23)
-    params['end_hour'] = end_hour.strftime(OPEN_METEO_DATE_TIME_FORMAT)
-    start_date = start_hour.date()
+    params.update(_get_hourly_range_params())
+    start_date = datetime.now().date()
     params['start_date'] = start_date.strftime(OPEN_METEO_DATE_FORMAT)
     end_date = start_date + timedelta(days=9)
     params['end_date'] = end_date.strftime(OPEN_METEO_DATE_FORMAT)
+    model_list = parse_models(models)
+    if model_list:
+        params['models'] = ','.join(model_list)
+    forecast_info = _call_api(FORECAST_API_URL, params=params)
+    if len(model_list) > 1:
+        with span('ensemble_aggregation'):
+            aggregate_models(forecast_info, model_list)
+    return forecast_info
+
+
+@timed('get_air_quality')
+@snap_to_grid
+@cache_json(ttl_minutes=60, ttl_factor=get_ttl_factor, stale_on_error=STALE_CACHE_ERRORS)
+def get_air_quality(latitude: float, longitude: float, timezone: str) -> Dict[str, Any]:
+    params = AIR_QUALITY_API_BASE_PARAMS.copy()
+    params['latitude'] = str(latitude)
+    params['longitude'] = str(longitude)
+    params['timezone'] = timezone
+    params.update(_get_hourly_range_params())
+    return _call_api(AIR_QUALITY_API_URL, params=params)
+
+
+@timed('get_daily_history')
+@snap_to_grid
+def get_daily_history(latitude: float,
+                      longitude: float,
+                      timezone: str,
+                      start_date: date,
+                      end_date: date) -> Dict[str, Any]:
+    """
+    Get past daily weather for a date range
+
+    Forecast API provides past data for up to 92 days.
+    """
+    params = HISTORY_API_BASE_PARAMS.copy()
+    params['latitude'] = str(latitude)
+    params['longitude'] = str(longitude)
+    params['timezone'] = timezone
+    params['start_date'] = start_date.strftime(OPEN_METEO_DATE_FORMAT)
+    params['end_date'] = end_date.strftime(OPEN_METEO_DATE_FORMAT)
     return _call_api(FORECAST_API_URL, params=params)
+
+
+def _get_forecast_args(latitude: float,
+                       longitude: float,
+                       timezone: str,
+                       models: str) -> Tuple[Any, ...]:
+    # Cache keys of single-model forecasts stay the same as before ensemble support
+    if models:
+        return latitude, longitude, timezone, models
+    return latitude, longitude, timezone
+
+
+def evict_weather_data(latitude: float,
+                       longitude: float,
+                       timezone: str,
+                       addon: Addon = ADDON) -> None:
+    """
+    Evict cached forecast and air quality data for a location
+
+    :param addon: an addon instance to read settings from
+    """
+    models = addon.getSettingString('ensemble_models').strip()
+    for forecast_args in dict.fromkeys([_get_forecast_args(latitude, longitude, timezone, ''),
+                                        _get_forecast_args(latitude, longitude, timezone, models)]):
+        if get_forecast.evict(*forecast_args, addon=addon):
+            logger.debug('Evicted cached forecast for %s', forecast_args)
+    if get_air_quality.evict(latitude, longitude, timezone, addon=addon):
+        logger.debug('Evicted cached air quality for %s, %s, %s', latitude, longitude, timezone)
+
+
+def get_weather_data(latitude: float,  # pylint: disable=too-many-arguments
+                     longitude: float,
+                     timezone: str,
+                     with_air_quality: bool,
+                     models: str = '',
+                     *,
+                     addon: Addon = ADDON) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """
+    Get forecast and, optionally, air quality data
+
+    Forecast and air quality data are fetched concurrently. An air quality error
+    is logged and does not prevent returning forecast data. Hourly series start
+    from the current hour. Cached data that do not cover the current hour
+    are evicted and fetched again.
+
+    :param models: comma-separated weather models for an ensemble forecast
+    :param addon: an addon instance to read settings from
+
+    :return: (forecast, air_quality) tuple. Air quality is ``None``
+        if it is not requested or cannot be fetched.
+    :raises ForecastOutdatedError: if only outdated forecast data are available
+    """
+    forecast_args = _get_forecast_args(latitude, longitude, timezone, models)
+    if not with_air_quality:
+        forecast, air_quality = get_forecast(*forecast_args, addon=addon), None
+    else:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            forecast_future = executor.submit(get_forecast, *forecast_args, addon=addon)
+            air_quality_future = executor.submit(get_air_quality, latitude, longitude, timezone,
+                                                 addon=addon)
+            forecast = forecast_future.result()
+            try:
+                air_quality = air_quality_future.result()
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.error('Unable to get air quality data: %s', exc)
+                air_quality = None
+    if not shift_to_current_hour(forecast, HOURLY_FORECAST_HOURS):
+        logger.warning('Cached forecast is older than its horizon, fetching a new one')
+        get_forecast.evict(*forecast_args, addon=addon)
+        forecast = get_forecast(*forecast_args, addon=addon)
+        if not shift_to_current_hour(forecast, HOURLY_FORECAST_HOURS):
+            # A stale cache entry is returned on errors, and it must not be shown as current
+            raise ForecastOutdatedError('Unable to get a forecast that covers the current hour')
+    if air_quality is not None and not shift_to_current_hour(air_quality, HOURLY_FORECAST_HOURS):
+        logger.warning('Cached air quality data are older than their horizon')
+        get_air_quality.evict(latitude, longitude, timezone, addon=addon)
+        air_quality = None
+    return forecast, air_quality
@@ -0,0 +1,96 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Plugin directories with hourly and daily forecasts for skin list containers
+
+* ``plugin://weather.open-meteo.lite/hourly``
+* ``plugin://weather.open-meteo.lite/daily``
+
+An optional ``location`` query parameter, e.g. ``?location=location2``, selects
+a location. By default the location last shown in the Weather window is used. List items are
+built from the last forecast snapshot, so listing directories does not fetch data
+from the network. Each list item has the same properties as the respective
+``Hourly.N.*`` or ``Daily.N.*`` window properties without the prefix,
+e.g. ``ListItem.Property(Temperature)``.
+"""
+
+import logging
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import xbmcplugin
+from xbmcgui import ListItem
+
+from libs.common.kodi_service import PROFILE
+from libs.forecast_snapshot import SnapshotReader, get_rows
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOTS_DIR = PROFILE / 'snapshots'
+
+WEATHER_ICONS_PATH = 'resource://resource.images.weathericons.default/'
+
+
+def _make_hourly_item(row: Dict[str, str]) -> ListItem:
+    return ListItem(row.get('Time', ''), row.get('Temperature', ''), offscreen=True)
+
+
+def _make_daily_item(row: Dict[str, str]) -> ListItem:
+    temperature = f'{row.get("HighTemperature", "")} / {row.get("LowTemperature", "")}'
+    return ListItem(row.get('ShortDay', ''), temperature, offscreen=True)
+
+
+DIRECTORIES = {
+    '/hourly': ('Hourly', _make_hourly_item),
+    '/daily': ('Daily', _make_daily_item),
+}
+
+
+def _get_list_items(prefix: str,
+                    make_item: Callable[[Dict[str, str]], ListItem],
+                    location_id: str) -> List[Tuple[str, ListItem, bool]]:
+    snapshot = SnapshotReader(SNAPSHOTS_DIR, location_id or None).read()
+    if snapshot is None:
+        logger.warning('No forecast snapshot for %s directory', prefix)
+        return []
+    list_items = []
+    for row in get_rows(snapshot, prefix):
+        list_item = make_item(row)
+        list_item.setProperties(row)
+        list_item.setProperty('Location', snapshot['location'])
+        if outlook_icon := row.get('OutlookIcon'):
+            list_item.setArt({'icon': WEATHER_ICONS_PATH + outlook_icon})
+        list_items.append(('', list_item, False))
+    return list_items
+
+
+def run_plugin(argv: List[str]) -> None:
+    """
+    Show a plugin directory
+
+    :param argv: plugin invocation arguments: [plugin URL, handle, query string]
+    """
+    handle = int(argv[1])
+    path = urlsplit(argv[0]).path.rstrip('/')
+    params = dict(parse_qsl(argv[2].lstrip('?')))
+    directory = DIRECTORIES.get(path)
+    if directory is None:
+        logger.error('Unknown plugin directory: %s', argv[0])
+        xbmcplugin.endOfDirectory(handle, succeeded=False)
+        return
+    prefix, make_item = directory
+    list_items = _get_list_items(prefix, make_item, params.get('location', ''))
+    xbmcplugin.addDirectoryItems(handle, list_items, len(list_items))
+    xbmcplugin.endOfDirectory(handle, cacheToDisc=False)
@@ -0,0 +1,182 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Adaptive forecast refresh scheduling
+
+The time-to-live of cached forecast data is placed between two anchors:
+the next update of current conditions in the API response and the time when
+the next weather model run is expected to become available. Calm weather
+keeps the data until new model data appear, while volatile weather
+(precipitation probability swings, weather code changes, strong wind)
+brings the refresh closer to the next update of current conditions.
+
+Cached data may outlive the hour and even the day they were fetched in,
+so hourly and daily series are shifted to the current hour and date before use,
+see :func:`shift_to_current_hour`.
+"""
+
+import logging
+import time
+from bisect import bisect_left
+from calendar import timegm
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Open-Meteo updates its "best match" forecast every few hours
+# as new runs of the underlying weather models become available.
+MODEL_RUN_INTERVAL_HOURS = 3
+MODEL_RUN_AVAILABILITY_DELAY_MINUTES = 120
+# Current conditions are provided in 15-minute intervals
+DEFAULT_CURRENT_INTERVAL_SECONDS = 900
+
+MIN_TTL_MINUTES = 10
+MAX_TTL_MINUTES = MODEL_RUN_INTERVAL_HOURS * 60
+
+VOLATILITY_HOURS = 6
+# Values at which each volatility component reaches its maximum
+MAX_PRECIPITATION_PROBABILITY_SWING = 50
+MAX_WEATHER_CODE_CHANGES = 3
+CALM_WIND_SPEED_KMH = 20.0
+STORM_WIND_SPEED_KMH = 60.0
+
+
+def get_minutes_until_model_update(now: float) -> float:
+    """
+    Get minutes until the next weather model run is expected to become available
+
+    :param now: current UNIX timestamp
+    """
+    interval_seconds = MODEL_RUN_INTERVAL_HOURS * 3600
+    delay_seconds = MODEL_RUN_AVAILABILITY_DELAY_MINUTES * 60
+    last_run_available = (now - delay_seconds) // interval_seconds * interval_seconds
+    next_run_available = last_run_available + interval_seconds + delay_seconds
+    return (next_run_available - now) / 60
+
+
+def get_minutes_until_current_update(forecast_info: Dict[str, Any], now: float) -> float:
+    """
+    Get minutes until the next update of current conditions
+
+    :param forecast_info: Forecast API response
+    :param now: current UNIX timestamp
+    """
+    current_info = forecast_info['current']
+    interval = current_info.get('interval') or DEFAULT_CURRENT_INTERVAL_SECONDS
+    local_time = datetime.strptime(current_info['time'], '%Y-%m-%dT%H:%M')
+    current_time = timegm(local_time.timetuple()) - forecast_info.get('utc_offset_seconds', 0)
+    minutes = (current_time + interval - now) / 60
+    if minutes <= 0:
+        # Timestamps are outdated, e.g. the data come from a stale cache of a LAN peer
+        minutes = interval / 60
+    return minutes
+
+
+def _get_series(hourly_info: Dict[str, List[Any]], key: str) -> List[Any]:
+    return [value for value in hourly_info.get(key, [])[:VOLATILITY_HOURS]
+            if value is not None]
+
+
+def get_volatility(hourly_info: Dict[str, List[Any]]) -> float:
+    """
+    Measure weather volatility over the next hours
+
+    :param hourly_info: hourly forecast series starting from the current hour
+    :return: a value from 0.0 (calm) to 1.0 (rapidly changing or stormy weather)
+    """
+    precipitation_probability = _get_series(hourly_info, 'precipitation_probability')
+    precipitation_swing = max(
+        (abs(next_value - value)
+         for value, next_value in zip(precipitation_probability, precipitation_probability[1:])),
+        default=0
+    )
+    weather_codes = _get_series(hourly_info, 'weather_code')
+    weather_code_changes = sum(
+        1 for code, next_code in zip(weather_codes, weather_codes[1:]) if code != next_code
+    )
+    max_wind_speed = max(_get_series(hourly_info, 'wind_speed_10m'), default=0.0)
+    components = (
+        precipitation_swing / MAX_PRECIPITATION_PROBABILITY_SWING,
+        weather_code_changes / MAX_WEATHER_CODE_CHANGES,
+        (max_wind_speed - CALM_WIND_SPEED_KMH) / (STORM_WIND_SPEED_KMH - CALM_WIND_SPEED_KMH),
+    )
+    return max(0.0, min(1.0, max(components)))
+
+
+def get_forecast_ttl_minutes(forecast_info: Dict[str, Any]) -> float:
+    """
+    Get time-to-live for cached forecast data
+
+    :param forecast_info: Forecast API response
+    :return: TTL in minutes
+    """
+    now = time.time()
+    volatility = get_volatility(forecast_info['hourly'])
+    current_update_minutes = get_minutes_until_current_update(forecast_info, now)
+    model_update_minutes = max(current_update_minutes, get_minutes_until_model_update(now))
+    ttl_minutes = (current_update_minutes
+                   + (model_update_minutes - current_update_minutes) * (1.0 - volatility))
+    ttl_minutes = max(MIN_TTL_MINUTES, min(MAX_TTL_MINUTES, ttl_minutes))
+    logger.debug('Forecast volatility: %.2f, next current conditions update in %.0f min, '
+                 'next model update in %.0f min, forecast TTL: %.0f min',
+                 volatility, current_update_minutes, model_update_minutes, ttl_minutes)
+    return ttl_minutes
+
+
+def shift_to_current_hour(api_response: Dict[str, Any],
+                          hours: int,
+                          now: Optional[float] = None) -> bool:
+    """
+    Drop past hours and days from hourly and daily series of an API response in place
+
+    If current conditions are older than the current hour, their values are replaced
+    with the values of the current hour from the hourly series.
+
+    :param api_response: Forecast or Air Quality API response
+    :param hours: the max number of hours to keep
+    :param now: current UNIX timestamp
+    :return: ``False`` if the hourly or daily series ends before the current hour
+        or date, i.e. the data are older than their forecast horizon.
+        The response is not changed in this case.
+    """
+    if now is None:
+        now = time.time()
+    hourly_info = api_response['hourly']
+    daily_info = api_response.get('daily')
+    local_time = time.gmtime(now + api_response.get('utc_offset_seconds', 0))
+    current_hour = time.strftime('%Y-%m-%dT%H:00', local_time)
+    index = bisect_left(hourly_info['time'], current_hour)
+    if index >= len(hourly_info['time']):
+        return False
+    day_index = 0
+    if daily_info is not None:
+        day_index = bisect_left(daily_info['time'], time.strftime('%Y-%m-%d', local_time))
+        if day_index >= len(daily_info['time']):
+            return False
+    for key, values in hourly_info.items():
+        hourly_info[key] = values[index:index + hours]
+    if day_index > 0:
+        logger.debug('Dropping %d past days from the daily forecast', day_index)
+        for key, values in daily_info.items():
+            daily_info[key] = values[day_index:]
+    current_info = api_response.get('current')
+    if index > 0 and current_info is not None and current_info['time'] < current_hour:
+        logger.debug('Current conditions from %s are outdated, using hourly data for %s',
+                     current_info['time'], current_hour)
+        for key in current_info:
+            if key in hourly_info:
+                current_info[key] = hourly_info[key][0]
+    return True
@@ -0,0 +1,188 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Open-Meteo request budget governor
+
+Open-Meteo free tier limits the number of API calls per minute, hour and day.
+The governor keeps a token bucket for each period in a JSON file in the addon profile,
+so the budget is shared between all script invocations and the service.
+"""
+
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict
+
+from xbmcaddon import Addon
+
+from libs.common.kodi_service import PROFILE, file_lock
+
+logger = logging.getLogger(__name__)
+
+BUDGET_FILE = PROFILE / 'request_budget.json'
+BUDGET_LOCK_FILE = PROFILE / 'request_budget.lock'
+
+BUDGET_PERIODS = {
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
+MINUTELY_REQUEST_LIMIT = 600
+DEFAULT_HOURLY_REQUEST_LIMIT = 5000
+DEFAULT_DAILY_REQUEST_LIMIT = 10000
+
+# TTLs are stretched when less than this fraction of the budget remains
+LOW_BUDGET_FRACTION = 0.5
+MAX_TTL_FACTOR = 4.0
+
+
+class RequestBudgetExceeded(Exception):
+    pass
+
+
+def _get_limits() -> Dict[str, int]:
+    # The governor is also used by the long-running service, and Kodi does not update
+    # settings of an existing addon instance
+    addon = Addon()
+    return {
+        'minute': MINUTELY_REQUEST_LIMIT,
+        'hour': addon.getSettingInt('hourly_request_limit') or DEFAULT_HOURLY_REQUEST_LIMIT,
+        'day': addon.getSettingInt('daily_request_limit') or DEFAULT_DAILY_REQUEST_LIMIT,
+    }
+
+
+def _load_state() -> Dict[str, Any]:
+    try:
+        with BUDGET_FILE.open('r', encoding='utf-8') as fo:
+            return json.load(fo)
+    except (OSError, ValueError):
+        return {'buckets': {}, 'usage': {}}
+
+
+def _save_state(state: Dict[str, Any]) -> None:
+    with BUDGET_FILE.open('w', encoding='utf-8') as fo:
+        json.dump(state, fo)
+
+
+def _refill_buckets(state: Dict[str, Any], limits: Dict[str, int], now: float) -> None:
+    buckets = state['buckets']
+    for period, period_seconds in BUDGET_PERIODS.items():
+        limit = limits[period]
+        bucket = buckets.get(period)
+        if bucket is None:
+            buckets[period] = {'tokens': float(limit), 'updated': now}
+            continue
+        elapsed = max(0.0, now - bucket['updated'])
+        bucket['tokens'] = min(float(limit), bucket['tokens'] + elapsed * limit / period_seconds)
+        bucket['updated'] = now
+
+
+def _count_usage(state: Dict[str, Any], endpoint: str, now: float, cost: int) -> None:
+    usage = state['usage']
+    now_dt = datetime.fromtimestamp(now)
+    day = now_dt.strftime('%Y-%m-%d')
+    hour = now_dt.strftime('%Y-%m-%dT%H')
+    if usage.get('day') != day:
+        usage['day'] = day
+        usage['day_counts'] = {}
+    if usage.get('hour') != hour:
+        usage['hour'] = hour
+        usage['hour_counts'] = {}
+    usage['day_counts'][endpoint] = usage['day_counts'].get(endpoint, 0) + cost
+    usage['hour_counts'][endpoint] = usage['hour_counts'].get(endpoint, 0) + cost
+
+
+def acquire_request(endpoint: str, cost: int = 1) -> None:
+    """
+    Take tokens from the request budget for an API call
+
+    :param endpoint: API endpoint name for usage statistics
+    :param cost: the number of tokens. Open-Meteo counts a request for several
+        weather models as several API calls.
+    :raises RequestBudgetExceeded: if the budget for any period is exhausted
+    """
+    limits = _get_limits()
+    with file_lock(BUDGET_LOCK_FILE):
+        state = _load_state()
+        now = time.time()
+        _refill_buckets(state, limits, now)
+        exhausted_periods = [period for period, bucket in state['buckets'].items()
+                             if bucket['tokens'] < cost]
+        if exhausted_periods:
+            _save_state(state)
+            raise RequestBudgetExceeded(
+                f'Open-Meteo request budget is exhausted for: {", ".join(exhausted_periods)}')
+        for bucket in state['buckets'].values():
+            bucket['tokens'] -= cost
+        _count_usage(state, endpoint, now, cost)
+        _save_state(state)
+    logger.debug('Open-Meteo request budget: %s requests remaining today',
+                 int(state['buckets']['day']['tokens']))
+
+
+def get_remaining_budget_fraction() -> float:
+    """
+    Get the remaining fraction of the tightest request budget
+
+    :return: a value from 0.0 (exhausted) to 1.0 (full)
+    """
+    limits = _get_limits()
+    with file_lock(BUDGET_LOCK_FILE):
+        state = _load_state()
+    _refill_buckets(state, limits, time.time())
+    return min(bucket['tokens'] / limits[period] for period, bucket in state['buckets'].items())
+
+
+def get_ttl_factor() -> float:
+    """
+    Get a cache TTL multiplier that grows as the request budget runs low
+
+    :return: 1.0 if at least half of the budget remains, up to :data:`MAX_TTL_FACTOR`
+        when the budget is exhausted
+    """
+    remaining_fraction = get_remaining_budget_fraction()
+    if remaining_fraction >= LOW_BUDGET_FRACTION:
+        return 1.0
+    ttl_factor = 1.0 + (MAX_TTL_FACTOR - 1.0) * (1.0 - remaining_fraction / LOW_BUDGET_FRACTION)
+    logger.info('Open-Meteo request budget is running low (%.0f%% remaining), '
+                'cache TTL is stretched %.1f times', remaining_fraction * 100, ttl_factor)
+    return ttl_factor
+
+
+def get_usage() -> Dict[str, Any]:
+    """
+    Get request usage counters
+
+    :return: a dict with "today" and "this_hour" total request counts,
+        "remaining_today" requests and per-endpoint "endpoints_today" counts
+    """
+    limits = _get_limits()
+    with file_lock(BUDGET_LOCK_FILE):
+        state = _load_state()
+    now = time.time()
+    _refill_buckets(state, limits, now)
+    usage = state['usage']
+    now_dt = datetime.fromtimestamp(now)
+    day_counts = usage.get('day_counts', {}) if usage.get('day') == now_dt.strftime(
+        '%Y-%m-%d') else {}
+    hour_counts = usage.get('hour_counts', {}) if usage.get('hour') == now_dt.strftime(
+        '%Y-%m-%dT%H') else {}
+    return {
+        'today': sum(day_counts.values()),
+        'this_hour': sum(hour_counts.values()),
+        'remaining_today': int(state['buckets']['day']['tokens']),
+        'endpoints_today': day_counts,
+    }
@@ -0,0 +1,151 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Background service of the addon"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import xbmc
+from xbmcaddon import Addon
+
+from libs.lan_cache import LanCacheServer, start_lan_cache_server
+from libs.open_meteo_api import LAN_CACHE_SERVER, evict_weather_data, snap_coordinates
+from libs.weather_info_service import (
+    LocationData,
+    get_location_data,
+    prepare_weather_info_for_location,
+)
+
+logger = logging.getLogger(__name__)
+
+
+LOCATION_IDS = ('location1', 'location2', 'location3')
+# Location settings are saved one by one, so changes are processed after a delay
+LOCATIONS_UPDATE_DELAY = 2.0
+
+
+def _get_locations(addon: Addon) -> Dict[str, Optional[LocationData]]:
+    return {location_id: get_location_data(location_id, addon) for location_id in LOCATION_IDS}
+
+
+def _get_weather_data_key(location_data: LocationData, addon: Addon) -> tuple:
+    return (*snap_coordinates(location_data.latitude, location_data.longitude, addon),
+            location_data.timezone)
+
+
+def _prepare_weather_info(location_id: str, location_data: LocationData, addon: Addon) -> None:
+    try:
+        prepare_weather_info_for_location(location_id, location_data, addon)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('Unable to pre-fetch weather info for %s', location_id)
+    else:
+        logger.debug('Weather info for %s is pre-fetched', location_id)
+
+
+class ServiceMonitor(xbmc.Monitor):
+    """
+    Runs LAN cache server according to addon settings and updates cached
+    weather data when locations are changed
+
+    Kodi does not update settings of an existing :class:`xbmcaddon.Addon` instance,
+    so settings are read from a new instance each time they are changed,
+    and this instance is used for pre-fetching weather data.
+    Weather data for changed locations are pre-fetched one location at a time
+    by a single worker thread.
+    """
+
+    def __init__(self):
+        super().__init__()
+        addon = Addon()
+        self._lan_cache_server: Optional[LanCacheServer] = None
+        self._lan_cache_port = 0
+        self._lan_cache_allowed_clients = ''
+        self._update_lan_cache_server(addon)
+        self._locations = _get_locations(addon)
+        self._locations_timer: Optional[threading.Timer] = None
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=1)
+
+    def _update_lan_cache_server(self, addon: Addon) -> None:
+        is_server_enabled = addon.getSettingInt('lan_cache_mode') == LAN_CACHE_SERVER
+        port = addon.getSettingInt('lan_cache_port')
+        allowed_clients = addon.getSettingString('lan_cache_allowed_clients')
+        if self._lan_cache_server is not None and (
+                not is_server_enabled
+                or port != self._lan_cache_port
+                or allowed_clients != self._lan_cache_allowed_clients):
+            self.stop_lan_cache_server()
+        if is_server_enabled and self._lan_cache_server is None:
+            try:
+                self._lan_cache_server = start_lan_cache_server(port, allowed_clients)
+            except OSError as exc:
+                logger.error('Unable to start LAN cache server on port %s: %s', port, exc)
+                return
+            self._lan_cache_port = port
+            self._lan_cache_allowed_clients = allowed_clients
+
+    def stop_lan_cache_server(self) -> None:
+        if self._lan_cache_server is not None:
+            self._lan_cache_server.shutdown()
+            self._lan_cache_server.server_close()
+            self._lan_cache_server = None
+            logger.info('LAN cache server is stopped')
+
+    def _update_locations(self) -> None:
+        """
+        Evict cached weather data for changed locations and pre-fetch new data
+
+        Cached data for a previous location are kept if another location
+        shares the same cache entry.
+        """
+        addon = Addon()
+        new_locations = _get_locations(addon)
+        new_data_keys = {_get_weather_data_key(location_data, addon)
+                         for location_data in new_locations.values() if location_data is not None}
+        for location_id, location_data in new_locations.items():
+            old_location_data = self._locations.get(location_id)
+            if location_data == old_location_data:
+                continue
+            logger.debug('%s is changed from %s to %s',
+                         location_id, old_location_data, location_data)
+            if (old_location_data is not None
+                    and _get_weather_data_key(old_location_data, addon) not in new_data_keys):
+                evict_weather_data(*old_location_data[1:], addon=addon)
+            if location_data is not None:
+                self._prefetch_executor.submit(_prepare_weather_info,
+                                               location_id, location_data, addon)
+        self._locations = new_locations
+
+    def onSettingsChanged(self):  # pylint: disable=invalid-name
+        addon = Addon()
+        self._update_lan_cache_server(addon)
+        if self._locations_timer is not None:
+            self._locations_timer.cancel()
+        self._locations_timer = threading.Timer(LOCATIONS_UPDATE_DELAY, self._update_locations)
+        self._locations_timer.daemon = True
+        self._locations_timer.start()
+
+    def stop(self) -> None:
+        if self._locations_timer is not None:
+            self._locations_timer.cancel()
+        self._prefetch_executor.shutdown(wait=False)
+        self.stop_lan_cache_server()
+
+
+def run_service() -> None:
+    monitor = ServiceMonitor()
+    monitor.waitForAbort()
+    monitor.stop()
@@ -0,0 +1,217 @@
+# Copyright (C) 2024, Roman Miroshnychenko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Rolling local store of past daily weather
+
+Each location has a JSON file with daily records keyed by date. Only the days
+that are not stored yet are fetched, and records older than the retention period
+are trimmed. Aggregates over stored records are updated incrementally
+as records are added and trimmed.
+
+Days with incomplete data are stored as "incomplete" entries with the date
+of the last attempt. They are requested again at most once a day and only
+while they are recent, because older data are not going to be completed.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from xbmcaddon import Addon
+
+from libs.common.kodi_service import ADDON, PROFILE, file_lock
+from libs.open_meteo_api import OPEN_METEO_DATE_FORMAT, get_daily_history, snap_coordinates
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DIR = PROFILE / 'history'
+# Open-Meteo Forecast API provides past data for up to 92 days
+MAX_HISTORY_DAYS = 92
+
+RECORD_FIELDS = ('temperature_2m_max', 'temperature_2m_min', 'precipitation_sum')
+# Incomplete data for days older than this are not requested again
+INCOMPLETE_RETRY_DAYS = 3
+
+
+def _get_store_path(latitude: float, longitude: float, timezone: str, addon: Addon):
+    latitude, longitude = snap_coordinates(latitude, longitude, addon)
+    file_name = re.sub(r'[^\w.-]', '_', f'{latitude}_{longitude}_{timezone}')
+    return HISTORY_DIR / f'{file_name}.json'
+
+
+def _get_empty_aggregates() -> Dict[str, Any]:
+    return {
+        'count': 0,
+        'sum_temperature_2m_max': 0.0,
+        'sum_temperature_2m_min': 0.0,
+        'sum_precipitation_sum': 0.0,
+        'max_temperature_2m_max': None,
+        'min_temperature_2m_min': None,
+    }
+
+
+def _add_to_aggregates(aggregates: Dict[str, Any], record: Dict[str, float]) -> None:
+    aggregates['count'] += 1
+    for field in RECORD_FIELDS:
+        aggregates[f'sum_{field}'] += record[field]
+    if (aggregates['max_temperature_2m_max'] is None
+            or record['temperature_2m_max'] > aggregates['max_temperature_2m_max']):
+        aggregates['max_temperature_2m_max'] = record['temperature_2m_max']
+    if (aggregates['min_temperature_2m_min'] is None
+            or record['temperature_2m_min'] < aggregates['min_temperature_2m_min']):
+        aggregates['min_temperature_2m_min'] = record['temperature_2m_min']
+
+
+def _remove_from_aggregates(aggregates: Dict[str, Any],
+                            record: Dict[str, float],
+                            records: Dict[str, Dict[str, float]]) -> None:
+    """
+    Remove a trimmed record from aggregates
+
+    Extremes are recalculated only if the trimmed record holds one of them.
+
+    :param records: remaining records
+    """
+    aggregates['count'] -= 1
+    for field in RECORD_FIELDS:
+        aggregates[f'sum_{field}'] -= record[field]
+    if record['temperature_2m_max'] == aggregates['max_temperature_2m_max']:
+        aggregates['max_temperature_2m_max'] = max(
+            (item['temperature_2m_max'] for item in records.values()), default=None)
+    if record['temperature_2m_min'] == aggregates['min_temperature_2m_min']:
+        aggregates['min_temperature_2m_min'] = min(
+            (item['temperature_2m_min'] for item in records.values()), default=None)
+
+
+def _load_store(store_path) -> Dict[str, Any]:
+    try:
+        with store_path.open('r', encoding='utf-8') as fo:
+            return json.load(fo)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as exc:
+        logger.warning('Unable to load weather history from %s, treating it as empty: %s',
+                       store_path.name, exc)
+    return {'records': {}, 'aggregates': _get_empty_aggregates(), 'incomplete': {}}
+
+
+def _save_store(store_path, store: Dict[str, Any]) -> None:
+    # The store is replaced atomically, so concurrent readers never see a partial file
+    temp_path = store_path.with_name(
+        f'.{store_path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    with temp_path.open('w', encoding='utf-8') as fo:
+        json.dump(store, fo)
+    os.replace(temp_path, store_path)
+
+
+def _is_missing(store: Dict[str, Any], day: date, today: date) -> bool:
+    date_str = day.strftime(OPEN_METEO_DATE_FORMAT)
+    if date_str in store['records']:
+        return False
+    last_attempt = store['incomplete'].get(date_str)
+    if last_attempt is None:
+        return True
+    return (today - day).days <= INCOMPLETE_RETRY_DAYS and last_attempt < today.strftime(
+        OPEN_METEO_DATE_FORMAT)
+
+
+def _get_missing_dates(store: Dict[str, Any],
+                       first_date: date,
+                       last_date: date,
+                       today: date) -> List[date]:
+    missing_dates = []
+    current_date = first_date
+    while current_date <= last_date:
+        if _is_missing(store, current_date, today):
+            missing_dates.append(current_date)
+        current_date += timedelta(days=1)
+    return missing_dates
+
+
+def _append_records(store: Dict[str, Any], daily_info: Dict[str, List[Any]], today: date) -> None:
+    records = store['records']
+    incomplete = store['incomplete']
+    for i, date_str in enumerate(daily_info['time']):
+        if date_str in records:
+            continue
+        record = {field: daily_info[field][i] for field in RECORD_FIELDS}
+        if any(value is None for value in record.values()):
+            incomplete[date_str] = today.strftime(OPEN_METEO_DATE_FORMAT)
+            continue
+        incomplete.pop(date_str, None)
+        records[date_str] = record
+        _add_to_aggregates(store['aggregates'], record)
+
+
+def _trim_records(store: Dict[str, Any], first_date: date) -> None:
+    records = store['records']
+    first_date_str = first_date.strftime(OPEN_METEO_DATE_FORMAT)
+    for date_str in sorted(records):
+        if date_str >= first_date_str:
+            break
+        record = records.pop(date_str)
+        _remove_from_aggregates(store['aggregates'], record, records)
+    for date_str in [date_str for date_str in store['incomplete'] if date_str < first_date_str]:
+        del store['incomplete'][date_str]
+
+
+def update_history(latitude: float,  # pylint: disable=too-many-arguments
+                   longitude: float,
+                   timezone: str,
+                   history_days: int,
+                   today: Optional[date] = None,
+                   *,
+                   addon: Addon = ADDON) -> Dict[str, Any]:
+    """
+    Update the history store for a location and return its contents
+
+    :param history_days: retention period in days
+    :param today: the current date in the location timezone (optional)
+    :param addon: an addon instance to read settings from
+    :return: the history store: a dict with "records" keyed by date strings,
+        "aggregates" over those records and "incomplete" dates
+    """
+    history_days = min(history_days, MAX_HISTORY_DAYS)
+    if today is None:
+        today = datetime.now().date()
+    first_date = today - timedelta(days=history_days)
+    last_date = today - timedelta(days=1)
+    store_path = _get_store_path(latitude, longitude, timezone, addon)
+    HISTORY_DIR.mkdir(parents=True, exist_ok=True)
+    # The lock is held while missing days are fetched, so concurrent invocations
+    # neither fetch the same days nor overwrite each other's records
+    with file_lock(store_path.with_suffix('.lock')):
+        store = _load_store(store_path)
+        store.setdefault('incomplete', {})
+        is_changed = False
+        if missing_dates := _get_missing_dates(store, first_date, last_date, today):
+            logger.debug('Fetching weather history from %s to %s',
+                         missing_dates[0], missing_dates[-1])
+            history_info = get_daily_history(latitude, longitude, timezone,
+                                             missing_dates[0], missing_dates[-1], addon=addon)
+            _append_records(store, history_info['daily'], today)
+            is_changed = True
+        first_date_str = first_date.strftime(OPEN_METEO_DATE_FORMAT)
+        if ((store['records'] and min(store['records']) < first_date_str)
+                or (store['incomplete'] and min(store['incomplete']) < first_date_str)):
+            _trim_records(store, first_date)
+            is_changed = True
+        if is_changed:
+            _save_store(store_path, store)
+    return store
@@ -17,27 +17,47 @@ This module includes functions that are responsible for populating various weath
 properties of the Weather window (id=12600)
 """
 
+import json
 import logging
-from datetime import datetime, date
-from pprint import pformat
+import re
+from datetime import datetime, date, timedelta
 from typing import NamedTuple, Dict, List, Any, Optional
 
 import xbmc
+from xbmcaddon import Addon
 from xbmcgui import Window
 
-from libs.common.kodi_service import ADDON, BANNER, ADDON_NAME
+from libs.common.kodi_service import ADDON, BANNER, ADDON_NAME, PROFILE, log_payload
+from libs.common.metrics import span, timed
+from libs.astronomy import get_astronomy, get_tzinfo
 from libs.converter_service import (
     get_weather_condition_label,
     get_kodi_weather_code,
     get_wind_direction,
+    get_day_length,
+    get_moon_phase_label,
     get_temperature,
+    get_temperature_difference,
+    get_precipitation,
     get_wind_speed,
 )
-from libs.open_meteo_api import get_forecast, OPEN_METEO_DATE_TIME_FORMAT, OPEN_METEO_DATE_FORMAT
+from libs.forecast_snapshot import load_snapshot, write_current_location, write_snapshot
+from libs.open_meteo_api import (
+    get_weather_data,
+    OPEN_METEO_DATE_TIME_FORMAT,
+    OPEN_METEO_DATE_FORMAT,
+)
+from libs.request_governor import get_usage
+from libs.weather_history import update_history
 
 logger = logging.getLogger(__name__)
 
 WEATHER_WINDOW = Window(12600)
+SNAPSHOTS_DIR = PROFILE / 'snapshots'
+# Optional JSON file that maps window IDs to {"<property>": "<skin property>"} dicts
+WINDOW_PROPERTY_MAPPINGS_FILE = PROFILE / 'window_property_mappings.json'
+# Hourly and daily forecast properties that are also available as plugin directories
+LIST_PROPERTY_PATTERN = re.compile(r'^(Hourly|Daily)\.\d+\.')
 
 LONG_DATE_FORMAT = xbmc.getRegion('datelong')
 SHORT_DATE_FORMAT = xbmc.getRegion('dateshort')
@@ -48,11 +68,17 @@ SPEED_UNIT = xbmc.getRegion('speedunit')
 
 class LocationData(NamedTuple):
     name: str
-    longitude: float
     latitude: float
+    longitude: float
     timezone: str
 
 
+class PropertyTarget(NamedTuple):
+    window: Window
+    prefix: str
+    mapping: Optional[Dict[str, str]]
+
+
 class HourlyWeather(NamedTuple):
     time: datetime
     temperature_2m: int
@@ -90,8 +116,6 @@ class DailyWeather(NamedTuple):
     weather_code: int
     temperature_2m_max: int
     temperature_2m_min: int
-    sunrise: datetime
-    sunset: datetime
     precipitation_probability_mean: int
     wind_speed_10m_max: float
     wind_direction_10m_dominant: int
@@ -104,8 +128,6 @@ class DailyWeather(NamedTuple):
             weather_code=values['weather_code'],
             temperature_2m_max=round(values['temperature_2m_max']),
             temperature_2m_min=round(values['temperature_2m_min']),
-            sunrise=datetime.strptime(values['sunrise'], OPEN_METEO_DATE_TIME_FORMAT),
-            sunset=datetime.strptime(values['sunset'], OPEN_METEO_DATE_TIME_FORMAT),
             precipitation_probability_mean=values['precipitation_probability_mean'],
             wind_speed_10m_max=values['wind_speed_10m_max'],
             wind_direction_10m_dominant=values['wind_direction_10m_dominant'],
@@ -113,18 +135,20 @@ class DailyWeather(NamedTuple):
         )
 
 
-def _get_location_data(location_id: str) -> Optional[LocationData]:
-    name = ADDON.getSettingString(f'{location_id}_name')
-    latitude = ADDON.getSettingNumber(f'{location_id}_lat')
-    longitude = ADDON.getSettingNumber(f'{location_id}_lon')
-    timezone = ADDON.getSettingString(f'{location_id}_timezone')
+def get_location_data(location_id: str, addon: Addon = ADDON) -> Optional[LocationData]:
+    name = addon.getSettingString(f'{location_id}_name')
+    latitude = addon.getSettingNumber(f'{location_id}_lat')
+    longitude = addon.getSettingNumber(f'{location_id}_lon')
+    timezone = addon.getSettingString(f'{location_id}_timezone')
     location_data = LocationData(name, latitude, longitude, timezone)
     if not all(location_data):
         return None
     return location_data
 
 
-def _populate_current_weather(current_info: Dict[str, Any]) -> None:
+@timed('populate_current_weather')
+def _populate_current_weather(current_info: Dict[str, Any],
+                              window_properties: Dict[str, str]) -> None:
     open_meteo_weather_code = current_info['weather_code']
     is_day = bool(current_info['is_day'])
     kodi_weather_code = get_kodi_weather_code(open_meteo_weather_code, is_day)
@@ -138,21 +162,22 @@ def _populate_current_weather(current_info: Dict[str, Any]) -> None:
         'Current.OutlookIcon': f'{kodi_weather_code}.png',
         'Current.FanartCode': kodi_weather_code,
     }
-    logger.debug('Populating current weather:\n%s', pformat(window_properties_map))
-    for prop, value in window_properties_map.items():
-        WEATHER_WINDOW.setProperty(prop, value)
+    log_payload(logger, 'Populating current weather:\n%s', window_properties_map)
+    window_properties.update(window_properties_map)
 
 
-def _populate_hourly_weather(hourly_info: Dict[str, List[Any]]) -> None:
+@timed('populate_hourly_weather')
+def _populate_hourly_weather(hourly_info: Dict[str, List[Any]],
+                             window_properties: Dict[str, str]) -> None:
     keys = tuple(hourly_info.keys())
     first_hour = True
     for i, values in enumerate(zip(*hourly_info.values()), 1):
         hourly_weather = HourlyWeather.from_raw_values(**dict(zip(keys, values)))
         if first_hour:
-            WEATHER_WINDOW.setProperty('Current.DewPoint', str(hourly_weather.dew_point_2m))
-            WEATHER_WINDOW.setProperty('Current.Precipitation',
-                                       str(hourly_weather.precipitation_probability) + '%')
-            WEATHER_WINDOW.setProperty('Current.Cloudiness', str(hourly_weather.cloud_cover) + '%')
+            window_properties['Current.DewPoint'] = str(hourly_weather.dew_point_2m)
+            window_properties['Current.Precipitation'] = (
+                str(hourly_weather.precipitation_probability) + '%')
+            window_properties['Current.Cloudiness'] = str(hourly_weather.cloud_cover) + '%'
             first_hour = False
         hourly_prefix = f'Hourly.{i}'
         kodi_weather_code = get_kodi_weather_code(hourly_weather.weather_code,
@@ -176,20 +201,19 @@ def _populate_hourly_weather(hourly_info: Dict[str, List[Any]]) -> None:
             f'{hourly_prefix}.Pressure': str(hourly_weather.surface_pressure),
             f'{hourly_prefix}.Precipitation': str(hourly_weather.precipitation_probability) + '%',
         }
-        logger.debug('Setting hourly weather %s:\n%s', i, pformat(window_properties_map))
-        for prop, value in window_properties_map.items():
-            WEATHER_WINDOW.setProperty(prop, value)
+        log_payload(logger, 'Setting hourly weather %s:\n%s', i, window_properties_map)
+        window_properties.update(window_properties_map)
 
 
-def _populate_daily_weather(daily_info: Dict[str, List[Any]]) -> None:
+@timed('populate_daily_weather')
+def _populate_daily_weather(daily_info: Dict[str, List[Any]],
+                            window_properties: Dict[str, str]) -> None:
     keys = tuple(daily_info.keys())
     first_day = True
     for i, values in enumerate(zip(*daily_info.values()), 1):
         daily_weather = DailyWeather.from_raw_values(**dict(zip(keys, values)))
         if first_day:
-            WEATHER_WINDOW.setProperty('Today.Sunrise', daily_weather.sunrise.strftime(TIME_FORMAT))
-            WEATHER_WINDOW.setProperty('Today.Sunset', daily_weather.sunset.strftime(TIME_FORMAT))
-            WEATHER_WINDOW.setProperty('Current.UVIndex', str(daily_weather.uv_index_max))
+            window_properties['Current.UVIndex'] = str(daily_weather.uv_index_max)
             first_day = False
         daily_prefix = f'Daily.{i}'
         kodi_weather_code = get_kodi_weather_code(daily_weather.weather_code, is_day=True)
@@ -222,38 +246,371 @@ def _populate_daily_weather(daily_info: Dict[str, List[Any]]) -> None:
                 f'{day_prefix}.HighTemp': window_properties_map[f'{daily_prefix}.HighTemperature'],
                 f'{day_prefix}.LowTemp': window_properties_map[f'{daily_prefix}.LowTemperature'],
             })
-        logger.debug('Setting daily weather %s:\n%s', i, pformat(window_properties_map))
-        for prop, value in window_properties_map.items():
-            WEATHER_WINDOW.setProperty(prop, value)
+        log_payload(logger, 'Setting daily weather %s:\n%s', i, window_properties_map)
+        window_properties.update(window_properties_map)
+
+
+def _format_air_quality_value(value: Optional[float]) -> str:
+    # Pollen data are available only for Europe during pollen season
+    if value is None:
+        return ''
+    return str(round(value))
+
+
+AIR_QUALITY_PROPERTIES_MAP = {
+    'european_aqi': 'AirQuality.EuropeanAQI',
+    'us_aqi': 'AirQuality.USAQI',
+    'pm2_5': 'AirQuality.PM25',
+    'pm10': 'AirQuality.PM10',
+    'alder_pollen': 'Pollen.Alder',
+    'birch_pollen': 'Pollen.Birch',
+    'grass_pollen': 'Pollen.Grass',
+    'mugwort_pollen': 'Pollen.Mugwort',
+    'olive_pollen': 'Pollen.Olive',
+    'ragweed_pollen': 'Pollen.Ragweed',
+}
+
+
+@timed('populate_air_quality')
+def _populate_air_quality(air_quality_info: Optional[Dict[str, Any]],
+                          window_properties: Dict[str, str]) -> None:
+    if air_quality_info is None:
+        window_properties['AirQuality.IsFetched'] = ''
+        return
+    window_properties_map = {}
+    for key, value in air_quality_info['current'].items():
+        if (prop := AIR_QUALITY_PROPERTIES_MAP.get(key)) is not None:
+            window_properties_map[f'Current.{prop}'] = _format_air_quality_value(value)
+    hourly_info = air_quality_info['hourly']
+    for key, values in hourly_info.items():
+        if (prop := AIR_QUALITY_PROPERTIES_MAP.get(key)) is None:
+            continue
+        for i, value in enumerate(values, 1):
+            window_properties_map[f'Hourly.{i}.{prop}'] = _format_air_quality_value(value)
+    window_properties_map['AirQuality.IsFetched'] = 'true'
+    log_payload(logger, 'Populating air quality:\n%s', window_properties_map)
+    window_properties.update(window_properties_map)
+
+
+def _format_event_time(event_time: Optional[str]) -> str:
+    # Sun events do not happen during polar day or night
+    if event_time is None:
+        return ''
+    return datetime.strptime(event_time, OPEN_METEO_DATE_TIME_FORMAT).strftime(TIME_FORMAT)
+
+
+@timed('populate_astronomy')
+def _populate_astronomy(astronomy_info: Dict[str, List[Any]],
+                        window_properties: Dict[str, str]) -> None:
+    window_properties_map = {}
+    for i, (sunrise, sunset, day_length, moon_phase, moon_illumination) in enumerate(zip(
+            astronomy_info['sunrise'], astronomy_info['sunset'], astronomy_info['day_length'],
+            astronomy_info['moon_phase'], astronomy_info['moon_illumination']), 1):
+        daily_prefix = f'Daily.{i}'
+        window_properties_map.update({
+            f'{daily_prefix}.Sunrise': _format_event_time(sunrise),
+            f'{daily_prefix}.Sunset': _format_event_time(sunset),
+            f'{daily_prefix}.DayLength': get_day_length(day_length),
+            f'{daily_prefix}.MoonPhase': get_moon_phase_label(moon_phase),
+            f'{daily_prefix}.MoonIllumination': f'{round(moon_illumination * 100)}%',
+        })
+    window_properties_map.update({
+        'Today.Sunrise': window_properties_map['Daily.1.Sunrise'],
+        'Today.Sunset': window_properties_map['Daily.1.Sunset'],
+        'Today.DayLength': window_properties_map['Daily.1.DayLength'],
+        'Today.GoldenHourMorningEnd': _format_event_time(
+            astronomy_info['golden_hour_morning_end'][0]),
+        'Today.GoldenHourEveningStart': _format_event_time(
+            astronomy_info['golden_hour_evening_start'][0]),
+        'Today.MoonPhase': window_properties_map['Daily.1.MoonPhase'],
+        'Today.MoonIllumination': window_properties_map['Daily.1.MoonIllumination'],
+    })
+    log_payload(logger, 'Populating astronomy data:\n%s', window_properties_map)
+    window_properties.update(window_properties_map)
+
+
+def _format_confidence(confidence: Optional[float]) -> str:
+    if confidence is None:
+        return ''
+    return f'{round(confidence * 100)}%'
+
+
+def _format_temperature_spread(spread: Optional[float]) -> str:
+    if spread is None:
+        return ''
+    return get_temperature_difference(spread, TEMPERATURE_UNIT).lstrip('+')
+
+
+@timed('populate_forecast_confidence')
+def _populate_forecast_confidence(forecast_info: Dict[str, Any],
+                                  window_properties: Dict[str, str]) -> None:
+    hourly_info = forecast_info['hourly']
+    daily_info = forecast_info['daily']
+    if 'confidence' not in hourly_info or 'confidence' not in daily_info:
+        window_properties['Forecast.IsEnsemble'] = ''
+        return
+    window_properties_map = {
+        'Forecast.IsEnsemble': 'true',
+        'Current.Confidence': _format_confidence(hourly_info['confidence'][0]),
+    }
+    for i, (confidence, spread) in enumerate(
+            zip(hourly_info['confidence'], hourly_info['temperature_2m_spread']), 1):
+        window_properties_map[f'Hourly.{i}.Confidence'] = _format_confidence(confidence)
+        window_properties_map[f'Hourly.{i}.TemperatureSpread'] = _format_temperature_spread(
+            spread)
+    for i, (confidence, spread) in enumerate(
+            zip(daily_info['confidence'], daily_info['temperature_2m_max_spread']), 1):
+        window_properties_map[f'Daily.{i}.Confidence'] = _format_confidence(confidence)
+        window_properties_map[f'Daily.{i}.TemperatureSpread'] = _format_temperature_spread(
+            spread)
+    log_payload(logger, 'Populating forecast confidence:\n%s', window_properties_map)
+    window_properties.update(window_properties_map)
+
 
+@timed('populate_history')
+def _populate_history(location_data: LocationData,
+                      today_info: Dict[str, Any],
+                      window_properties: Dict[str, str],
+                      addon: Addon) -> None:
+    today = datetime.strptime(today_info['time'], OPEN_METEO_DATE_FORMAT).date()
+    try:
+        history = update_history(*location_data[1:],
+                                 history_days=addon.getSettingInt('history_days'),
+                                 today=today,
+                                 addon=addon)
+    except Exception as exc:  # pylint: disable=broad-except
+        # History is supplementary, so it must not prevent showing the forecast
+        logger.error('Unable to update weather history: %s', exc)
+        window_properties['History.IsFetched'] = ''
+        return
+    records = history['records']
+    aggregates = history['aggregates']
+    if not records:
+        window_properties['History.IsFetched'] = ''
+        return
+    count = aggregates['count']
+    window_properties_map = {
+        'History.Days': str(count),
+        'History.MeanHighTemperature': get_temperature(
+            round(aggregates['sum_temperature_2m_max'] / count), TEMPERATURE_UNIT),
+        'History.MeanLowTemperature': get_temperature(
+            round(aggregates['sum_temperature_2m_min'] / count), TEMPERATURE_UNIT),
+        'History.MaxTemperature': get_temperature(
+            round(aggregates['max_temperature_2m_max']), TEMPERATURE_UNIT),
+        'History.MinTemperature': get_temperature(
+            round(aggregates['min_temperature_2m_min']), TEMPERATURE_UNIT),
+        'History.TotalPrecipitation': get_precipitation(aggregates['sum_precipitation_sum']),
+        'History.IsFetched': 'true',
+    }
+    yesterday = records.get((today - timedelta(days=1)).strftime(OPEN_METEO_DATE_FORMAT))
+    if yesterday is not None:
+        window_properties_map.update({
+            'History.Yesterday.HighTemperature': get_temperature(
+                round(yesterday['temperature_2m_max']), TEMPERATURE_UNIT),
+            'History.Yesterday.LowTemperature': get_temperature(
+                round(yesterday['temperature_2m_min']), TEMPERATURE_UNIT),
+            'History.Yesterday.Precipitation': get_precipitation(yesterday['precipitation_sum']),
+            'History.TemperatureChange': get_temperature_difference(
+                today_info['temperature_2m_max'] - yesterday['temperature_2m_max'],
+                TEMPERATURE_UNIT),
+        })
+    log_payload(logger, 'Populating weather history:\n%s', window_properties_map)
+    window_properties.update(window_properties_map)
 
-def _populate_general_properties(location_name: str) -> None:
-    WEATHER_WINDOW.setProperty('Location', location_name)
-    WEATHER_WINDOW.setProperty('Current.Location', location_name)
-    WEATHER_WINDOW.setProperty('WeatherProvider', ADDON_NAME)
-    WEATHER_WINDOW.setProperty('WeatherProviderLogo', str(BANNER))
+
+@timed('populate_general_properties')
+def _populate_general_properties(location_name: str,
+                                 window_properties: Dict[str, str],
+                                 addon: Addon = ADDON) -> None:
+    window_properties['Location'] = location_name
+    window_properties['Current.Location'] = location_name
+    window_properties['WeatherProvider'] = ADDON_NAME
+    window_properties['WeatherProviderLogo'] = str(BANNER)
     is_fetched = 'true' if location_name else ''
-    WEATHER_WINDOW.setProperty('Weather.IsFetched', is_fetched)
-    WEATHER_WINDOW.setProperty('Current.IsFetched', is_fetched)
-    WEATHER_WINDOW.setProperty('Hourly.IsFetched', is_fetched)
-    WEATHER_WINDOW.setProperty('Daily.IsFetched', is_fetched)
+    window_properties['Weather.IsFetched'] = is_fetched
+    window_properties['Current.IsFetched'] = is_fetched
+    window_properties['Hourly.IsFetched'] = is_fetched
+    window_properties['Daily.IsFetched'] = is_fetched
     locations = 0
     for i in range(1, 4):
-        location_name = ADDON.getSettingString(f'location{i}_name')
+        location_name = addon.getSettingString(f'location{i}_name')
         if location_name:
             locations += 1
-        WEATHER_WINDOW.setProperty(f'Location{i}', location_name)
-    WEATHER_WINDOW.setProperty('Locations', str(locations))
+        window_properties[f'Location{i}'] = location_name
+    window_properties['Locations'] = str(locations)
+    request_usage = get_usage()
+    logger.debug('Open-Meteo request usage: %s', request_usage)
+    window_properties['OpenMeteo.RequestsToday'] = str(request_usage['today'])
+    window_properties['OpenMeteo.RequestsThisHour'] = str(request_usage['this_hour'])
+    window_properties['OpenMeteo.RequestsRemainingToday'] = str(request_usage['remaining_today'])
+
+
+def _load_window_property_mappings() -> Dict[str, Dict[str, str]]:
+    try:
+        with WINDOW_PROPERTY_MAPPINGS_FILE.open('r', encoding='utf-8') as fo:
+            return json.load(fo)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as exc:
+        logger.error('Unable to load window property mappings: %s', exc)
+        return {}
+
+
+def _get_property_targets() -> List[PropertyTarget]:
+    """
+    Get windows that receive weather properties
+
+    Besides the Weather window, properties are written to windows from
+    the "extra_window_ids" setting with the "extra_window_prefix" prefix,
+    and to windows from the mappings file with skin-specific names.
+    Only mapped properties are written to windows from the mappings file.
+    """
+    targets = [PropertyTarget(WEATHER_WINDOW, '', None)]
+    prefix = ADDON.getSettingString('extra_window_prefix')
+    window_ids = [window_id.strip()
+                  for window_id in ADDON.getSettingString('extra_window_ids').split(',')
+                  if window_id.strip()]
+    mappings = _load_window_property_mappings()
+    for window_id in dict.fromkeys(window_ids + list(mappings)):
+        try:
+            window = Window(int(window_id))
+        except (ValueError, RuntimeError):
+            logger.error('Invalid window ID: %s', window_id)
+            continue
+        targets.append(PropertyTarget(window, prefix, mappings.get(window_id)))
+    return targets
+
+
+def _set_window_properties(window_properties: Dict[str, str]) -> None:
+    targets = _get_property_targets()
+    with span('set_property'):
+        for prop, value in window_properties.items():
+            for target in targets:
+                if target.mapping is None:
+                    target.window.setProperty(target.prefix + prop, value)
+                elif (mapped_prop := target.mapping.get(prop)) is not None:
+                    target.window.setProperty(mapped_prop, value)
+
+
+def _get_weather_properties(location_data: LocationData,
+                            addon: Addon = ADDON) -> Dict[str, str]:
+    """
+    Get weather properties for a location
+
+    :param addon: an addon instance to read settings from. The background service
+        passes a new instance because an existing one keeps old settings.
+    """
+    forecast_info, air_quality_info = get_weather_data(
+        *location_data[1:],
+        with_air_quality=addon.getSettingBool('enable_air_quality'),
+        models=addon.getSettingString('ensemble_models').strip(),
+        addon=addon
+    )
+    window_properties = {}
+    _populate_current_weather(forecast_info['current'], window_properties)
+    _populate_hourly_weather(forecast_info['hourly'], window_properties)
+    _populate_daily_weather(forecast_info['daily'], window_properties)
+    tz = get_tzinfo(location_data.timezone, forecast_info.get('utc_offset_seconds', 0))
+    astronomy_info = get_astronomy(location_data.latitude, location_data.longitude, tz,
+                                   start_date=forecast_info['daily']['time'][0],
+                                   days=len(forecast_info['daily']['time']))
+    _populate_astronomy(astronomy_info, window_properties)
+    _populate_air_quality(air_quality_info, window_properties)
+    _populate_forecast_confidence(forecast_info, window_properties)
+    if addon.getSettingBool('enable_history'):
+        daily_info = forecast_info['daily']
+        today_info = {key: values[0] for key, values in daily_info.items()}
+        _populate_history(location_data, today_info, window_properties, addon)
+    _populate_general_properties(location_data.name, window_properties, addon)
+    return window_properties
+
+
+def _trim_list_properties(window_properties: Dict[str, str]) -> Dict[str, str]:
+    """
+    Remove numbered hourly and daily properties if the respective setting is enabled
+
+    Skins can get hourly and daily forecasts from plugin directories instead.
+    """
+    if not ADDON.getSettingBool('trim_list_properties'):
+        return window_properties
+    return {prop: value for prop, value in window_properties.items()
+            if LIST_PROPERTY_PATTERN.match(prop) is None}
+
+
+def _replay_last_snapshot(location_id: str, location_data: LocationData) -> Dict[str, str]:
+    """
+    Set weather properties from the last snapshot for a location
+
+    This shows the last known weather immediately, before data are fetched
+    and converted. A snapshot for other location settings, e.g. if the location
+    has been changed but its data have not been pre-fetched, is not used.
+    If the Weather window already shows the location, properties are not set again.
+
+    :return: the last snapshot properties that are shown in the window
+    """
+    snapshot = load_snapshot(SNAPSHOTS_DIR / f'{location_id}.json')
+    if snapshot is None:
+        return {}
+    if (snapshot['location'], snapshot.get('latitude'), snapshot.get('longitude'),
+            snapshot.get('timezone')) != tuple(location_data):
+        logger.debug('The last snapshot for %s is for another location: %s',
+                     location_id, snapshot['location'])
+        return {}
+    replayed_properties = _trim_list_properties(snapshot['properties'])
+    if WEATHER_WINDOW.getProperty('Current.Location') != location_data.name:
+        _set_window_properties(replayed_properties)
+    return replayed_properties
+
+
+def _get_changed_properties(previous_properties: Dict[str, str],
+                            window_properties: Dict[str, str]) -> Dict[str, str]:
+    changed_properties = {prop: value for prop, value in window_properties.items()
+                          if previous_properties.get(prop) != value}
+    # Clear properties that are not present anymore, e.g. when air quality is disabled
+    for prop in previous_properties.keys() - window_properties.keys():
+        changed_properties[prop] = ''
+    logger.debug('%d of %d weather properties have changed since the last snapshot',
+                 len(changed_properties), len(window_properties))
+    return changed_properties
 
 
 def populate_weather_info_for_location(location_id: str) -> None:
-    location_data = _get_location_data(location_id)
+    with span('settings'):
+        location_data = get_location_data(location_id)
     if location_data is None:
         logger.error('Location %s is not set', location_id)
-        _populate_general_properties('')
+        window_properties = {}
+        _populate_general_properties('', window_properties)
+        _set_window_properties(window_properties)
         return
-    forecast_info = get_forecast(*location_data[1:])
-    _populate_current_weather(forecast_info['current'])
-    _populate_hourly_weather(forecast_info['hourly'])
-    _populate_daily_weather(forecast_info['daily'])
-    _populate_general_properties(location_data.name)
+    with span('first_paint'):
+        previous_properties = _replay_last_snapshot(location_id, location_data)
+    window_properties = _get_weather_properties(location_data)
+    trimmed_properties = _trim_list_properties(window_properties)
+    changed_properties = _get_changed_properties(previous_properties, trimmed_properties)
+    if len(trimmed_properties) < len(window_properties) and WEATHER_WINDOW.getProperty(
+            'Hourly.1.Time'):
+        # Clear list properties that were set before trimming was enabled
+        changed_properties.update({prop: '' for prop in window_properties
+                                   if prop not in trimmed_properties})
+    _set_window_properties(changed_properties)
+    with span('snapshot'):
+        write_snapshot(SNAPSHOTS_DIR, location_id, location_data.name, window_properties,
+                       location_data[1:])
+        write_current_location(SNAPSHOTS_DIR, location_id)
+
+
+def prepare_weather_info_for_location(location_id: str,
+                                      location_data: LocationData,
+                                      addon: Addon) -> None:
+    """
+    Pre-fetch weather data and publish a snapshot for a location
+    without updating the Weather window
+
+    :param location_id: location ID, e.g. "location1"
+    :param location_data: location data read from the current addon settings
+    :param addon: an addon instance with the current settings
+    """
+    window_properties = _get_weather_properties(location_data, addon)
+    write_snapshot(SNAPSHOTS_DIR, location_id, location_data.name, window_properties,
+                   location_data[1:])
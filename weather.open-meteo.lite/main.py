@@ -14,11 +14,13 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
-from libs.actions import main
+from libs.actions import main, profile_invocation
 from libs.common.exception_logger import catch_exception
-from libs.common.kodi_service import initialize_logging
+from libs.common.kodi_service import ADDON, initialize_logging
 
 initialize_logging()
 if __name__ == '__main__':
-    with catch_exception():
-        main()
+    with profile_invocation():
+        with catch_exception(
+                full_diagnostics=ADDON.getSettingBool('full_exception_diagnostics')):
+            main()